@@ -0,0 +1,223 @@
+"""
+Компактные кодировки ответов: быстрый JSON (orjson), MessagePack и
+сжатие gzip/brotli по Accept-Encoding. Общий модуль для приложений
+проекта (chat_history, doctors), сами приложения друг от друга не зависят.
+
+Включается для отдельных представлений:
+
+    @api_view(['GET'])
+    @compact_encoding
+    def view(request): ...
+
+    class View(CompactEncodingMixin, generics.RetrieveAPIView): ...
+
+Формат ответа выбирается обычным согласованием DRF: Accept:
+application/msgpack (или ?format=msgpack) - MessagePack, иначе JSON.
+orjson, msgpack и brotli - необязательные зависимости: без orjson
+используется стандартный JSONRenderer, без msgpack формат не предлагается,
+без brotli ответы сжимаются только gzip. Настройки (прежнее имя
+CHAT_HISTORY_RESPONSE_ENCODING тоже читается):
+
+    API_RESPONSE_ENCODING = {
+        'compress': True,
+        'min_size': 1024,        # байт, меньшие ответы не сжимаются
+        'gzip_level': 6,
+        'brotli_quality': 5,     # 0-11, выше 6 заметно дороже по CPU
+    }
+
+Потоковые ответы (SSE, экспорт) не сжимаются.
+"""
+import functools
+import gzip
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # orjson - необязательная зависимость
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack - необязательная зависимость
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # brotli - необязательная зависимость
+    brotli = None
+
+
+DEFAULTS = {'compress': True, 'min_size': 1024, 'gzip_level': 6, 'brotli_quality': 5}
+
+# Типы, которых нет в JSON, кодируются так же, как в JSONRenderer
+_encode_default = JSONEncoder().default
+
+
+def get_options():
+    options = dict(DEFAULTS)
+    options.update(
+        getattr(settings, 'API_RESPONSE_ENCODING', None) or
+        getattr(settings, 'CHAT_HISTORY_RESPONSE_ENCODING', None) or {}
+    )
+    return options
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson. Даты и время форматируются кодировщиком DRF,
+    U+2028/U+2029 экранируются, как в JSONRenderer, поэтому вывод совпадает
+    с ним. Исключения: NaN и Infinity становятся null, а не ошибкой. Для
+    indent, UNICODE_JSON = False и COMPACT_JSON = False используется
+    JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (orjson is None or self.ensure_ascii or not self.compact or
+                self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+        content = orjson.dumps(
+            data, default=_encode_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+        # Допустимы в JSON, но не в JavaScript - JSONRenderer их экранирует
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class ORJSONParser(JSONParser):
+    """JSONParser на orjson"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack для клиентов с Accept: application/msgpack"""
+
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_encode_default, use_bin_type=True)
+
+
+def _without_json(classes):
+    return [cls for cls in classes if not issubclass(cls, (JSONRenderer, JSONParser))]
+
+
+RENDERER_CLASSES = (
+    [ORJSONRenderer] + ([MessagePackRenderer] if msgpack is not None else []) +
+    _without_json(api_settings.DEFAULT_RENDERER_CLASSES)
+)
+PARSER_CLASSES = [ORJSONParser] + _without_json(api_settings.DEFAULT_PARSER_CLASSES)
+
+
+def _gzip(data, options):
+    return gzip.compress(data, compresslevel=options['gzip_level'], mtime=0)
+
+
+def _brotli(data, options):
+    return brotli.compress(data, quality=options['brotli_quality'])
+
+
+# В порядке предпочтения сервера
+CODECS = [('br', _brotli), ('gzip', _gzip)] if brotli is not None else [('gzip', _gzip)]
+
+
+def choose_encoding(header):
+    """Лучшее доступное сжатие из заголовка Accept-Encoding или None"""
+    accepted = {}
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for name, _ in CODECS:
+        if accepted.get(name, accepted.get('*', 0.0)) > 0:
+            return name
+    return None
+
+
+def compress_response(request, response):
+    """Сжимает готовый ответ, если клиент это поддерживает и выигрыш есть"""
+    options = get_options()
+    if (not options['compress'] or getattr(response, 'streaming', False) or
+            response.has_header('Content-Encoding')):
+        return response
+    content = response.content
+    if len(content) < options['min_size']:
+        return response
+
+    patch_vary_headers(response, ('Accept-Encoding',))
+    encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if encoding is None:
+        return response
+    compressed = dict(CODECS)[encoding](content, options)
+    if len(compressed) >= len(content):
+        return response
+
+    response.content = compressed
+    response['Content-Length'] = str(len(compressed))
+    response['Content-Encoding'] = encoding
+    # Сжатое тело отличается побайтно - ETag становится слабым, как в GZipMiddleware
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+    return response
+
+
+def attach_compression(request, response):
+    """Сжатие после рендеринга ответа DRF (или сразу для обычного HttpResponse)"""
+    # Формат зависит от Accept, кэшам нужен Vary
+    patch_vary_headers(response, ('Accept',))
+    if hasattr(response, 'add_post_render_callback') and not response.is_rendered:
+        response.add_post_render_callback(lambda rendered: compress_response(request, rendered))
+        return response
+    return compress_response(request, response)
+
+
+def compact_encoding(view):
+    """
+    Декоратор функции-представления DRF (ставится под @api_view):
+    рендереры и парсеры orjson/msgpack и сжатие ответа.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        return attach_compression(request, view(request, *args, **kwargs))
+    wrapper.renderer_classes = RENDERER_CLASSES
+    wrapper.parser_classes = PARSER_CLASSES
+    return wrapper
+
+
+class CompactEncodingMixin:
+    """То же, что compact_encoding, для представлений-классов"""
+
+    renderer_classes = RENDERER_CLASSES
+    parser_classes = PARSER_CLASSES
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        return attach_compression(request, response)
@@ -1,18 +1,189 @@
+import calendar
+import datetime
+import uuid
+from collections import Counter, defaultdict
+
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.utils import formats, timezone
 from django.utils.html import format_html
-from .models import ChatSession, ChatMessage, ChatAnalytics
+from . import histograms, search
+from .models import ChatSession, ChatMessage, ChatAnalytics, ChatResponseTimeBucket
+from .pagination import EstimatedCountPaginator
+
+
+ADMIN_DEFAULTS = {'large_tables': False, 'exact_count_limit': 100000}
+
+
+def get_options():
+    options = dict(ADMIN_DEFAULTS)
+    options.update(getattr(settings, 'CHAT_HISTORY_ADMIN', None) or {})
+    return options
+
+
+def large_tables():
+    return get_options()['large_tables']
+
+
+class DateDrillDownFilter(admin.SimpleListFilter):
+    """
+    Переход по годам, месяцам и дням вместо date_hierarchy: варианты
+    строятся от первой и последней даты (два поиска по индексу), а не
+    DISTINCT по всей таблице, выбор фильтрует диапазоном дат.
+    """
+    title = 'Дата (по периодам)'
+    parameter_name = 'period'
+
+    def __init__(self, request, params, model, model_admin):
+        self.field_name = model_admin.drilldown_field
+        super().__init__(request, params, model, model_admin)
+
+    @staticmethod
+    def parse(value):
+        """(год, месяц, день) из 'ГГГГ', 'ГГГГ-ММ' или 'ГГГГ-ММ-ДД'; ValueError"""
+        parts = [int(part) for part in value.split('-')]
+        if not 1 <= len(parts) <= 3:
+            raise ValueError(f'Некорректный период: {value!r}')
+        year, month, day = parts + [None] * (3 - len(parts))
+        datetime.date(year, month or 1, day or 1)
+        return year, month, day
+
+    def bounds(self, model):
+        dates = model._default_manager.values_list(self.field_name, flat=True)
+        first = dates.order_by(self.field_name).first()
+        last = dates.order_by(f'-{self.field_name}').first()
+        if first is None or last is None:
+            return None, None
+        if timezone.is_aware(first):
+            first, last = timezone.localtime(first), timezone.localtime(last)
+        return first.date(), last.date()
+
+    def lookups(self, request, model_admin):
+        first, last = self.bounds(model_admin.model)
+        if first is None:
+            return []
+        try:
+            year, month, _ = self.parse(self.value()) if self.value() else (None, None, None)
+        except ValueError:
+            year = month = None
+        if year is None:
+            return [(str(y), str(y)) for y in range(last.year, first.year - 1, -1)]
+
+        choices = [(str(year), str(year))]
+        for m in range(1, 13):
+            start = datetime.date(year, m, 1)
+            if (year, m) < (first.year, first.month) or (year, m) > (last.year, last.month):
+                continue
+            if month is None:
+                choices.append((f'{year}-{m:02d}', formats.date_format(start, 'YEAR_MONTH_FORMAT')))
+            elif m == month:
+                choices.append((f'{year}-{m:02d}', formats.date_format(start, 'YEAR_MONTH_FORMAT')))
+                for d in range(1, calendar.monthrange(year, m)[1] + 1):
+                    day = datetime.date(year, m, d)
+                    if first <= day <= last:
+                        choices.append((f'{year}-{m:02d}-{d:02d}', formats.date_format(day, 'SHORT_DATE_FORMAT')))
+        return choices
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            year, month, day = self.parse(self.value())
+        except ValueError as e:
+            raise IncorrectLookupParameters(e)
+        start = datetime.date(year, month or 1, day or 1)
+        if day:
+            end = start + datetime.timedelta(days=1)
+        elif month:
+            end = (start + datetime.timedelta(days=31)).replace(day=1)
+        else:
+            end = start.replace(year=year + 1)
+        start, end = datetime.datetime.combine(start, datetime.time()), datetime.datetime.combine(end, datetime.time())
+        if settings.USE_TZ:
+            start, end = timezone.make_aware(start), timezone.make_aware(end)
+        return queryset.filter(**{f'{self.field_name}__gte': start, f'{self.field_name}__lt': end})
+
+
+class LargeTableAdminMixin:
+    """
+    Режим больших таблиц для админки истории чатов:
+
+        CHAT_HISTORY_ADMIN = {
+            'large_tables': True,
+            'exact_count_limit': 100000,  # до скольких строк считать точно
+        }
+
+    * число строк - EstimatedCountPaginator, без второго COUNT(*) для
+      "показать все";
+    * поиск - по полнотекстовому индексу (search) и точным совпадениям
+      search_exact вместо icontains; без индекса - обычный поиск;
+    * переход по датам - DateDrillDownFilter вместо date_hierarchy;
+    * сортировка по индексу (created_at, id).
+    """
+    drilldown_field = 'created_at'
+
+    @property
+    def date_hierarchy(self):
+        return None if large_tables() else self.drilldown_field
+
+    @property
+    def show_full_result_count(self):
+        return not large_tables()
+
+    def get_ordering(self, request):
+        if large_tables():
+            return [f'-{self.drilldown_field}', '-id']
+        return super().get_ordering(request)
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if large_tables():
+            return [*list_filter, DateDrillDownFilter]
+        return list_filter
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if not large_tables():
+            return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+        paginator = EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        paginator.exact_limit = get_options()['exact_count_limit']
+        return paginator
+
+    def search_exact(self, term):
+        """Дополнительные условия поиска по индексируемым полям или None"""
+        return None
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        condition = search.match(queryset.model, term) if large_tables() and term else None
+        if condition is None:
+            return super().get_search_results(request, queryset, search_term)
+        exact = self.search_exact(term)
+        if exact is not None:
+            condition |= exact
+        return queryset.filter(condition), False
+
+
+def _parse_uuid(value):
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        return None
 
 
 @admin.register(ChatSession)
-class ChatSessionAdmin(admin.ModelAdmin):
+class ChatSessionAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = [
         'title_short', 'user_name', 'total_messages', 
         'total_tokens_used', 'is_active', 'created_at'
     ]
     list_filter = ['is_active', 'created_at', 'updated_at']
+    list_select_related = ['user']
     search_fields = ['title', 'user__username', 'user__email', 'last_message_preview']
     readonly_fields = ['id', 'created_at', 'updated_at', 'total_messages']
-    date_hierarchy = 'created_at'
     
     fieldsets = (
         ('Основная информация', {
@@ -34,18 +205,24 @@ class ChatSessionAdmin(admin.ModelAdmin):
     def user_name(self, obj):
         return obj.user.get_full_name() if hasattr(obj.user, 'get_full_name') else obj.user.username
     user_name.short_description = 'Пользователь'
+    
+    def search_exact(self, term):
+        User = get_user_model()
+        condition = Q(user__in=User._default_manager.filter(**{User.USERNAME_FIELD: term}))
+        session_id = _parse_uuid(term)
+        return condition | Q(pk=session_id) if session_id else condition
 
 
 @admin.register(ChatMessage)
-class ChatMessageAdmin(admin.ModelAdmin):
+class ChatMessageAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = [
         'session_title', 'role', 'content_short', 
         'tokens_used', 'is_error', 'is_fallback', 'created_at'
     ]
     list_filter = ['role', 'is_error', 'is_fallback', 'created_at']
+    list_select_related = ['session']
     search_fields = ['content', 'session__title', 'session__user__username']
     readonly_fields = ['id', 'created_at']
-    date_hierarchy = 'created_at'
     
     fieldsets = (
         ('Основная информация', {
@@ -64,16 +241,54 @@ class ChatMessageAdmin(admin.ModelAdmin):
         return obj.session.title[:30] + ('...' if len(obj.session.title) > 30 else '')
     session_title.short_description = 'Сессия'
     
+    def search_exact(self, term):
+        User = get_user_model()
+        condition = Q(session__in=ChatSession.objects.filter(
+            user__in=User._default_manager.filter(**{User.USERNAME_FIELD: term})
+        ))
+        object_id = _parse_uuid(term)
+        return condition | Q(pk=object_id) | Q(session=object_id) if object_id else condition
+    
     def content_short(self, obj):
         return obj.content[:100] + ('...' if len(obj.content) > 100 else '')
     content_short.short_description = 'Содержимое'
+    
+    def get_changelist(self, request, **kwargs):
+        return ChatMessageChangeList
+
+
+class ChatMessageChangeList(ChangeList):
+    """Список сообщений без metadata: документ не загружается и не распаковывается"""
+    
+    def get_queryset(self, request, exclude_parameters=None):
+        return super().get_queryset(request, exclude_parameters).defer('metadata')
+
+
+class ChatAnalyticsChangeList(ChangeList):
+    """Загружает гистограммы времени ответа для всей страницы одним запросом"""
+    
+    def get_results(self, request):
+        super().get_results(request)
+        rows = list(self.result_list)
+        if not rows:
+            return
+        
+        buckets = defaultdict(Counter)
+        for user_id, date, bucket, count in ChatResponseTimeBucket.objects.filter(
+            user_id__in={row.user_id for row in rows},
+            date__in={row.date for row in rows}
+        ).values_list('user_id', 'date', 'bucket', 'count'):
+            buckets[(user_id, date)][bucket] += count
+        
+        for row in rows:
+            row.latency_percentiles = histograms.percentiles(buckets[(row.user_id, row.date)])
 
 
 @admin.register(ChatAnalytics)
 class ChatAnalyticsAdmin(admin.ModelAdmin):
     list_display = [
         'user', 'date', 'total_sessions', 'total_messages', 
-        'total_tokens', 'error_rate'
+        'total_tokens', 'error_rate', 'latency_p50', 'latency_p95', 'latency_p99'
     ]
     list_filter = ['date']
     search_fields = ['user__username', 'user__email']
@@ -84,8 +299,27 @@ class ChatAnalyticsAdmin(admin.ModelAdmin):
             rate = (obj.error_messages / obj.total_messages) * 100
             color = 'red' if rate > 10 else 'orange' if rate > 5 else 'green'
             return format_html(
-                '<span style="color: {};">{:.1f}%</span>',
-                color, rate
+                '<span style="color: {};">{}%</span>',
+                color, f'{rate:.1f}'
             )
         return '0%'
     error_rate.short_description = 'Процент ошибок'
+    
+    def get_changelist(self, request, **kwargs):
+        return ChatAnalyticsChangeList
+    
+    def _latency(self, obj, point):
+        value = getattr(obj, 'latency_percentiles', {}).get(point)
+        return f'{value} мс' if value is not None else '-'
+    
+    def latency_p50(self, obj):
+        return self._latency(obj, 50)
+    latency_p50.short_description = 'p50'
+    
+    def latency_p95(self, obj):
+        return self._latency(obj, 95)
+    latency_p95.short_description = 'p95'
+    
+    def latency_p99(self, obj):
+        return self._latency(obj, 99)
+    latency_p99.short_description = 'p99'
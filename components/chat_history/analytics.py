@@ -0,0 +1,126 @@
+"""
+Пересчет дневных агрегатов ChatAnalytics и гистограмм времени ответа
+по истории сообщений.
+
+В обычной работе агрегаты обновляются инкрементально при записи
+(ChatSession.register_messages, ChatSession.save). Здесь - полный пересчет
+диапазона дат порциями, для первичного заполнения и исправления расхождений.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import histograms
+from .models import ChatAnalytics, ChatMessage, ChatResponseTimeBucket, ChatSession
+
+
+MESSAGE_AGGREGATES = {
+    'total_messages': Count('id'),
+    'total_tokens': Sum('tokens_used'),
+    'total_response_time_ms': Sum('response_time_ms'),
+    'user_messages': Count('id', filter=Q(role='user')),
+    'assistant_messages': Count('id', filter=Q(role='assistant')),
+    'error_messages': Count('id', filter=Q(is_error=True)),
+    'fallback_messages': Count('id', filter=Q(is_fallback=True)),
+}
+
+
+def day_start(day):
+    """Начало дня как datetime в текущем часовом поясе"""
+    value = datetime.combine(day, time.min)
+    return timezone.make_aware(value) if settings.USE_TZ else value
+
+
+def aggregate_days(start, end, user_id=None):
+    """
+    Агрегаты за дни [start, end) в виде {(user_id, date): {field: value}}.
+
+    Фильтр по диапазону created_at использует индексы по времени создания.
+    """
+    rows = defaultdict(dict)
+
+    messages = ChatMessage.objects.filter(created_at__gte=day_start(start), created_at__lt=day_start(end))
+    if user_id is not None:
+        messages = messages.filter(session__user_id=user_id)
+    for row in (messages.annotate(day=TruncDate('created_at'))
+                .values('session__user_id', 'day')
+                .annotate(**MESSAGE_AGGREGATES)
+                .order_by()):
+        key = (row.pop('session__user_id'), row.pop('day'))
+        rows[key].update({field: value or 0 for field, value in row.items()})
+
+    sessions = ChatSession.objects.filter(created_at__gte=day_start(start), created_at__lt=day_start(end))
+    if user_id is not None:
+        sessions = sessions.filter(user_id=user_id)
+    for row in (sessions.annotate(day=TruncDate('created_at'))
+                .values('user_id', 'day')
+                .annotate(total_sessions=Count('id'))
+                .order_by()):
+        rows[(row['user_id'], row['day'])]['total_sessions'] = row['total_sessions']
+
+    return rows
+
+
+def aggregate_latency(start, end, user_id=None):
+    """
+    Гистограммы времени ответа за дни [start, end) в виде
+    {(user_id, date, bucket): count}. База группирует по точному значению,
+    раскладка по бакетам делается здесь.
+    """
+    buckets = defaultdict(int)
+    messages = ChatMessage.objects.filter(
+        created_at__gte=day_start(start),
+        created_at__lt=day_start(end),
+        response_time_ms__isnull=False
+    )
+    if user_id is not None:
+        messages = messages.filter(session__user_id=user_id)
+    for row in (messages.annotate(day=TruncDate('created_at'))
+                .values('session__user_id', 'day', 'response_time_ms')
+                .annotate(count=Count('id'))
+                .order_by()):
+        bucket = histograms.bucket_index(row['response_time_ms'])
+        buckets[(row['session__user_id'], row['day'], bucket)] += row['count']
+    return buckets
+
+
+def rebuild(start, end, user_id=None, chunk_days=7, log=None):
+    """
+    Пересчитывает ChatAnalytics за дни [start, end) порциями по chunk_days.
+
+    Каждая порция заменяется в своей транзакции, поэтому блокировки короткие,
+    а прерванный пересчет можно просто запустить снова.
+    Возвращает количество записанных строк.
+    """
+    written = 0
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days), end)
+        rows = aggregate_days(chunk_start, chunk_end, user_id=user_id)
+        buckets = aggregate_latency(chunk_start, chunk_end, user_id=user_id)
+
+        with transaction.atomic():
+            for model in (ChatAnalytics, ChatResponseTimeBucket):
+                existing = model.objects.filter(date__gte=chunk_start, date__lt=chunk_end)
+                if user_id is not None:
+                    existing = existing.filter(user_id=user_id)
+                existing.delete()
+            ChatAnalytics.objects.bulk_create([
+                ChatAnalytics(user_id=key[0], date=key[1], **counters)
+                for key, counters in rows.items()
+            ])
+            ChatResponseTimeBucket.objects.bulk_create([
+                ChatResponseTimeBucket(user_id=key[0], date=key[1], bucket=key[2], count=count)
+                for key, count in buckets.items()
+            ])
+
+        written += len(rows)
+        if log:
+            log(f'{chunk_start} - {chunk_end - timedelta(days=1)}: {len(rows)} строк')
+        chunk_start = chunk_end
+    return written
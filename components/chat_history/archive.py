@@ -0,0 +1,161 @@
+"""
+Очистка мягко удаленных сессий с переносом в холодный архив.
+
+Сессии, неактивные дольше срока хранения, вместе с сообщениями упаковываются
+в сжатый JSON (ChatSessionArchive) и физически удаляются из chat_sessions и
+chat_messages. Работа идет небольшими порциями, каждая - в своей короткой
+транзакции, чтобы не держать долгих блокировок. Сессии, уже лежащие в
+архиве под тем же id, не трогаются (см. archive_conflicts).
+
+Восстановление вставляет сообщения со старыми датами, поэтому сбрасывает
+кэш и векторный индекс пользователя; полнотекстовый индекс после него
+стоит проверить (search.verify), это делает restore_chat_sessions.
+"""
+import functools
+import json
+import zlib
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import vectors
+from .caching import bump_user_version_on_commit
+from .models import ChatMessage, ChatSession, ChatSessionArchive
+
+
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_BATCH_SIZE = 100
+RESTORE_CHUNK_SIZE = 500
+
+SESSION_FIELDS = [field.attname for field in ChatSession._meta.concrete_fields]
+MESSAGE_FIELDS = [field.attname for field in ChatMessage._meta.concrete_fields]
+DATETIME_FIELDS = ('created_at', 'updated_at')
+
+
+class ArchiveJSONEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder обрезает время до миллисекунд, в архиве нужна полная точность"""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def retention_days():
+    return getattr(settings, 'CHAT_HISTORY_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+
+
+def expired_sessions(older_than_days=None):
+    """Неактивные сессии, не менявшиеся дольше срока хранения (updated_at - момент удаления)"""
+    days = retention_days() if older_than_days is None else older_than_days
+    cutoff = timezone.now() - timedelta(days=days)
+    return ChatSession.objects.filter(is_active=False, updated_at__lt=cutoff)
+
+
+def archive_conflicts(queryset):
+    """Сессии из queryset, чей id уже занят в архиве - purge_batch их пропускает"""
+    return queryset.filter(id__in=ChatSessionArchive.objects.values('id'))
+
+
+def pack(session_row, message_rows):
+    payload = {'session': session_row, 'messages': message_rows}
+    return zlib.compress(json.dumps(payload, cls=ArchiveJSONEncoder, ensure_ascii=False).encode('utf-8'), 6)
+
+
+def unpack(data):
+    payload = json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+    for row in [payload['session'], *payload['messages']]:
+        for field in DATETIME_FIELDS:
+            if row.get(field):
+                row[field] = parse_datetime(row[field])
+    return payload
+
+
+def purge_batch(queryset, batch_size=DEFAULT_BATCH_SIZE, archive=True):
+    """
+    Архивирует и удаляет одну порцию сессий из queryset.
+
+    Возвращает (число сессий, число сообщений); (0, 0) - больше нечего удалять.
+    Удаляются только сессии, архивная копия которых записана в этой же
+    транзакции.
+    """
+    if archive:
+        queryset = queryset.exclude(id__in=ChatSessionArchive.objects.values('id'))
+    with transaction.atomic():
+        # Блокируем порцию; строки, занятые другими транзакциями, пропускаем
+        session_rows = list(
+            queryset.select_for_update(skip_locked=True)
+            .order_by('updated_at').values(*SESSION_FIELDS)[:batch_size]
+        )
+        if not session_rows:
+            return 0, 0
+        session_ids = [row['id'] for row in session_rows]
+
+        message_count = 0
+        if archive:
+            messages_by_session = {session_id: [] for session_id in session_ids}
+            for row in (ChatMessage.objects.filter(session_id__in=session_ids)
+                        .order_by('created_at', 'id').values(*MESSAGE_FIELDS)
+                        .iterator(chunk_size=RESTORE_CHUNK_SIZE)):
+                messages_by_session[row['session_id']].append(row)
+                message_count += 1
+
+            ChatSessionArchive.objects.bulk_create([
+                ChatSessionArchive(
+                    id=row['id'],
+                    user_id=row['user_id'],
+                    title=row['title'],
+                    created_at=row['created_at'],
+                    deleted_at=row['updated_at'],
+                    total_messages=len(messages_by_session[row['id']]),
+                    payload=pack(row, messages_by_session[row['id']]),
+                )
+                for row in session_rows
+            ])
+
+        deleted_messages, _ = ChatMessage.objects.filter(session_id__in=session_ids).delete()
+        ChatSession.objects.filter(id__in=session_ids).delete()
+        return len(session_rows), message_count or deleted_messages
+
+
+def _fix_timestamps(model, rows):
+    """bulk_create перезаписывает auto_now/auto_now_add - возвращаем исходные значения"""
+    fields = [field for field in DATETIME_FIELDS if field in rows[0]]
+    model.objects.filter(pk__in=[row['id'] for row in rows]).update(**{
+        field: Case(*[When(pk=row['id'], then=Value(row[field])) for row in rows], default=field)
+        for field in fields
+    })
+
+
+def restore(archive, activate=False):
+    """
+    Восстанавливает сессию из архива с исходными id и временем сообщений.
+
+    Модельные save() не вызываются, поэтому аналитика и счетчики не
+    учитываются повторно: счетчики берутся из архивной копии сессии.
+    После фиксации сбрасываются версия кэша и векторный индекс пользователя.
+    """
+    payload = unpack(archive.payload)
+    session_row = dict(payload['session'])
+    if activate:
+        session_row['is_active'] = True
+
+    with transaction.atomic():
+        ChatSession.objects.bulk_create([ChatSession(**session_row)])
+        _fix_timestamps(ChatSession, [session_row])
+
+        messages = payload['messages']
+        for start in range(0, len(messages), RESTORE_CHUNK_SIZE):
+            chunk = messages[start:start + RESTORE_CHUNK_SIZE]
+            ChatMessage.objects.bulk_create([ChatMessage(**row) for row in chunk])
+            _fix_timestamps(ChatMessage, chunk)
+
+        archive.delete()
+        bump_user_version_on_commit(session_row['user_id'])
+        transaction.on_commit(functools.partial(vectors.reset_user, session_row['user_id']), robust=True)
+    return session_row['id'], len(messages)
@@ -0,0 +1,244 @@
+"""
+Асинхронные (ASGI) версии основных эндпоинтов истории чатов.
+
+Работают параллельно с синхронными DRF-представлениями из views и отдают
+те же данные, но во время запросов к базе не занимают поток воркера:
+используется асинхронный ORM Django. Аутентификация - через классы DRF
+из настроек (JWT, сессия), она выполняется в пуле потоков. Ответы
+кодируются orjson и сжимаются по Accept-Encoding (см. api_encoding).
+
+Под WSGI эти представления тоже работают, но выигрыша не дают.
+"""
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from api_encoding import ORJSONRenderer, compress_response
+
+from . import idempotency, ratelimit, search, writebehind
+from .caching import STATS_CACHE_TIMEOUT, stats_cache_key, user_version_key, get_user_version
+from .models import ChatSession
+from .serializers import (
+    ChatSessionDetailSerializer, ChatMessageCreateSerializer, ChatMessageSerializer,
+    ChatStatsSerializer, MESSAGE_VALUES, SESSION_LIST_VALUES, serialize_session_list
+)
+from .views import (
+    ChatSessionPagination, DEFAULT_MESSAGES_WINDOW, MAX_MESSAGES_WINDOW, SEARCH_PAGE_SIZE,
+    chat_statistics_queries, fallback_search_sessions, format_chat_statistics, parse_date_range
+)
+
+
+def json_response(data, status_code=status.HTTP_200_OK, headers=None):
+    response = HttpResponse(
+        ORJSONRenderer().render(data), status=status_code, content_type='application/json'
+    )
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
+
+
+def _authenticate(request):
+    drf_request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    )
+    try:
+        user = drf_request.user
+    except APIException:
+        return None
+    return user if user is not None and user.is_authenticated else None
+
+
+def async_api_view(methods):
+    """
+    Аналог @api_view для async-функций: проверка метода, аутентификация
+    классами DRF, ошибки в формате {'success': False, 'error': ...}.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return json_response(
+                    {'detail': f'Метод "{request.method}" не разрешен.'},
+                    status.HTTP_405_METHOD_NOT_ALLOWED,
+                    headers={'Allow': ', '.join(methods)}
+                )
+            user = await sync_to_async(_authenticate)(request)
+            if user is None:
+                return json_response(
+                    {'detail': 'Учетные данные не были предоставлены.'},
+                    status.HTTP_401_UNAUTHORIZED
+                )
+            request.user = user
+            try:
+                return compress_response(request, await view(request, *args, **kwargs))
+            except ChatSession.DoesNotExist:
+                return json_response({'detail': 'Не найдено.'}, status.HTTP_404_NOT_FOUND)
+            except Exception as e:
+                return json_response({
+                    'success': False,
+                    'error': str(e)
+                }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Как у APIView: CSRF для сессионных пользователей проверяет SessionAuthentication
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def _int_param(request, name, default, maximum):
+    try:
+        value = int(request.GET.get(name, default))
+    except ValueError:
+        value = default
+    return min(max(value, 1), maximum)
+
+
+@async_api_view(['GET'])
+async def async_session_list(request):
+    """Список активных сессий (постраничный, формат как у ChatSessionListCreateView)"""
+    paginator = ChatSessionPagination
+    page_size = _int_param(request, paginator.page_size_query_param, paginator.page_size, paginator.max_page_size)
+    page = _int_param(request, 'page', 1, 10 ** 9)
+
+    sessions = ChatSession.objects.filter(user=request.user, is_active=True).order_by('-updated_at')
+    count = await sessions.acount()
+    sessions = sessions.values(*SESSION_LIST_VALUES)
+    offset = (page - 1) * page_size
+    if offset and offset >= count:
+        return json_response({'detail': 'Неправильная страница.'}, status.HTTP_404_NOT_FOUND)
+
+    rows = [session async for session in sessions[offset:offset + page_size]]
+    url = request.build_absolute_uri()
+    return json_response({
+        'count': count,
+        'next': replace_query_param(url, 'page', page + 1) if offset + page_size < count else None,
+        'previous': replace_query_param(url, 'page', page - 1) if page > 1 else None,
+        'results': serialize_session_list(rows),
+    })
+
+
+@async_api_view(['GET'])
+async def async_session_detail(request, id):
+    """Сессия с последними сообщениями (как ChatSessionDetailView)"""
+    session = await ChatSession.objects.aget(id=id, user=request.user)
+
+    limit = _int_param(request, 'messages_limit', DEFAULT_MESSAGES_WINDOW, MAX_MESSAGES_WINDOW)
+    rows = [
+        message async for message in
+        session.messages.values(*MESSAGE_VALUES).order_by('-created_at', '-id')[:limit + 1]
+    ]
+    has_older = len(rows) > limit
+    messages = rows[:limit][::-1]
+
+    serializer = ChatSessionDetailSerializer(session, context={
+        'messages_limit': limit,
+        'messages_windows': {session.pk: (messages, has_older)},
+    })
+    return json_response(serializer.data)
+
+
+@async_api_view(['POST'])
+@idempotency.async_idempotent
+async def async_add_message(request, session_id):
+    """Добавить сообщение в сессию (как add_message_to_session)"""
+    wait = await sync_to_async(ratelimit.check_write_limits)(request.user.pk)
+    if wait:
+        return json_response(
+            {'detail': 'Слишком много запросов.'},
+            status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={'Retry-After': str(int(wait) + 1)}
+        )
+
+    session = await ChatSession.objects.aget(id=session_id, user=request.user, is_active=True)
+
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return json_response({'error': 'Некорректный JSON'}, status.HTTP_400_BAD_REQUEST)
+
+    serializer = ChatMessageCreateSerializer(data=payload)
+    if not serializer.is_valid():
+        return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+    # save() модели обновляет счетчики сессии; при write-behind - групповая запись
+    message = serializer.Meta.model(session=session, **serializer.validated_data)
+    await writebehind.asave_message(message)
+    return json_response(ChatMessageSerializer(message).data, status.HTTP_201_CREATED)
+
+
+@async_api_view(['GET'])
+async def async_search_sessions(request):
+    """Поиск по сессиям (как search_chat_sessions)"""
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return json_response({
+            'success': False,
+            'error': 'Параметр поиска q обязателен'
+        }, status.HTTP_400_BAD_REQUEST)
+
+    page = _int_param(request, 'page', 1, 10 ** 9)
+    page_size = _int_param(request, 'page_size', SEARCH_PAGE_SIZE, ChatSessionPagination.max_page_size)
+    offset = (page - 1) * page_size
+
+    # Полнотекстовый поиск использует курсор напрямую - выполняем в потоке
+    hits = await sync_to_async(search.search_sessions)(
+        request.user, query, limit=page_size + 1, offset=offset
+    )
+    if hits is None:
+        sessions = fallback_search_sessions(request.user, query)[offset:offset + page_size + 1]
+        hits = [(session, None, None) async for session in sessions]
+
+    has_next = len(hits) > page_size
+    hits = hits[:page_size]
+    data = serialize_session_list([session for session, _, _ in hits])
+    for item, (_, rank, snippet) in zip(data, hits):
+        item['rank'] = rank
+        item['snippet'] = snippet
+
+    return json_response({
+        'success': True,
+        'data': data,
+        'count': len(data),
+        'page': page,
+        'page_size': page_size,
+        'has_next': has_next
+    })
+
+
+async def acompute_chat_statistics(user, date_from=None, date_to=None):
+    """Асинхронный вариант views.compute_chat_statistics (те же запросы)"""
+    sessions, aggregates, most_active = chat_statistics_queries(user, date_from, date_to)
+    return format_chat_statistics(await sessions.aaggregate(**aggregates), await most_active.afirst())
+
+
+@async_api_view(['GET'])
+async def async_chat_statistics(request):
+    """Статистика пользователя (как chat_statistics), с тем же кэшем"""
+    user = request.user
+    try:
+        date_from, date_to = parse_date_range(request.GET)
+    except ValueError as e:
+        return json_response({'success': False, 'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+
+    version = await cache.aget(user_version_key(user.pk))
+    if version is None:
+        version = await sync_to_async(get_user_version)(user.pk)
+    cache_key = stats_cache_key(user.pk, version, date_from, date_to)
+
+    stats_data = await cache.aget(cache_key)
+    if stats_data is None:
+        stats_data = await acompute_chat_statistics(user, date_from, date_to)
+        await cache.aset(cache_key, stats_data, STATS_CACHE_TIMEOUT)
+
+    return json_response({
+        'success': True,
+        'data': ChatStatsSerializer(stats_data).data
+    })
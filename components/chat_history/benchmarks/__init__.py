@@ -0,0 +1,14 @@
+"""
+Инструменты для замеров производительности chat_history и doctors.
+
+    data      - генератор синтетических данных (команда seed_chat_benchmark)
+    micro     - микробенчмарки представлений и сериализаторов
+    baseline  - базовые результаты (baseline.json) и поиск регрессий
+                (команда run_chat_benchmarks --save / --compare)
+    load      - нагрузочный драйвер для работающего сервера, sync и async
+
+Типичный цикл проверки изменения:
+
+    python manage.py seed_chat_benchmark --users 50 --sessions 20 --messages 12 --doctors 10
+    python manage.py run_chat_benchmarks --compare
+"""
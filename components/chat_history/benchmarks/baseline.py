@@ -0,0 +1,102 @@
+"""
+Базовые результаты бенчмарков и сравнение с ними.
+
+Базовый файл (по умолчанию BASELINE_PATH) - JSON с окружением замера и
+результатами micro.run_all. Сравнивается медиана времени (p50 устойчивее
+среднего к выбросам) с допуском: регрессией считается замедление больше
+tolerance (доля) и больше min_delta_ms.
+Рост числа SQL-запросов - регрессия всегда: он не зависит от машины.
+Бенчмарк без базового замера (new) означает, что базовый файл устарел:
+сравнение тогда не проходит, пока файл не перезаписан (--save).
+"""
+import json
+import os
+import platform
+import sys
+
+import django
+from django.db import connection
+from django.utils import timezone
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_TOLERANCE = 0.25
+MIN_DELTA_MS = 1.0
+TIME_KEY = 'p50_ms'
+
+
+def environment():
+    return {
+        'created_at': timezone.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'platform': sys.platform,
+    }
+
+
+def save(results, path=BASELINE_PATH, dataset=None):
+    payload = {'environment': environment(), 'dataset': dataset or {}, 'results': results}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load(path=BASELINE_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(results, baseline_results, tolerance=DEFAULT_TOLERANCE, min_delta_ms=MIN_DELTA_MS):
+    """
+    Строки сравнения: (имя, было мс, стало мс, изменение, было SQL, стало SQL, статус).
+
+    Статусы: ok, faster, slower, queries (больше SQL), new, missing.
+    """
+    rows = []
+    for name in sorted(set(results) | set(baseline_results)):
+        current, base = results.get(name), baseline_results.get(name)
+        if base is None:
+            rows.append((name, None, current[TIME_KEY], None, None, current['queries'], 'new'))
+            continue
+        if current is None:
+            rows.append((name, base[TIME_KEY], None, None, base['queries'], None, 'missing'))
+            continue
+
+        delta = current[TIME_KEY] - base[TIME_KEY]
+        change = delta / base[TIME_KEY] if base[TIME_KEY] else 0.0
+        if current['queries'] > base['queries']:
+            state = 'queries'
+        elif change > tolerance and delta > min_delta_ms:
+            state = 'slower'
+        elif change < -tolerance and -delta > min_delta_ms:
+            state = 'faster'
+        else:
+            state = 'ok'
+        rows.append((name, base[TIME_KEY], current[TIME_KEY], change,
+                     base['queries'], current['queries'], state))
+    return rows
+
+
+def regressions(rows):
+    return [row for row in rows if row[-1] in ('slower', 'queries')]
+
+
+def stale(rows):
+    """Бенчмарки, добавленные после записи базового файла"""
+    return [row for row in rows if row[-1] == 'new']
+
+
+def _cell(value, spec=''):
+    return '-' if value is None else format(value, spec)
+
+
+def format_rows(rows):
+    lines = [f"{'benchmark (p50)':<32} {'было, мс':>10} {'стало, мс':>10} {'изм.':>8} {'SQL':>9}  статус"]
+    for name, base_ms, current_ms, change, base_q, current_q, state in rows:
+        queries = f'{_cell(base_q)}->{_cell(current_q)}'
+        lines.append(
+            f'{name:<32} {_cell(base_ms, ".2f"):>10} {_cell(current_ms, ".2f"):>10} '
+            f'{_cell(change, "+.0%"):>8} {queries:>9}  {state}'
+        )
+    return '\n'.join(lines)
@@ -0,0 +1,244 @@
+"""
+Генератор синтетических данных для замеров: пользователи, сессии,
+сообщения и (если приложение doctors установлено) врачи и больницы.
+
+Размеры распределены логнормально, как в реальной истории: у большинства
+пользователей несколько коротких чатов, у немногих - сотни длинных.
+Ответы ассистента заметно длиннее вопросов. Счетчики сессий заполняются
+сразу, дневная аналитика пересчитывается в конце (analytics.rebuild).
+
+Работает на любой базе Django (SQLite, PostgreSQL). Все созданные
+пользователи получают префикс USERNAME_PREFIX, по нему же данные удаляются.
+"""
+import math
+import random
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from chat_history import analytics
+from chat_history.models import ChatMessage, ChatSession, local_date
+
+try:
+    from doctors.models import Doctor, Hospital
+except ImportError:  # приложение doctors может быть не установлено
+    Doctor = Hospital = None
+
+
+USERNAME_PREFIX = 'bench_'
+BATCH_SIZE = 1000
+
+WORDS = (
+    'пациент врач диагноз анализ кровь давление симптом лечение препарат доза '
+    'температура боль головная сердце легкие почки печень обследование МРТ УЗИ '
+    'рекомендация консультация хронический острый терапия режим питание сон '
+    'прием утром вечером дней неделя результат норма повышен снижен контроль '
+    'glucose hemoglobin ECG CT mg ml protocol guideline dosage follow-up'
+).split()
+
+# Значения metadata.analysis_type и их доля среди ответов ассистента
+ANALYSIS_TYPES = ('radiology', 'lab', 'ecg', 'dermatology')
+ANALYSIS_SHARE = 0.3
+IMAGE_SHARE = 0.05
+
+
+def lognormal(rng, mean, sigma, low=1, high=None):
+    """Целое из логнормального распределения с заданным средним"""
+    mu = math.log(mean) - sigma ** 2 / 2
+    value = max(low, int(round(rng.lognormvariate(mu, sigma))))
+    return min(value, high) if high else value
+
+
+class TextSource:
+    """Случайный текст нужной длины - срезы заранее собранного корпуса"""
+
+    def __init__(self, rng, size=50000):
+        self.rng = rng
+        self.corpus = ' '.join(rng.choice(WORDS) for _ in range(size // 6))
+
+    def take(self, length):
+        length = min(length, len(self.corpus) - 1)
+        start = self.rng.randrange(0, len(self.corpus) - length)
+        return self.corpus[start:start + length].strip() or 'текст'
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Временно отключает auto_now/auto_now_add, чтобы bulk_create записал
+    сгенерированное время. Только для одноразовой генерации данных.
+    """
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _model_kwargs(model, **values):
+    """Только поля, существующие в модели (модели doctors не входят в этот репозиторий)"""
+    names = {field.name for field in model._meta.concrete_fields}
+    return {name: value for name, value in values.items() if name in names}
+
+
+def create_users(count, start=0):
+    User = get_user_model()
+    users = []
+    for i in range(start, start + count):
+        name = f'{USERNAME_PREFIX}{i}'
+        values = {
+            User.USERNAME_FIELD: f'{name}@example.com' if User.USERNAME_FIELD == 'email' else name,
+            'email': f'{name}@example.com',
+            'full_name': f'Bench User {i}',
+            'first_name': 'Bench',
+            'last_name': f'User {i}',
+        }
+        user = User(**_model_kwargs(User, **values))
+        user.set_unusable_password()
+        users.append(user)
+    User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+    lookup = f'{User.USERNAME_FIELD}__startswith'
+    return list(User.objects.filter(**{lookup: USERNAME_PREFIX}).order_by('pk'))
+
+
+def build_session(rng, text, user, now, days, mean_messages):
+    """Сессия и ее сообщения с правдоподобными временем, длиной и токенами"""
+    created = now - timedelta(seconds=rng.uniform(0, days * 86400))
+    count = lognormal(rng, mean_messages, 0.9, high=500)
+    moment = created
+    messages = []
+    for position in range(count):
+        role = 'user' if position % 2 == 0 else 'assistant'
+        if role == 'user':
+            moment += timedelta(seconds=lognormal(rng, 40, 1.0))
+            content = text.take(lognormal(rng, 120, 0.8, high=4000))
+            extra = {'tokens_used': 0, 'response_time_ms': None, 'is_error': False, 'is_fallback': False}
+            metadata = {'has_image': True} if rng.random() < IMAGE_SHARE else {}
+        else:
+            response_ms = lognormal(rng, 2000, 0.6, high=120000)
+            moment += timedelta(milliseconds=response_ms)
+            content = text.take(lognormal(rng, 900, 0.7, high=16000))
+            extra = {
+                'tokens_used': len(content) // 4 + lognormal(rng, 300, 0.5),
+                'response_time_ms': response_ms,
+                'is_error': rng.random() < 0.02,
+                'is_fallback': rng.random() < 0.03,
+            }
+            metadata = {'model': 'bench'}
+            if rng.random() < ANALYSIS_SHARE:
+                metadata['analysis_type'] = rng.choice(ANALYSIS_TYPES)
+        if moment > now:
+            break
+        messages.append(ChatMessage(
+            id=uuid.uuid4(), role=role, content=content, created_at=moment,
+            metadata=metadata, **extra
+        ))
+
+    first_user = next((m for m in messages if m.role == 'user'), None)
+    last_assistant = next((m for m in reversed(messages) if m.role == 'assistant'), None)
+    session = ChatSession(
+        id=uuid.uuid4(),
+        user=user,
+        title=ChatSession.make_title(first_user.content) if first_user else 'Новый чат',
+        created_at=created,
+        updated_at=messages[-1].created_at if messages else created,
+        is_active=rng.random() >= 0.1,
+        total_messages=len(messages),
+        total_tokens_used=sum(m.tokens_used for m in messages),
+        last_message_preview=ChatSession.make_preview(last_assistant.content) if last_assistant else '',
+    )
+    for message in messages:
+        message.session = session
+    return session, messages
+
+
+def create_doctors(rng, users):
+    if Doctor is None or not users:
+        return 0
+    hospitals = [
+        Hospital(**_model_kwargs(Hospital, name=f'Bench Hospital {i}', address=f'Street {i}'))
+        for i in range(max(1, len(users) // 20))
+    ]
+    Hospital.objects.bulk_create(hospitals)
+    hospitals = list(Hospital.objects.filter(name__startswith='Bench Hospital'))
+    specialties = [value for value, _ in getattr(Doctor._meta.get_field('specialty'), 'choices', None) or []] or ['therapist']
+    doctors = [
+        Doctor(**_model_kwargs(
+            Doctor,
+            user=user,
+            hospital=rng.choice(hospitals),
+            specialty=rng.choice(specialties),
+            license_number=f'BENCH-{user.pk}',
+            years_of_experience=lognormal(rng, 10, 0.6, high=50),
+            education='Медицинский университет',
+            certifications='Сертификат 1, Сертификат 2',
+            consultation_fee=rng.choice([100000, 150000, 200000, 300000]),
+            is_available=rng.random() < 0.8,
+            rating=round(rng.uniform(3.5, 5), 1),
+        ))
+        for user in users
+    ]
+    Doctor.objects.bulk_create(doctors, batch_size=BATCH_SIZE)
+    return len(doctors)
+
+
+def generate(users=10, sessions_per_user=20, messages_per_session=12, doctors=0,
+             days=90, seed=1, log=None):
+    """
+    Создает данные и возвращает словарь с количеством созданных объектов.
+
+    sessions_per_user и messages_per_session - средние значения.
+    """
+    rng = random.Random(seed)
+    text = TextSource(rng)
+    now = timezone.now()
+    User = get_user_model()
+    start = User.objects.filter(**{f'{User.USERNAME_FIELD}__startswith': USERNAME_PREFIX}).count()
+    created_users = create_users(users, start=start)[start:]
+
+    totals = {'users': len(created_users), 'sessions': 0, 'messages': 0, 'doctors': 0}
+    with explicit_timestamps(ChatSession, ChatMessage):
+        for index, user in enumerate(created_users, 1):
+            sessions, messages = [], []
+            for _ in range(lognormal(rng, sessions_per_user, 1.0, high=5000)):
+                session, session_messages = build_session(rng, text, user, now, days, messages_per_session)
+                sessions.append(session)
+                messages.extend(session_messages)
+            with transaction.atomic():
+                ChatSession.objects.bulk_create(sessions, batch_size=BATCH_SIZE)
+                ChatMessage.objects.bulk_create(messages, batch_size=BATCH_SIZE)
+            totals['sessions'] += len(sessions)
+            totals['messages'] += len(messages)
+            if log:
+                log(f'{index}/{len(created_users)}: {len(sessions)} сессий, {len(messages)} сообщений')
+
+    with transaction.atomic():
+        totals['doctors'] = create_doctors(rng, created_users[:doctors])
+
+    analytics.rebuild(local_date(now - timedelta(days=days + 1)), local_date(now) + timedelta(days=1))
+    return totals
+
+
+def clear(log=None):
+    """Удаляет всех сгенерированных пользователей и их данные"""
+    User = get_user_model()
+    users = User.objects.filter(**{f'{User.USERNAME_FIELD}__startswith': USERNAME_PREFIX})
+    if Doctor is not None:
+        Doctor.objects.filter(user__in=users).delete()
+        Hospital.objects.filter(name__startswith='Bench Hospital').delete()
+    # Сообщения - отдельным запросом, чтобы каскад не загружал их в память
+    ChatMessage.objects.filter(session__user__in=users).delete()
+    deleted, _ = users.delete()
+    if log:
+        log(f'Удалено объектов: {deleted}')
+    return deleted
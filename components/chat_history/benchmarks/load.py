@@ -0,0 +1,131 @@
+"""
+Нагрузочный драйвер: сравнение синхронных и асинхронных эндпоинтов.
+
+Шлет запросы с заданной конкурентностью на работающий сервер и печатает
+пропускную способность и задержки для каждой пары sync/async. Пример для
+ASGI (uvicorn) и для сравнения - WSGI (gunicorn):
+
+    uvicorn config.asgi:application --workers 1
+    python -m chat_history.benchmarks.load --base-url http://127.0.0.1:8000/api/chat \\
+        --token <JWT> --session <uuid> --concurrency 50 --requests 2000
+
+Использует только стандартную библиотеку, Django не нужен.
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+# (имя, метод, синхронный путь, асинхронный путь); {session} - id сессии
+SCENARIOS = [
+    ('list', 'GET', 'sessions/', 'async/sessions/'),
+    ('detail', 'GET', 'sessions/{session}/', 'async/sessions/{session}/'),
+    ('search', 'GET', 'search/?q=test', 'async/search/?q=test'),
+    ('statistics', 'GET', 'statistics/', 'async/statistics/'),
+    ('add-message', 'POST', 'sessions/{session}/messages/', 'async/sessions/{session}/messages/'),
+]
+MESSAGE_BODY = json.dumps({'role': 'user', 'content': 'benchmark message'}).encode()
+
+
+def percentile(values, point):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(len(values) * point / 100), len(values) - 1)
+    return values[index]
+
+
+def run(url, method, total, concurrency, headers, timeout=30):
+    """Выполняет total запросов; возвращает словарь с результатами"""
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+
+    def one(_):
+        body = MESSAGE_BODY if method == 'POST' else None
+        request = urllib.request.Request(url, data=body, method=method, headers=headers)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                code = response.status
+        except urllib.error.HTTPError as e:
+            code = e.code
+        except OSError as e:
+            code = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            if code in (200, 201):
+                latencies.append(elapsed)
+            else:
+                errors[code] = errors.get(code, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    duration = time.perf_counter() - started
+
+    return {
+        'requests': total,
+        'ok': len(latencies),
+        'errors': errors,
+        'duration': round(duration, 3),
+        'rps': round(len(latencies) / duration, 1) if duration else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+    }
+
+
+def compare(base_url, token, session, concurrency, total, scenarios=None, writes=False):
+    headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+    results = []
+    for name, method, sync_path, async_path in SCENARIOS:
+        if scenarios and name not in scenarios:
+            continue
+        if method != 'GET' and not writes:
+            continue
+        if '{session}' in sync_path and not session:
+            continue
+        for mode, path in (('sync', sync_path), ('async', async_path)):
+            url = f'{base_url.rstrip("/")}/{path.format(session=session)}'
+            result = run(url, method, total, concurrency, headers)
+            results.append({'scenario': name, 'mode': mode, **result})
+    return results
+
+
+def print_table(results):
+    columns = ('scenario', 'mode', 'ok', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'errors')
+    print('  '.join(f'{column:>10}' for column in columns))
+    for row in results:
+        print('  '.join(f'{str(row[column] or "-"):>10}' for column in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Сравнение sync/async эндпоинтов chat_history под нагрузкой')
+    parser.add_argument('--base-url', required=True, help='Например http://127.0.0.1:8000/api/chat')
+    parser.add_argument('--token', required=True, help='JWT access-токен')
+    parser.add_argument('--session', help='id сессии для detail и add-message')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--scenario', action='append', help='Запустить только указанные сценарии')
+    parser.add_argument('--writes', action='store_true', help='Включить add-message (создает сообщения)')
+    parser.add_argument('--json', action='store_true', help='Вывести результаты в JSON')
+    args = parser.parse_args(argv)
+
+    results = compare(
+        args.base_url, args.token, args.session, args.concurrency, args.requests,
+        scenarios=args.scenario, writes=args.writes
+    )
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Микробенчмарки представлений и сериализаторов chat_history и doctors.
+
+Представления вызываются напрямую через APIRequestFactory (без URLconf и
+middleware), поэтому замер показывает работу самого представления: SQL,
+сериализацию и рендеринг. Для каждого сценария - время (среднее, p50, p95)
+и число SQL-запросов за один вызов.
+
+Кэши списка и статистики по умолчанию сбрасываются перед каждым вызовом
+(сценарии *-cached меряют повторный запрос с попаданием в кэш).
+Сценарии encoding.* кодируют один и тот же ответ разными способами и
+дополнительно сообщают размер результата в байтах.
+"""
+import gzip
+import statistics
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from rest_framework.renderers import JSONRenderer
+
+import api_encoding as encoding
+from chat_history import views
+from chat_history.caching import bump_user_version
+from chat_history.models import ChatAnalytics, ChatMessage, ChatSession
+from chat_history.serializers import (
+    ChatAnalyticsSerializer, ChatMessageSerializer,
+    ChatSessionDetailSerializer, ChatSessionListSerializer,
+    MESSAGE_VALUES, SESSION_LIST_VALUES, serialize_messages, serialize_session_list
+)
+
+try:
+    from doctors import views as doctor_views
+    from doctors.models import Doctor
+    from doctors.serializers import DoctorProfileSerializer
+except ImportError:  # приложение doctors может быть не установлено
+    doctor_views = Doctor = DoctorProfileSerializer = None
+
+
+class Benchmark:
+    """Замеряемый вызов; setup выполняется перед каждым вызовом вне замера"""
+
+    def __init__(self, name, run, setup=None, writes=False):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.writes = writes
+
+
+def percentile(values, point):
+    values = sorted(values)
+    return values[min(int(len(values) * point / 100), len(values) - 1)]
+
+
+def measure(benchmark, iterations=20, warmup=2):
+    """Время вызовов в мс и число SQL-запросов одного вызова"""
+    for _ in range(warmup):
+        if benchmark.setup:
+            benchmark.setup()
+        benchmark.run()
+
+    if benchmark.setup:
+        benchmark.setup()
+    with CaptureQueriesContext(connection) as queries:
+        output = benchmark.run()
+
+    timings = []
+    for _ in range(iterations):
+        if benchmark.setup:
+            benchmark.setup()
+        started = time.perf_counter()
+        benchmark.run()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    result = {
+        'iterations': iterations,
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'queries': len(queries.captured_queries),
+    }
+    if isinstance(output, bytes):
+        result['bytes'] = len(output)
+    return result
+
+
+def pick_user():
+    """Пользователь с наибольшим числом сессий - самый тяжелый случай"""
+    row = (ChatSession.objects.values('user_id').annotate(n=Count('id'))
+           .order_by('-n').first())
+    if row is None:
+        raise ValueError('Нет данных: сначала запустите seed_chat_benchmark')
+    return ChatSession._meta.get_field('user').related_model.objects.get(pk=row['user_id'])
+
+
+def request_factory():
+    # build_absolute_uri проверяет хост по ALLOWED_HOSTS
+    hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host not in ('*', '')]
+    return APIRequestFactory(SERVER_NAME=hosts[0] if hosts else 'localhost')
+
+
+def _response(view, request, **kwargs):
+    response = view(request, **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    elif getattr(response, 'streaming', False):
+        for _ in response.streaming_content:
+            pass
+    assert response.status_code < 400, f'{request.path}: {response.status_code}'
+    return response
+
+
+def view_benchmarks(user):
+    factory = request_factory()
+    session = (ChatSession.objects.filter(user=user, is_active=True)
+               .order_by('-total_messages').first())
+
+    def call(view, path, method='get', data=None, **kwargs):
+        def run():
+            request = getattr(factory, method)(path, data, format='json' if method == 'post' else None)
+            force_authenticate(request, user=user)
+            return _response(view, request, **kwargs)
+        return run
+
+    cold = lambda: bump_user_version(user.pk)
+    list_view = views.ChatSessionListCreateView.as_view()
+    detail_view = views.ChatSessionDetailView.as_view()
+    base = '/api/chat'
+    sid = session.id
+
+    benchmarks = [
+        Benchmark('chat.session-list', call(list_view, f'{base}/sessions/'), setup=cold),
+        Benchmark('chat.session-list-cached', call(list_view, f'{base}/sessions/')),
+        Benchmark('chat.session-list-cursor', call(list_view, f'{base}/sessions/?pagination=cursor'), setup=cold),
+        Benchmark('chat.session-detail', call(detail_view, f'{base}/sessions/{sid}/', id=sid)),
+        Benchmark('chat.session-list-meta', call(list_view, f'{base}/sessions/?meta.analysis_type=radiology'), setup=cold),
+        Benchmark('chat.messages-window', call(views.session_messages_window, f'{base}/sessions/{sid}/messages/history/', session_id=sid)),
+        Benchmark('chat.messages-window-meta', call(
+            views.session_messages_window, f'{base}/sessions/{sid}/messages/history/?meta.model=bench', session_id=sid
+        )),
+        Benchmark('chat.statistics', call(views.chat_statistics, f'{base}/statistics/'), setup=cold),
+        Benchmark('chat.statistics-cached', call(views.chat_statistics, f'{base}/statistics/')),
+        Benchmark('chat.analytics', call(views.chat_analytics_daily, f'{base}/analytics/')),
+        Benchmark('chat.analytics-latency', call(views.chat_latency_percentiles, f'{base}/analytics/latency/')),
+        Benchmark('chat.search', call(views.search_chat_sessions, f'{base}/search/?q=пациент')),
+        Benchmark('chat.export-json', call(
+            views.export_chat_session, f'{base}/sessions/{sid}/export/', 'post',
+            {'format': 'json'}, session_id=sid
+        )),
+        Benchmark('chat.add-message', call(
+            views.add_message_to_session, f'{base}/sessions/{sid}/messages/', 'post',
+            {'role': 'user', 'content': 'benchmark'}, session_id=sid
+        ), writes=True),
+    ]
+    return benchmarks
+
+
+def doctor_benchmarks():
+    if Doctor is None:
+        return []
+    doctor = Doctor.objects.select_related('user').first()
+    if doctor is None:
+        return []
+    factory = request_factory()
+
+    def call(view, path, **kwargs):
+        def run():
+            request = factory.get(path)
+            force_authenticate(request, user=doctor.user)
+            return _response(view, request, **kwargs)
+        return run
+
+    base = '/api/doctors'
+    return [
+        Benchmark('doctors.profile', call(doctor_views.DoctorProfileView.as_view(), f'{base}/profile/')),
+        Benchmark('doctors.schedule', call(doctor_views.doctor_schedule, f'{base}/{doctor.pk}/schedule/', pk=doctor.pk)),
+        Benchmark('doctors.contacts', call(doctor_views.doctor_contacts, f'{base}/{doctor.pk}/contacts/', pk=doctor.pk)),
+        Benchmark('doctors.reviews', call(doctor_views.doctor_reviews, f'{base}/{doctor.pk}/reviews/', pk=doctor.pk)),
+        Benchmark('doctors.analytics', call(doctor_views.doctor_analytics, f'{base}/{doctor.pk}/analytics/', pk=doctor.pk)),
+    ]
+
+
+def serializer_benchmarks(user):
+    sessions = list(ChatSession.objects.filter(user=user, is_active=True).order_by('-updated_at')[:20])
+    session = max(sessions, key=lambda s: s.total_messages)
+    messages = list(ChatMessage.objects.filter(session=session).order_by('created_at', 'id')[:200])
+    window = messages[-50:]
+    session_rows = list(ChatSession.objects.filter(pk__in=[s.pk for s in sessions])
+                        .order_by('-updated_at').values(*SESSION_LIST_VALUES))
+    message_rows = list(ChatMessage.objects.filter(session=session).order_by('created_at', 'id')
+                        .values(*MESSAGE_VALUES)[:200])
+    days = list(ChatAnalytics.objects.filter(user=user)[:30])
+
+    benchmarks = [
+        Benchmark('serializer.session-list', lambda: ChatSessionListSerializer(sessions, many=True).data),
+        Benchmark('serializer.session-list-fast', lambda: serialize_session_list(session_rows)),
+        Benchmark('serializer.session-detail', lambda: ChatSessionDetailSerializer(session, context={
+            'messages_windows': {session.pk: (window, len(messages) > len(window))}
+        }).data),
+        Benchmark('serializer.messages', lambda: ChatMessageSerializer(messages, many=True).data),
+        Benchmark('serializer.messages-fast', lambda: serialize_messages(message_rows)),
+        Benchmark('serializer.analytics', lambda: ChatAnalyticsSerializer(days, many=True).data),
+    ]
+    if Doctor is not None:
+        doctor = Doctor.objects.select_related('user', 'hospital').first()
+        if doctor is not None:
+            benchmarks.append(Benchmark('serializer.doctor-profile', lambda: DoctorProfileSerializer(doctor).data))
+    return benchmarks
+
+
+def encoding_benchmarks(user):
+    """Кодирование ответа с длинной историей: DRF JSON, orjson, msgpack, сжатие"""
+    session = (ChatSession.objects.filter(user=user, is_active=True)
+               .order_by('-total_messages').first())
+    payload = ChatSessionDetailSerializer(session, context={'messages_limit': 200}).data
+    body = JSONRenderer().render(payload)
+    options = encoding.get_options()
+
+    benchmarks = [
+        Benchmark('encoding.json-drf', lambda: JSONRenderer().render(payload)),
+        Benchmark('encoding.json-orjson', lambda: encoding.ORJSONRenderer().render(payload)),
+    ]
+    if encoding.msgpack is not None:
+        benchmarks.append(Benchmark('encoding.msgpack', lambda: encoding.MessagePackRenderer().render(payload)))
+    benchmarks.append(Benchmark(
+        'encoding.gzip', lambda: gzip.compress(body, compresslevel=options['gzip_level'], mtime=0)
+    ))
+    if encoding.brotli is not None:
+        benchmarks.append(Benchmark(
+            'encoding.brotli', lambda: encoding.brotli.compress(body, quality=options['brotli_quality'])
+        ))
+    return benchmarks
+
+
+def all_benchmarks(user):
+    return (view_benchmarks(user) + doctor_benchmarks() +
+            serializer_benchmarks(user) + encoding_benchmarks(user))
+
+
+def run_all(user=None, iterations=20, only=None, writes=False, log=None):
+    """Запускает бенчмарки; возвращает {имя: результат}"""
+    user = user or pick_user()
+    results = {}
+    for benchmark in all_benchmarks(user):
+        if only and not any(benchmark.name.startswith(prefix) for prefix in only):
+            continue
+        if benchmark.writes and not writes:
+            continue
+        if benchmark.writes:
+            # Записи откатываются, данные для следующих запусков не меняются
+            with transaction.atomic():
+                results[benchmark.name] = measure(benchmark, iterations)
+                transaction.set_rollback(True)
+        else:
+            results[benchmark.name] = measure(benchmark, iterations)
+        if log:
+            row = results[benchmark.name]
+            size = f"  {row['bytes']} байт" if 'bytes' in row else ''
+            log(f"{benchmark.name:<32} {row['mean_ms']:>9.2f} мс  p95 {row['p95_ms']:>9.2f} мс  SQL {row['queries']}{size}")
+    return results
@@ -0,0 +1,212 @@
+"""
+Версионирование кэша истории чатов по пользователю.
+
+Любая запись в сессии или сообщения пользователя увеличивает его версию,
+поэтому кэшированные данные с версией в ключе становятся недоступны сразу,
+без перебора и удаления ключей.
+
+Версии хранятся в кэше default, поэтому при нескольких процессах он должен
+быть общим (Redis, Memcached), иначе запись в одном процессе не сбросит
+данные, закэшированные в другом.
+"""
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+
+
+CACHE_PREFIX = 'chat_history'
+STATS_CACHE_TIMEOUT = 300
+
+
+def user_version_key(user_id):
+    return f'{CACHE_PREFIX}:user:{user_id}:version'
+
+
+def _initial_version():
+    # Время в мс: после вытеснения ключа версия не повторит прежнюю
+    return int(time.time() * 1000)
+
+
+def get_user_version(user_id):
+    key = user_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key, _initial_version())
+    return version
+
+
+def bump_user_version(user_id):
+    key = user_version_key(user_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _initial_version()
+        cache.add(key, version, timeout=None)
+        return version
+
+
+def bump_user_version_on_commit(user_id, using=None):
+    """
+    Увеличивает версию после фиксации текущей транзакции (без транзакции -
+    сразу). Иначе читатель может закэшировать старые данные под новой
+    версией, а откат записи оставит в кэше несуществующие данные.
+    """
+    transaction.on_commit(functools.partial(bump_user_version, user_id), using=using, robust=True)
+
+
+def stats_cache_key(user_id, version, date_from=None, date_to=None):
+    return f'{CACHE_PREFIX}:stats:{user_id}:{version}:{date_from or ""}:{date_to or ""}'
+
+
+class LocalLRUStore:
+    """Кэш в памяти процесса с вытеснением давно неиспользованных записей"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self._set(key, value, timeout)
+
+    def _set(self, key, value, timeout):
+        self.entries[key] = (value, time.monotonic() + timeout)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def add(self, key, value, timeout):
+        """Записывает значение, только если ключа нет (или он истек)"""
+        with self.lock:
+            item = self.entries.get(key)
+            if item is not None and item[1] > time.monotonic():
+                return False
+            self._set(key, value, timeout)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DjangoCacheStore:
+    """Обертка над алиасом из CACHES (locmem, файловый, Redis...)"""
+
+    # Размер и вытеснение определяются настройками самого бэкенда
+    # (MAX_ENTRIES / CULL_FREQUENCY в CACHES)
+    evictions = None
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout):
+        self.cache.set(key, value, timeout)
+
+    def add(self, key, value, timeout):
+        return self.cache.add(key, value, timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+
+class VersionedPageCache:
+    """
+    Кэш сериализованных страниц с версией пользователя в ключе.
+
+    Настройки (CHAT_HISTORY_LIST_CACHE):
+        'backend': 'local' - LRU в памяти процесса (по умолчанию),
+                   'cache' - алиас из CACHES, например locmem или файловый
+        'alias': 'default', 'max_entries': 1000, 'timeout': 300,
+        'enabled': True
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._store = None
+        self._options = None
+
+    @property
+    def options(self):
+        options = {'backend': 'local', 'alias': 'default', 'max_entries': 1000, 'timeout': 300, 'enabled': True}
+        options.update(getattr(settings, 'CHAT_HISTORY_LIST_CACHE', None) or {})
+        return options
+
+    @property
+    def store(self):
+        options = self.options
+        if self._store is None or options != self._options:
+            if options['backend'] == 'cache':
+                self._store = DjangoCacheStore(options['alias'])
+            else:
+                self._store = LocalLRUStore(options['max_entries'])
+            self._options = options
+        return self._store
+
+    def key(self, user_id, variant):
+        digest = hashlib.sha1(variant.encode()).hexdigest()
+        return f'{CACHE_PREFIX}:{self.name}:{user_id}:{get_user_version(user_id)}:{digest}'
+
+    def get(self, key):
+        value = self.store.get(key) if self.options['enabled'] else None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.options['enabled']:
+            self.store.set(key, value, self.options['timeout'])
+
+    def stats(self):
+        """Счетчики текущего процесса"""
+        store = self.store
+        total = self.hits + self.misses
+        return {
+            'name': self.name,
+            'backend': self.options['backend'],
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else None,
+            'entries': len(store) if isinstance(store, LocalLRUStore) else None,
+            'evictions': store.evictions,
+        }
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = self.misses = 0
+
+
+session_list_cache = VersionedPageCache('sessions')
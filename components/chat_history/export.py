@@ -0,0 +1,118 @@
+"""
+Потоковый экспорт сессий чата.
+
+Сообщения читаются из базы порциями через iterator(), документ отдается
+по частям, поэтому потребление памяти не зависит от размера сессии.
+"""
+import json
+import zlib
+
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+from .serializers import ChatSessionListSerializer, ChatMessageSerializer
+
+
+EXPORT_CHUNK_SIZE = 500
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'txt': 'text/plain; charset=utf-8',
+    'md': 'text/markdown; charset=utf-8',
+}
+
+EXPORT_FORMATS = tuple(CONTENT_TYPES)
+
+
+def _dumps(data):
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False)
+
+
+def _iter_messages(session):
+    return session.messages.order_by('created_at', 'id').iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def _session_header(session):
+    data = ChatSessionListSerializer(session).data
+    data['is_active'] = session.is_active
+    return data
+
+
+def export_json(session):
+    header = _dumps(_session_header(session))
+    yield header[:-1] + ', "messages": ['
+    for index, msg in enumerate(_iter_messages(session)):
+        yield (', ' if index else '') + _dumps(ChatMessageSerializer(msg).data)
+    yield ']}'
+
+
+def export_ndjson(session):
+    yield _dumps({'type': 'session', **_session_header(session)}) + '\n'
+    for msg in _iter_messages(session):
+        yield _dumps({'type': 'message', **ChatMessageSerializer(msg).data}) + '\n'
+
+
+def export_txt(session):
+    yield f"Чат: {session.title}\nДата: {session.created_at.strftime('%Y-%m-%d %H:%M')}\n\n"
+    for msg in _iter_messages(session):
+        role_name = "Врач" if msg.role == "user" else "Avishifo.ai"
+        yield f"[{msg.created_at.strftime('%H:%M')}] {role_name}:\n{msg.content}\n\n"
+
+
+def export_md(session):
+    yield f"# {session.title}\n\n**Дата:** {session.created_at.strftime('%Y-%m-%d %H:%M')}\n\n"
+    for msg in _iter_messages(session):
+        role_name = "**Врач**" if msg.role == "user" else "**Avishifo.ai**"
+        yield f"### {role_name} ({msg.created_at.strftime('%H:%M')})\n\n{msg.content}\n\n---\n\n"
+
+
+EXPORTERS = {
+    'json': export_json,
+    'ndjson': export_ndjson,
+    'txt': export_txt,
+    'md': export_md,
+}
+
+
+def encode_chunks(chunks, buffer_size=EXPORT_BUFFER_SIZE):
+    """Кодирует строки в UTF-8 и склеивает мелкие части в блоки ~buffer_size"""
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_chunks(chunks, level=6):
+    """Сжимает поток на лету в формат gzip"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def streaming_export_response(session, export_format, compress=False):
+    """StreamingHttpResponse с экспортом сессии в виде файла-вложения"""
+    chunks = encode_chunks(EXPORTERS[export_format](session))
+    filename = f'chat-{session.id}.{export_format}'
+    content_type = CONTENT_TYPES[export_format]
+
+    if compress:
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
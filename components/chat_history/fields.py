@@ -0,0 +1,137 @@
+"""
+Поля моделей с прозрачным сжатием.
+
+Значения длиннее порога хранятся сжатыми (zlib или zstd) в виде
+'<алгоритм>:<base64>' в той же текстовой колонке, короткие - как есть,
+поэтому старые несжатые строки читаются без миграции данных. Сжатие
+включается настройками:
+
+    CHAT_HISTORY_COMPRESSION = 'zlib'            # None (по умолчанию), 'zlib' или 'zstd'
+    CHAT_HISTORY_COMPRESSION_THRESHOLD = 4096    # байт, меньшие значения не сжимаются
+
+Значение распаковывается сразу при загрузке поля из базы (from_db_value),
+а не при обращении к нему: from_db_value вызывается и для values(), где
+сжатую строку некому распаковать позже. Поэтому запросы, которым тело не
+нужно, его не загружают: values()/only()/defer() (поиск похожих
+сообщений, админка, векторный индекс).
+
+Сжатые значения непрозрачны для СУБД и не находятся поиском по подстроке.
+Полнотекстовый индекс (search) со сжатием несовместим: install() его не
+создает, а проверка chat_history.E001 (manage.py check --database default,
+migrate) сообщает об уже созданном. JSON (metadata) не сжимается: строка
+вместо объекта ломает фильтры по ключам и GIN-индексы. На PostgreSQL
+большие значения уже сжимаются TOAST, поэтому там сжатие не нужно.
+"""
+import base64
+import json
+import zlib
+
+from django.conf import settings
+from django.core import checks
+from django.db import DEFAULT_DB_ALIAS, models
+
+try:
+    import zstandard
+except ImportError:  # zstd - необязательная зависимость
+    zstandard = None
+
+
+DEFAULT_THRESHOLD = 4096
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, ZLIB_LEVEL), zlib.decompress),
+    'zstd': (_zstd_compress, _zstd_decompress),
+}
+
+
+def compression_algorithm():
+    algorithm = getattr(settings, 'CHAT_HISTORY_COMPRESSION', None)
+    if algorithm == 'zstd' and zstandard is None:
+        # Без пакета zstandard пишем zlib, чтобы не терять данные
+        return 'zlib'
+    return algorithm if algorithm in CODECS else None
+
+
+def compression_threshold():
+    return getattr(settings, 'CHAT_HISTORY_COMPRESSION_THRESHOLD', DEFAULT_THRESHOLD)
+
+
+def compress_text(value):
+    """Сжимает строку, если включено сжатие и она длиннее порога"""
+    algorithm = compression_algorithm()
+    if algorithm is None or value is None:
+        return value
+    data = value.encode('utf-8')
+    if len(data) < compression_threshold():
+        return value
+    packed = CODECS[algorithm][0](data)
+    encoded = f'{algorithm}:{base64.b64encode(packed).decode("ascii")}'
+    # Несжимаемые данные оставляем как есть
+    return encoded if len(encoded) < len(value) else value
+
+
+def decompress_text(value):
+    """Распаковывает значение, записанное compress_text; прочие строки не меняются"""
+    if not isinstance(value, str):
+        return value
+    algorithm, sep, payload = value.partition(':')
+    if not sep or algorithm not in CODECS:
+        return value
+    try:
+        return CODECS[algorithm][1](base64.b64decode(payload, validate=True)).decode('utf-8')
+    except Exception:
+        # Обычный текст, случайно похожий на сжатое значение
+        return value
+
+
+class CompressedTextField(models.TextField):
+    """TextField, сжимающий длинные значения при записи"""
+
+    def from_db_value(self, value, expression, connection):
+        return decompress_text(value)
+
+    def get_prep_value(self, value):
+        return compress_text(super().get_prep_value(value))
+
+
+class DecompressingJSONField(models.JSONField):
+    """
+    JSONField, читающий документы, записанные сжатой строкой (раньше
+    metadata сжималась), и пишущий значения как есть: metaquery,
+    metadata__streaming и GIN-индексы работают только с объектом.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        value = super().from_db_value(value, expression, connection)
+        if isinstance(value, str):
+            unpacked = decompress_text(value)
+            if unpacked is not value:
+                return json.loads(unpacked)
+        return value
+
+
+@checks.register(checks.Tags.database)
+def check_compression(app_configs=None, databases=None, **kwargs):
+    """Сжатый content не виден полнотекстовому индексу: триггеры и to_tsvector получают base64"""
+    if compression_algorithm() is None or not databases or DEFAULT_DB_ALIAS not in databases:
+        return []
+    from . import search  # search импортирует models, а models - этот модуль
+    if search.get_backend() is None:
+        return []
+    return [checks.Error(
+        'CHAT_HISTORY_COMPRESSION несовместим с полнотекстовым индексом: '
+        'сжатые сообщения не находятся поиском',
+        hint='Отключите сжатие или удалите индекс: manage.py chat_search_index --drop',
+        id='chat_history.E001',
+    )]
@@ -0,0 +1,75 @@
+"""
+Лог-линейные гистограммы времени ответа.
+
+Значения до 2 * SUB_BUCKETS мс хранятся точно, дальше каждая степень двойки
+делится на SUB_BUCKETS равных бакетов (относительная погрешность не больше
+1 / SUB_BUCKETS). Границы бакетов фиксированы, поэтому гистограммы за разные
+дни и пользователей складываются простым суммированием счетчиков.
+"""
+from collections import Counter
+
+
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+DEFAULT_PERCENTILES = (50, 95, 99)
+
+
+def bucket_index(value):
+    """Номер бакета для значения в миллисекундах"""
+    value = max(int(value), 0)
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - (SUB_BUCKET_BITS + 1)
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_bounds(index):
+    """Границы бакета [lower, upper] в миллисекундах"""
+    if index < 2 * SUB_BUCKETS:
+        return index, index
+    shift = index // SUB_BUCKETS - 1
+    mantissa = index - shift * SUB_BUCKETS
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+def bucket_value(index):
+    """Представительное значение бакета - середина интервала"""
+    lower, upper = bucket_bounds(index)
+    return (lower + upper) // 2
+
+
+def build(values):
+    """Гистограмма {bucket: count} из набора значений"""
+    return Counter(bucket_index(value) for value in values if value is not None)
+
+
+def merge(histograms):
+    total = Counter()
+    for histogram in histograms:
+        total.update(histogram)
+    return total
+
+
+def percentiles(histogram, points=DEFAULT_PERCENTILES):
+    """
+    Оценка процентилей по гистограмме: {50: ms, 95: ms, ...}.
+
+    Для пустой гистограммы значения None.
+    """
+    total = sum(histogram.values())
+    if not total:
+        return {point: None for point in points}
+
+    result = {}
+    targets = sorted(points)
+    seen = 0
+    position = 0
+    for index in sorted(histogram):
+        seen += histogram[index]
+        while position < len(targets) and seen >= total * targets[position] / 100:
+            result[targets[position]] = bucket_value(index)
+            position += 1
+        if position == len(targets):
+            break
+    return result
@@ -0,0 +1,274 @@
+"""
+Идемпотентные повторы записи по заголовку Idempotency-Key.
+
+Клиент генерирует ключ (например, UUID) на каждую логическую операцию и
+повторяет запрос с тем же ключом после таймаута. Первый ответ сохраняется,
+повтор получает его из хранилища с заголовком Idempotent-Replayed: true,
+не выполняя запись и не обращаясь к базе (кроме аутентификации).
+
+* ключ действует в пределах пользователя, метода и пути;
+* тот же ключ с другим телом запроса - 422;
+* пока первый запрос выполняется, повтор получает 409 и Retry-After;
+* ответы 5xx и исключения не сохраняются - их можно повторить.
+
+Без заголовка запрос обрабатывается как обычно. Настройки:
+
+    CHAT_HISTORY_IDEMPOTENCY = {
+        'enabled': True,
+        'backend': 'local',     # 'local' - LRU в памяти процесса, 'cache' - алиас из CACHES
+        'alias': 'default',
+        'max_entries': 10000,   # для 'local'
+        'timeout': 86400,       # сколько секунд хранится ответ
+        'lock_timeout': 60,     # сколько секунд ключ считается выполняемым
+    }
+
+Бэкенд 'local' работает только в пределах процесса. При нескольких
+воркерах нужен общий кэш ('cache' с Redis или Memcached): блокировка
+опирается на атомарный cache.add.
+"""
+import functools
+import hashlib
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+
+from .caching import CACHE_PREFIX, DjangoCacheStore, LocalLRUStore
+
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+DEFAULTS = {
+    'enabled': True, 'backend': 'local', 'alias': 'default',
+    'max_entries': 10000, 'timeout': 86400, 'lock_timeout': 60,
+}
+
+# Результаты begin()
+NEW, REPLAY, IN_PROGRESS, MISMATCH = 'new', 'replay', 'in_progress', 'mismatch'
+
+
+def get_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'CHAT_HISTORY_IDEMPOTENCY', None) or {})
+    return options
+
+
+class IdempotencyStore:
+    """Сохраненные ответы и блокировки выполняемых ключей"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stored = 0
+        self.replayed = 0
+        self.conflicts = 0
+        self._store = None
+        self._options = None
+
+    @property
+    def store(self):
+        options = get_options()
+        key = (options['backend'], options['alias'], options['max_entries'])
+        if self._store is None or key != self._options:
+            if options['backend'] == 'cache':
+                self._store = DjangoCacheStore(options['alias'])
+            else:
+                self._store = LocalLRUStore(options['max_entries'])
+            self._options = key
+        return self._store
+
+    def _count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def begin(self, key, fingerprint):
+        """
+        (NEW, None) - ключ захвачен, запрос нужно выполнить;
+        (REPLAY, (status, payload)) - сохраненный ответ;
+        (IN_PROGRESS, None) или (MISMATCH, None) - ошибка клиента.
+        """
+        options = get_options()
+        store = self.store
+        pending = {'fingerprint': fingerprint, 'pending': True}
+        if store.add(key, pending, options['lock_timeout']):
+            return NEW, None
+        entry = store.get(key)
+        if entry is None:
+            # Запись истекла между add и get - пробуем захватить еще раз
+            if store.add(key, pending, options['lock_timeout']):
+                return NEW, None
+            entry = store.get(key) or pending
+        if entry['fingerprint'] != fingerprint:
+            self._count('conflicts')
+            return MISMATCH, None
+        if entry.get('pending'):
+            self._count('conflicts')
+            return IN_PROGRESS, None
+        self._count('replayed')
+        return REPLAY, (entry['status'], entry['payload'])
+
+    def complete(self, key, fingerprint, status_code, payload):
+        if status_code >= 500:
+            self.abort(key)
+            return
+        self.store.set(key, {
+            'fingerprint': fingerprint, 'status': status_code, 'payload': payload
+        }, get_options()['timeout'])
+        self._count('stored')
+
+    def abort(self, key):
+        self.store.delete(key)
+
+
+store = IdempotencyStore()
+
+
+def storage_key(user_id, method, path, key):
+    digest = hashlib.sha256(f'{method}:{path}:{key}'.encode()).hexdigest()
+    return f'{CACHE_PREFIX}:idempotency:{user_id}:{digest}'
+
+
+def fingerprint(body):
+    return hashlib.sha256(body or b'').hexdigest()
+
+
+def get_key(request):
+    """Ключ из заголовка; ValueError, если он некорректен"""
+    key = request.headers.get(HEADER)
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+        raise ValueError(f'Некорректный заголовок {HEADER}')
+    return key
+
+
+def has_stored_response(request):
+    """
+    Есть ли сохраненный ответ для ключа запроса: повтор не выполнит запись,
+    поэтому троттлинг его пропускает (ответ - тот же, что и в первый раз).
+    """
+    if not get_options()['enabled']:
+        return False
+    try:
+        key = get_key(request)
+    except ValueError:
+        return False
+    if key is None:
+        return False
+    entry = store.store.get(storage_key(request.user.pk, request.method, request.path, key))
+    return entry is not None and not entry.get('pending')
+
+
+def plain(data):
+    """ReturnDict/ReturnList без ссылки на сериализатор (и его объекты)"""
+    if isinstance(data, dict):
+        return dict(data)
+    if isinstance(data, list):
+        return list(data)
+    return data
+
+
+def error_payload(result):
+    if result == MISMATCH:
+        return status.HTTP_422_UNPROCESSABLE_ENTITY, {
+            'success': False,
+            'error': f'{HEADER} уже использован с другим телом запроса'
+        }
+    return status.HTTP_409_CONFLICT, {
+        'success': False,
+        'error': f'Запрос с этим {HEADER} еще выполняется'
+    }
+
+
+def idempotent(view):
+    """
+    Декоратор функции-представления DRF (ставится под @api_view):
+    сохраняет ответ по Idempotency-Key и отдает его при повторе.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not get_options()['enabled']:
+            return view(request, *args, **kwargs)
+        try:
+            key = get_key(request)
+        except ValueError as e:
+            return Response({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if key is None:
+            return view(request, *args, **kwargs)
+
+        # Тело читается до разбора request.data, DRF затем возьмет его из памяти
+        body_fingerprint = fingerprint(request.body)
+        cache_key = storage_key(request.user.pk, request.method, request.path, key)
+        result, stored = store.begin(cache_key, body_fingerprint)
+        if result == REPLAY:
+            status_code, data = stored
+            return Response(data, status=status_code, headers={REPLAYED_HEADER: 'true'})
+        if result != NEW:
+            status_code, data = error_payload(result)
+            return Response(data, status=status_code, headers={'Retry-After': '1'} if result == IN_PROGRESS else None)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            store.abort(cache_key)
+            raise
+        if hasattr(response, 'data'):
+            store.complete(cache_key, body_fingerprint, response.status_code, plain(response.data))
+        else:
+            store.abort(cache_key)
+        return response
+    return wrapper
+
+
+def async_idempotent(view):
+    """
+    То же для async-представлений (ставится под @async_api_view):
+    сохраняется готовое тело ответа.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not get_options()['enabled']:
+            return await view(request, *args, **kwargs)
+        try:
+            key = get_key(request)
+        except ValueError as e:
+            return _json_error(status.HTTP_400_BAD_REQUEST, {'success': False, 'error': str(e)})
+        if key is None:
+            return await view(request, *args, **kwargs)
+
+        body_fingerprint = fingerprint(request.body)
+        cache_key = storage_key(request.user.pk, request.method, request.path, key)
+        result, stored = await sync_to_async(store.begin)(cache_key, body_fingerprint)
+        if result == REPLAY:
+            status_code, (content, content_type) = stored
+            response = HttpResponse(content, status=status_code, content_type=content_type)
+            response[REPLAYED_HEADER] = 'true'
+            return response
+        if result != NEW:
+            response = _json_error(*error_payload(result))
+            if result == IN_PROGRESS:
+                response['Retry-After'] = '1'
+            return response
+
+        try:
+            response = await view(request, *args, **kwargs)
+        except BaseException:
+            await sync_to_async(store.abort)(cache_key)
+            raise
+        if getattr(response, 'streaming', False):
+            await sync_to_async(store.abort)(cache_key)
+        else:
+            payload = (response.content, response['Content-Type'])
+            await sync_to_async(store.complete)(cache_key, body_fingerprint, response.status_code, payload)
+        return response
+    return wrapper
+
+
+def _json_error(status_code, data):
+    return HttpResponse(json.dumps(data, ensure_ascii=False), status=status_code, content_type='application/json')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_history import metaquery
+
+
+class Command(BaseCommand):
+    help = 'Создает индексы для фильтров по metadata сообщений (?meta.<ключ>=)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--drop', action='store_true',
+            help='Удалить все индексы metadata'
+        )
+
+    def handle(self, *args, **options):
+        if options['drop']:
+            names = metaquery.uninstall()
+            self.stdout.write(self.style.SUCCESS(f'Удалено индексов metadata: {len(names)}'))
+            return
+
+        try:
+            names = metaquery.install()
+        except (NotImplementedError, ValueError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Индексы metadata готовы: {', '.join(names) or 'нет'}"
+        ))
@@ -0,0 +1,33 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_history import search
+
+
+class Command(BaseCommand):
+    help = 'Создает или перестраивает полнотекстовый индекс истории чатов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Перестроить индекс по существующим данным'
+        )
+        parser.add_argument(
+            '--drop', action='store_true',
+            help='Удалить индекс и триггеры'
+        )
+
+    def handle(self, *args, **options):
+        if options['drop']:
+            search.uninstall()
+            self.stdout.write(self.style.SUCCESS('Полнотекстовый индекс удален'))
+            return
+
+        try:
+            backend = search.install(rebuild=options['rebuild'])
+        except (NotImplementedError, ImproperlyConfigured) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Полнотекстовый индекс готов ({backend.vendor})'
+        ))
@@ -0,0 +1,43 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_history import vectors
+from chat_history.models import ChatSession
+
+
+class Command(BaseCommand):
+    help = 'Строит или пополняет локальный векторный индекс сообщений (поиск похожих)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', help='ID пользователя (можно несколько раз)')
+        parser.add_argument('--rebuild', action='store_true', help='Перестроить индекс с нуля')
+        parser.add_argument('--drop', action='store_true', help='Удалить файлы индекса')
+
+    def handle(self, *args, **options):
+        if vectors.np is None:
+            raise CommandError('Для векторного индекса нужен пакет numpy')
+
+        user_ids = options['user']
+        if user_ids:
+            missing = set(user_ids) - set(get_user_model().objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+            if missing:
+                raise CommandError(f"Пользователи не найдены: {', '.join(map(str, sorted(missing)))}")
+        else:
+            user_ids = ChatSession.objects.order_by().values_list('user_id', flat=True).distinct()
+
+        settings = vectors.get_options()
+        total = 0
+        for user_id in user_ids:
+            index = vectors.VectorIndex(user_id, settings)
+            if options['drop']:
+                index.drop()
+                continue
+            added, _ = index.update(rebuild=options['rebuild'])
+            total += added
+            if added:
+                self.stdout.write(f'Пользователь {user_id}: +{added}')
+
+        if options['drop']:
+            self.stdout.write(self.style.SUCCESS('Векторный индекс удален'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Векторный индекс готов, добавлено сообщений: {total}'))
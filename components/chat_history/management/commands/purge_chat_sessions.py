@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_history import archive, streaming
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит давно удаленные (неактивные) сессии в сжатый архив '
+        'и физически удаляет их вместе с сообщениями, порциями; '
+        'завершает брошенные черновики потоковых ответов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days', type=int,
+            help=f'Срок хранения удаленных сессий, по умолчанию '
+                 f'CHAT_HISTORY_RETENTION_DAYS или {archive.DEFAULT_RETENTION_DAYS}'
+        )
+        parser.add_argument('--batch-size', type=int, default=archive.DEFAULT_BATCH_SIZE, help='Сессий в одной транзакции')
+        parser.add_argument('--max-batches', type=int, help='Остановиться после указанного числа порций')
+        parser.add_argument('--sleep', type=float, default=0, help='Пауза между порциями в секундах')
+        parser.add_argument('--no-archive', action='store_true', help='Удалять без сохранения в архив')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, сколько сессий будет удалено')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным')
+
+        queryset = archive.expired_sessions(options['older_than_days'])
+
+        if options['dry_run']:
+            self.stdout.write(f'К удалению: {queryset.count()} сессий')
+            self.stdout.write(f'Брошенных черновиков: {streaming.abandoned_drafts().count()}')
+            return
+
+        finalized, deleted = streaming.sweep_drafts(batch_size=options['batch_size'])
+        if finalized or deleted:
+            self.stdout.write(f'Брошенных черновиков завершено: {finalized}, удалено пустых: {deleted}')
+
+        total_sessions = total_messages = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            sessions, messages = archive.purge_batch(
+                queryset,
+                batch_size=options['batch_size'],
+                archive=not options['no_archive']
+            )
+            if not sessions:
+                break
+            batches += 1
+            total_sessions += sessions
+            total_messages += messages
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Порция {batches}: {sessions} сессий, {messages} сообщений')
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        if not options['no_archive']:
+            conflicts = archive.archive_conflicts(queryset).count()
+            if conflicts:
+                self.stderr.write(f'Пропущено сессий, уже лежащих в архиве: {conflicts}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено сессий: {total_sessions}, сообщений: {total_messages}'
+        ))
@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from chat_history import analytics
+from chat_history.models import ChatSession, local_date
+
+
+class Command(BaseCommand):
+    help = 'Заполняет или пересчитывает дневную аналитику чатов (ChatAnalytics) порциями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Первый день (YYYY-MM-DD), по умолчанию - самая ранняя сессия')
+        parser.add_argument('--until', help='Последний день включительно (YYYY-MM-DD), по умолчанию - сегодня')
+        parser.add_argument('--user', type=int, help='Пересчитать только одного пользователя')
+        parser.add_argument('--chunk-days', type=int, default=7, help='Размер порции в днях')
+
+    def parse_day(self, value, name):
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Некорректная дата {name}: {value}')
+        return day
+
+    def handle(self, *args, **options):
+        if options['chunk_days'] < 1:
+            raise CommandError('--chunk-days должен быть положительным')
+
+        if options['since']:
+            since = self.parse_day(options['since'], '--since')
+        else:
+            first = ChatSession.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            if first is None:
+                self.stdout.write('Нет данных для пересчета')
+                return
+            since = local_date(first)
+
+        until = self.parse_day(options['until'], '--until') if options['until'] else timezone.localdate()
+        if since > until:
+            raise CommandError('--since позже --until')
+
+        written = analytics.rebuild(
+            since, until + timedelta(days=1),
+            user_id=options['user'],
+            chunk_days=options['chunk_days'],
+            log=self.stdout.write if options['verbosity'] > 1 else None
+        )
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано {written} строк аналитики за {since} - {until}'))
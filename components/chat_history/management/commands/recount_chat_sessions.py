@@ -0,0 +1,41 @@
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.core.management.base import BaseCommand
+
+from chat_history.models import ChatMessage, ChatSession
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает total_messages и total_tokens_used сессий по сообщениям '
+        '(для данных, записанных до атомарного учета счетчиков)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Пересчитать только сессии одного пользователя')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Сессий в одном UPDATE')
+
+    def handle(self, *args, **options):
+        messages = ChatMessage.objects.filter(session=OuterRef('pk')).order_by().values('session')
+        message_count = Subquery(messages.annotate(n=Count('id')).values('n'), output_field=IntegerField())
+        token_sum = Subquery(messages.annotate(n=Sum('tokens_used')).values('n'), output_field=IntegerField())
+
+        sessions = ChatSession.objects.order_by('pk')
+        if options['user']:
+            sessions = sessions.filter(user_id=options['user'])
+
+        updated = 0
+        last_pk = None
+        while True:
+            batch = sessions if last_pk is None else sessions.filter(pk__gt=last_pk)
+            pks = list(batch.values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            # updated_at не трогаем: пересчет не должен менять порядок сессий
+            updated += ChatSession.objects.filter(pk__in=pks).update(
+                total_messages=Coalesce(message_count, 0),
+                total_tokens_used=Coalesce(token_sum, 0),
+            )
+            last_pk = pks[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано сессий: {updated}'))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_history import archive, search
+from chat_history.models import ChatSession, ChatSessionArchive
+
+
+class Command(BaseCommand):
+    help = 'Восстанавливает сессии чата из холодного архива'
+
+    def add_arguments(self, parser):
+        parser.add_argument('session_ids', nargs='*', help='ID архивных сессий')
+        parser.add_argument('--user', type=int, help='Восстановить все архивные сессии пользователя')
+        parser.add_argument('--activate', action='store_true', help='Сделать восстановленные сессии активными')
+
+    def handle(self, *args, **options):
+        archives = ChatSessionArchive.objects.all()
+        if options['session_ids']:
+            archives = archives.filter(id__in=options['session_ids'])
+        elif options['user']:
+            archives = archives.filter(user_id=options['user'])
+        else:
+            raise CommandError('Укажите ID сессий или --user')
+
+        restored = 0
+        for item in archives.iterator():
+            if ChatSession.objects.filter(id=item.id).exists():
+                self.stderr.write(f'Сессия {item.id} уже существует, пропускаем')
+                continue
+            session_id, messages = archive.restore(item, activate=options['activate'])
+            restored += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{session_id}: {messages} сообщений')
+
+        if restored and search.verify() is False:
+            # Восстановленные строки должны попасть в индекс триггерами
+            search.install(rebuild=True)
+            self.stderr.write('Полнотекстовый индекс расходился с данными и перестроен')
+
+        self.stdout.write(self.style.SUCCESS(f'Восстановлено сессий: {restored}'))
@@ -0,0 +1,69 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_history.benchmarks import baseline, micro
+from chat_history.models import ChatMessage, ChatSession
+
+
+class Command(BaseCommand):
+    help = 'Микробенчмарки представлений и сериализаторов с сравнением с базовыми результатами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--user', type=int, help='id пользователя (по умолчанию - с наибольшим числом сессий)')
+        parser.add_argument('--only', action='append', help='Префикс имени бенчмарка, например chat. или serializer.')
+        parser.add_argument('--writes', action='store_true', help='Включить сценарии записи (откатываются)')
+        parser.add_argument('--save', nargs='?', const=baseline.BASELINE_PATH, help='Сохранить как базовые результаты')
+        parser.add_argument('--compare', nargs='?', const=baseline.BASELINE_PATH, help='Сравнить с базовыми результатами')
+        parser.add_argument('--tolerance', type=float, default=baseline.DEFAULT_TOLERANCE,
+                            help='Допустимое замедление (доля), по умолчанию 0.25')
+        parser.add_argument('--json', action='store_true', help='Вывести результаты в JSON')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations должен быть положительным')
+        user = None
+        if options['user']:
+            user = get_user_model().objects.filter(pk=options['user']).first()
+            if user is None:
+                raise CommandError(f'Пользователь {options["user"]} не найден')
+
+        try:
+            results = micro.run_all(
+                user=user,
+                iterations=options['iterations'],
+                only=options['only'],
+                writes=options['writes'],
+                log=None if options['json'] else self.stdout.write
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False, indent=2))
+        if options['save']:
+            dataset = {
+                'sessions': ChatSession.objects.count(),
+                'messages': ChatMessage.objects.count(),
+            }
+            baseline.save(results, options['save'], dataset=dataset)
+            self.stdout.write(self.style.SUCCESS(f'Базовые результаты записаны в {options["save"]}'))
+        if options['compare']:
+            base = baseline.load(options['compare'])['results']
+            if options['only']:
+                base = {name: row for name, row in base.items()
+                        if any(name.startswith(prefix) for prefix in options['only'])}
+            rows = baseline.compare(results, base, options['tolerance'])
+            self.stdout.write(baseline.format_rows(rows))
+            failed = baseline.regressions(rows)
+            if failed:
+                raise CommandError(f'Регрессии: {", ".join(row[0] for row in failed)}')
+            missing = baseline.stale(rows)
+            if missing:
+                raise CommandError(
+                    f'Базовые результаты устарели, нет замеров: {", ".join(row[0] for row in missing)}. '
+                    f'Перезапишите их: run_chat_benchmarks --writes --save'
+                )
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat_history.benchmarks import data
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими пользователями, сессиями, сообщениями и врачами для замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Число пользователей')
+        parser.add_argument('--sessions', type=int, default=20, help='Среднее число сессий на пользователя')
+        parser.add_argument('--messages', type=int, default=12, help='Среднее число сообщений в сессии')
+        parser.add_argument('--doctors', type=int, default=0, help='Скольким пользователям создать профиль врача')
+        parser.add_argument('--days', type=int, default=90, help='За сколько дней распределить историю')
+        parser.add_argument('--seed', type=int, default=1, help='Зерно генератора (одинаковое - одинаковые данные)')
+        parser.add_argument('--clear', action='store_true', help='Удалить ранее сгенерированные данные')
+
+    def handle(self, *args, **options):
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        if options['clear']:
+            data.clear(log=self.stdout.write)
+            return
+        for name in ('users', 'sessions', 'messages', 'days'):
+            if options[name] < 1:
+                raise CommandError(f'--{name} должен быть положительным')
+        if not 0 <= options['doctors'] <= options['users']:
+            raise CommandError('--doctors должен быть от 0 до --users')
+
+        totals = data.generate(
+            users=options['users'],
+            sessions_per_user=options['sessions'],
+            messages_per_session=options['messages'],
+            doctors=options['doctors'],
+            days=options['days'],
+            seed=options['seed'],
+            log=log
+        )
+        self.stdout.write(self.style.SUCCESS(
+            'Создано: пользователей {users}, сессий {sessions}, сообщений {messages}, врачей {doctors}'.format(**totals)
+        ))
@@ -0,0 +1,230 @@
+"""
+Фильтры по ChatMessage.metadata: ?meta.<ключ>=<значение>.
+
+    GET sessions/?meta.analysis_type=radiology       - сессии, где есть такое сообщение
+    GET sessions/<id>/messages/history/?meta.has_image=true
+
+Несколько значений одного ключа объединяются через OR, разные ключи - через
+AND (все условия к одному сообщению). Значения true/false и числа
+сравниваются как JSON-типы, строку из цифр можно передать в кавычках:
+meta.code="042". Ключи - латиница, цифры и _, вложенные ключи не
+поддерживаются.
+
+Индексы создает команда ``manage.py chat_metadata_index``:
+
+* PostgreSQL - GIN (jsonb_path_ops) по всему metadata для любых ключей
+  (поиск через @>) и B-tree по (session_id, metadata -> 'ключ') для
+  горячих ключей;
+* SQLite - индексы по (session_id, json_extract(metadata, '$."ключ"'))
+  для горячих ключей, остальные ключи фильтруются без индекса.
+
+Горячие ключи задаются настройкой:
+
+    CHAT_HISTORY_METADATA = {
+        'indexed_keys': ['model', 'analysis_type', 'has_image'],
+    }
+
+Сжатые документы metadata (см. fields) для фильтров не видны.
+"""
+import json
+import re
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import BooleanField, Exists, F, Func, OuterRef, Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .models import ChatMessage, ChatSession
+
+
+PARAM_PREFIX = 'meta.'
+MAX_FILTERS = 5
+MAX_VALUES = 20
+INDEX_PREFIX = 'chat_messages_meta_'
+
+DEFAULTS = {'indexed_keys': ['model', 'analysis_type', 'has_image']}
+
+_KEY_RE = re.compile(r'^[A-Za-z0-9_]{1,40}$')
+_NUMBER_RE = re.compile(r'^-?\d+(\.\d+)?$')
+
+
+def get_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'CHAT_HISTORY_METADATA', None) or {})
+    return options
+
+
+def indexed_keys():
+    keys = list(get_options()['indexed_keys'])
+    for key in keys:
+        if not _KEY_RE.match(key):
+            raise ValueError(f'Недопустимый ключ metadata в CHAT_HISTORY_METADATA: {key!r}')
+    return keys
+
+
+def parse_value(raw):
+    """Значение из query-параметра: true/false, число или строка"""
+    if raw in ('true', 'false'):
+        return raw == 'true'
+    if _NUMBER_RE.match(raw):
+        return float(raw) if '.' in raw else int(raw)
+    if len(raw) >= 2 and raw[0] == raw[-1] == '"':
+        return raw[1:-1]
+    return raw
+
+
+def parse_filters(params):
+    """
+    [(ключ, [значения])] из параметров meta.*; ValueError при
+    некорректном ключе или слишком большом числе условий.
+    """
+    filters = []
+    for name, raw_values in params.lists():
+        if not name.startswith(PARAM_PREFIX):
+            continue
+        key = name[len(PARAM_PREFIX):]
+        if not _KEY_RE.match(key):
+            raise ValueError(f'Некорректный ключ metadata: {key!r}')
+        if len(raw_values) > MAX_VALUES:
+            raise ValueError(f'Не больше {MAX_VALUES} значений для {name}')
+        filters.append((key, [parse_value(value) for value in raw_values]))
+    if len(filters) > MAX_FILTERS:
+        raise ValueError(f'Не больше {MAX_FILTERS} фильтров metadata')
+    return filters
+
+
+class MetadataMatch(Func):
+    """
+    metadata[key] IN values в виде, совпадающем с выражением индекса.
+
+    Ключ подставляется в SQL литералом (он проверен по _KEY_RE): с
+    параметром вместо литерала СУБД не узнает выражение индекса.
+    """
+
+    conditional = True
+    output_field = BooleanField()
+
+    def __init__(self, key, values, indexed=True):
+        super().__init__(F('metadata'))
+        self.key = key
+        self.values = list(values)
+        self.indexed = indexed
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        column, params = compiler.compile(self.source_expressions[0])
+        if self.indexed:
+            placeholders = ', '.join(['%s::jsonb'] * len(self.values))
+            sql = f"({column} -> '{self.key}') IN ({placeholders})"
+            return sql, [*params, *(json.dumps(value) for value in self.values)]
+        # Остальные ключи - через GIN (jsonb_path_ops поддерживает @>)
+        sql = ' OR '.join([f'{column} @> %s::jsonb'] * len(self.values))
+        values = []
+        for value in self.values:
+            values += [*params, json.dumps({self.key: value})]
+        return f'({sql})', values
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        column, params = compiler.compile(self.source_expressions[0])
+        placeholders = ', '.join(['%s'] * len(self.values))
+        sql = f"JSON_EXTRACT({column}, '$.\"{self.key}\"') IN ({placeholders})"
+        # json_extract возвращает true/false как 1/0
+        return sql, [*params, *(int(value) if isinstance(value, bool) else value for value in self.values)]
+
+
+def condition(key, values, using='default'):
+    if connections[using].vendor in ('postgresql', 'sqlite'):
+        return MetadataMatch(key, values, indexed=key in indexed_keys())
+    return Q(**{f'metadata__{key}__in': values})
+
+
+def filter_messages(queryset, filters):
+    """Сообщения, подходящие под все фильтры"""
+    return queryset.filter(*[condition(key, values, queryset.db) for key, values in filters])
+
+
+def filter_sessions(queryset, filters):
+    """Сессии, в которых есть сообщение, подходящее под все фильтры"""
+    messages = ChatMessage.objects.using(queryset.db).filter(session=OuterRef('pk'))
+    return queryset.filter(Exists(filter_messages(messages, filters)))
+
+
+class MetadataFilterBackend(BaseFilterBackend):
+    """Фильтр DRF по параметрам meta.* для сессий и сообщений"""
+
+    def filter_queryset(self, request, queryset, view):
+        try:
+            filters = parse_filters(request.query_params)
+        except ValueError as e:
+            raise ValidationError({'meta': str(e)})
+        if not filters:
+            return queryset
+        if queryset.model is ChatSession:
+            return filter_sessions(queryset, filters)
+        return filter_messages(queryset, filters)
+
+
+def _index_name(key):
+    return f'{INDEX_PREFIX}{key}'
+
+
+def install_sql(vendor, keys):
+    if vendor == 'postgresql':
+        statements = [
+            f'CREATE INDEX IF NOT EXISTS "{INDEX_PREFIX}gin" '
+            'ON chat_messages USING gin (metadata jsonb_path_ops)'
+        ]
+        statements += [
+            f'CREATE INDEX IF NOT EXISTS "{_index_name(key)}" '
+            f"ON chat_messages (session_id, (metadata -> '{key}'))"
+            for key in keys
+        ]
+        return statements
+    if vendor == 'sqlite':
+        return [
+            f'CREATE INDEX IF NOT EXISTS "{_index_name(key)}" '
+            f"ON chat_messages (session_id, JSON_EXTRACT(metadata, '$.\"{key}\"'))"
+            for key in keys
+        ]
+    raise NotImplementedError(f'Индексы metadata не поддерживаются для {vendor}')
+
+
+def existing_indexes(cursor):
+    if connection.vendor == 'postgresql':
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'chat_messages' "
+            "AND indexname LIKE %s", [INDEX_PREFIX.replace('_', '\\_') + '%']
+        )
+    else:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'chat_messages' "
+            "AND name LIKE %s ESCAPE '\\'", [INDEX_PREFIX.replace('_', '\\_') + '%']
+        )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def install():
+    """
+    Создает индексы для горячих ключей (идемпотентно) и удаляет индексы
+    ключей, убранных из настройки. Возвращает имена созданных индексов.
+    """
+    keys = indexed_keys()
+    statements = install_sql(connection.vendor, keys)
+    wanted = {_index_name(key) for key in keys} | {f'{INDEX_PREFIX}gin'}
+    with connection.cursor() as cursor:
+        for name in existing_indexes(cursor):
+            if name not in wanted:
+                cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+        for sql in statements:
+            cursor.execute(sql)
+        return existing_indexes(cursor)
+
+
+def uninstall():
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        return []
+    with connection.cursor() as cursor:
+        names = existing_indexes(cursor)
+        for name in names:
+            cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+    return names
@@ -0,0 +1,50 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import profiling
+
+
+class ProfilingMiddleware:
+    """
+    Собирает метрики запроса (см. profiling). Подключается в MIDDLEWARE
+    первым, чтобы учитывать время остальных middleware:
+
+        MIDDLEWARE = ['chat_history.middleware.ProfilingMiddleware', ...]
+
+    Работает и в синхронном, и в асинхронном режиме без переключения потоков.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        profiling.install()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile, token = profiling.start()
+        if profile is None:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            profiling.cancel(token)
+            raise
+        profiling.finish(profile, token, request, response)
+        return response
+
+    async def __acall__(self, request):
+        profile, token = profiling.start()
+        if profile is None:
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            profiling.cancel(token)
+            raise
+        profiling.finish(profile, token, request, response)
+        return response
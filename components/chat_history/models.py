@@ -1,10 +1,44 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Case, F, Sum, Value, When
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from collections import Counter, defaultdict
 import uuid
 
+from . import histograms, ratelimit
+from .caching import bump_user_version_on_commit
+from .fields import CompressedTextField, DecompressingJSONField
+
 User = get_user_model()
 
+
+def local_date(value):
+    """Дата в текущем часовом поясе (для aware и naive datetime)"""
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def increment_counters(model, lookup, counters):
+    """
+    Атомарный upsert: прибавляет counters к строке, найденной по lookup.
+    
+    Сначала UPDATE через F(); если строки еще нет - INSERT в savepoint,
+    а при гонке с параллельным INSERT повторяем UPDATE.
+    """
+    counters = {field: value for field, value in counters.items() if value}
+    if not counters:
+        return
+    
+    updates = {field: F(field) + value for field, value in counters.items()}
+    rows = model.objects.filter(**lookup)
+    if rows.update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **counters)
+    except IntegrityError:
+        rows.update(**updates)
+
+
 class ChatSession(models.Model):
     """Модель для хранения сессий чата с ИИ"""
     
@@ -26,6 +60,10 @@ class ChatSession(models.Model):
         indexes = [
             models.Index(fields=['user', '-updated_at']),
             models.Index(fields=['user', 'is_active']),
+            # Поиск давно удаленных сессий для очистки
+            models.Index(fields=['is_active', 'updated_at']),
+            # Сортировка и переход по датам в админке
+            models.Index(fields=['created_at', 'id']),
         ]
     
     def __str__(self):
@@ -33,15 +71,73 @@ class ChatSession(models.Model):
     
     def update_last_message_preview(self):
         """Обновляет превью последнего сообщения"""
-        last_message = self.messages.filter(role='assistant').order_by('-created_at').first()
+        last_message = self.messages.filter(role='assistant').only('content').order_by('-created_at').first()
         if last_message:
-            self.last_message_preview = last_message.content[:100] + ('...' if len(last_message.content) > 100 else '')
+            self.last_message_preview = self.make_preview(last_message.content)
         self.save(update_fields=['last_message_preview', 'updated_at'])
     
     def update_message_count(self):
         """Обновляет счетчик сообщений"""
         self.total_messages = self.messages.count()
         self.save(update_fields=['total_messages', 'updated_at'])
+    
+    @staticmethod
+    def make_preview(content):
+        """Превью сообщения для списка сессий"""
+        return content[:100] + ('...' if len(content) > 100 else '')
+    
+    @staticmethod
+    def make_title(content):
+        """Заголовок сессии из первого пользовательского сообщения"""
+        return content[:50] + ('...' if len(content) > 50 else '')
+    
+    @classmethod
+    def register_messages(cls, session, messages):
+        """
+        Учитывает новые сообщения одним атомарным UPDATE: счетчики
+        увеличиваются через F(), превью и заголовок берутся из переданных
+        сообщений без повторных запросов. Безопасно при параллельной записи.
+        Дневная аналитика пользователя обновляется здесь же.
+        """
+        messages = list(messages)
+        if not messages:
+            return 0
+        
+        tokens = sum(m.tokens_used or 0 for m in messages)
+        updates = {
+            'total_messages': F('total_messages') + len(messages),
+            'total_tokens_used': F('total_tokens_used') + tokens,
+            'updated_at': timezone.now(),
+        }
+        
+        assistant = [m for m in messages if m.role == 'assistant']
+        if assistant:
+            updates['last_message_preview'] = cls.make_preview(assistant[-1].content)
+        
+        # Заголовок задается пользовательским сообщением, если после него
+        # в сессии не больше двух сообщений; условие проверяется в самом UPDATE
+        title_rules = [
+            When(total_messages__lte=1 - position, then=Value(cls.make_title(m.content)))
+            for position, m in enumerate(messages[:2])
+            if m.role == 'user' and m.content.strip()
+        ]
+        if title_rules:
+            updates['title'] = Case(*reversed(title_rules), default=F('title'))
+        
+        updated = cls.objects.filter(pk=session.pk).update(**updates)
+        # Токены пользователя: дневной агрегат в ChatAnalytics и счетчик лимита
+        ChatAnalytics.record_messages(session.user_id, messages)
+        # Лимит и версия кэша меняются только после фиксации транзакции
+        ratelimit.record_tokens(session.user_id, tokens)
+        bump_user_version_on_commit(session.user_id)
+        return updated
+    
+    def save(self, *args, **kwargs):
+        is_new = self._state.adding
+        super().save(*args, **kwargs)
+        if is_new:
+            ChatAnalytics.increment(self.user_id, local_date(self.created_at), total_sessions=1)
+        bump_user_version_on_commit(self.user_id)
 
 
 class ChatMessage(models.Model):
@@ -56,7 +152,7 @@ class ChatMessage(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
     role = models.CharField(max_length=20, choices=ROLE_CHOICES)
-    content = models.TextField(help_text="Содержимое сообщения")
+    content = CompressedTextField(help_text="Содержимое сообщения")
     created_at = models.DateTimeField(auto_now_add=True)
     
     # Метаданные сообщения
@@ -66,7 +162,7 @@ class ChatMessage(models.Model):
     response_time_ms = models.PositiveIntegerField(null=True, blank=True, help_text="Время ответа в миллисекундах")
     
     # Дополнительные данные
-    metadata = models.JSONField(default=dict, blank=True, help_text="Дополнительные метаданные")
+    metadata = DecompressingJSONField(default=dict, blank=True, help_text="Дополнительные метаданные")
     
     class Meta:
         db_table = 'chat_messages'
@@ -74,17 +170,18 @@ class ChatMessage(models.Model):
         indexes = [
             models.Index(fields=['session', 'created_at']),
             models.Index(fields=['session', 'role']),
+            models.Index(fields=['created_at', 'id']),
         ]
     
     def __str__(self):
         return f"{self.get_role_display()} - {self.content[:50]}..."
     
     def save(self, *args, **kwargs):
+        is_new = self._state.adding
         super().save(*args, **kwargs)
-        # Обновляем счетчики в сессии
-        self.session.update_message_count()
-        if self.role == 'assistant':
-            self.session.update_last_message_preview()
+        # Обновляем счетчики в сессии одним запросом
+        if is_new:
+            ChatSession.register_messages(self.session, [self])
 
 
 class ChatAnalytics(models.Model):
@@ -112,3 +209,98 @@ class ChatAnalytics(models.Model):
     
     def __str__(self):
         return f"{self.user} - {self.date} - {self.total_messages} сообщений"
+    
+    @classmethod
+    def increment(cls, user_id, date, **counters):
+        """Атомарно прибавляет значения к строке (user, date)"""
+        increment_counters(cls, {'user_id': user_id, 'date': date}, counters)
+    
+    @classmethod
+    def message_counters(cls, message):
+        """Вклад одного сообщения в дневные счетчики"""
+        return {
+            'total_messages': 1,
+            'total_tokens': message.tokens_used or 0,
+            'total_response_time_ms': message.response_time_ms or 0,
+            'user_messages': int(message.role == 'user'),
+            'assistant_messages': int(message.role == 'assistant'),
+            'error_messages': int(message.is_error),
+            'fallback_messages': int(message.is_fallback),
+        }
+    
+    @classmethod
+    def record_messages(cls, user_id, messages):
+        """Добавляет сообщения в дневные агрегаты: один upsert на каждый день"""
+        by_date = defaultdict(Counter)
+        for message in messages:
+            by_date[local_date(message.created_at)].update(cls.message_counters(message))
+        for date, counters in by_date.items():
+            cls.increment(user_id, date, **counters)
+        ChatResponseTimeBucket.record_messages(user_id, messages)
+
+
+class ChatResponseTimeBucket(models.Model):
+    """
+    Гистограмма времени ответа: число сообщений пользователя за день,
+    попавших в лог-линейный бакет (см. histograms). Гистограммы за любой
+    диапазон дат получаются суммированием счетчиков по бакетам.
+    """
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_response_time_buckets')
+    date = models.DateField()
+    bucket = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        db_table = 'chat_response_time_buckets'
+        unique_together = ['user', 'date', 'bucket']
+        ordering = ['date', 'bucket']
+    
+    def __str__(self):
+        lower, upper = histograms.bucket_bounds(self.bucket)
+        return f"{self.user} - {self.date} - {lower}-{upper} мс: {self.count}"
+    
+    @classmethod
+    def record_messages(cls, user_id, messages):
+        by_date = defaultdict(list)
+        for message in messages:
+            if message.response_time_ms is not None:
+                by_date[local_date(message.created_at)].append(message.response_time_ms)
+        for date, values in by_date.items():
+            for bucket, count in histograms.build(values).items():
+                increment_counters(cls, {'user_id': user_id, 'date': date, 'bucket': bucket}, {'count': count})
+    
+    @classmethod
+    def histogram(cls, user_id, date_from=None, date_to=None):
+        """Объединенная гистограмма {bucket: count} за диапазон дат"""
+        rows = cls.objects.filter(user_id=user_id)
+        if date_from:
+            rows = rows.filter(date__gte=date_from)
+        if date_to:
+            rows = rows.filter(date__lte=date_to)
+        return Counter(dict(
+            rows.values('bucket').annotate(total=Sum('count')).values_list('bucket', 'total').order_by()
+        ))
+
+
+class ChatSessionArchive(models.Model):
+    """Холодный архив удаленных сессий: сессия и сообщения в сжатом JSON"""
+    
+    id = models.UUIDField(primary_key=True, editable=False, help_text="ID исходной сессии")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_session_archives')
+    title = models.CharField(max_length=200)
+    created_at = models.DateTimeField(help_text="Создание исходной сессии")
+    deleted_at = models.DateTimeField(help_text="Последнее изменение сессии перед архивацией")
+    archived_at = models.DateTimeField(auto_now_add=True)
+    total_messages = models.PositiveIntegerField(default=0)
+    payload = models.BinaryField(help_text="zlib(JSON) с полями сессии и сообщений")
+    
+    class Meta:
+        db_table = 'chat_session_archives'
+        ordering = ['-archived_at']
+        indexes = [
+            models.Index(fields=['user', '-archived_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user} - {self.title[:50]} (архив)"
@@ -0,0 +1,228 @@
+import base64
+import binascii
+import json
+import uuid
+from collections import OrderedDict
+
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(position, direction='next'):
+    """Кодирует позицию (datetime, id) в непрозрачную строку курсора"""
+    value, pk = position
+    payload = json.dumps({'v': value.isoformat(), 'i': str(pk), 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Возвращает ((datetime, id), direction) или бросает ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        value = parse_datetime(payload['v'])
+        if value is None or payload['d'] not in ('next', 'prev'):
+            raise ValueError
+        return (value, uuid.UUID(payload['i'])), payload['d']
+    except (TypeError, KeyError, ValueError, AttributeError, UnicodeDecodeError, binascii.Error):
+        raise ValueError('Некорректный курсор')
+
+
+def keyset_filter(field, position, after):
+    """
+    Условие (field, id) > position или (field, id) < position.
+
+    Записывается через OR, чтобы использовать составной индекс на любой СУБД.
+    """
+    value, pk = position
+    op = 'gt' if after else 'lt'
+    return Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': pk})
+
+
+def message_window(queryset, before=None, after=None, limit=50):
+    """
+    Окно сообщений по ключу (created_at, id) в хронологическом порядке.
+
+    Без курсоров возвращает последние limit сообщений. before/after -
+    позиции (created_at, id), относительно которых берутся более старые или
+    более новые сообщения. Возвращает (messages, has_older, has_newer).
+    """
+    if after is not None:
+        rows = list(
+            queryset.filter(keyset_filter('created_at', after, after=True))
+            .order_by('created_at', 'id')[:limit + 1]
+        )
+        has_newer = len(rows) > limit
+        return rows[:limit], True, has_newer
+
+    if before is not None:
+        queryset = queryset.filter(keyset_filter('created_at', before, after=False))
+    rows = list(queryset.order_by('-created_at', '-id')[:limit + 1])
+    has_older = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return rows, has_older, before is not None
+
+
+def row_position(row, field):
+    """Позиция (field, id) модели или строки .values()"""
+    if isinstance(row, dict):
+        return row[field], row['id']
+    return getattr(row, field), row.pk
+
+
+def message_cursor(message):
+    return encode_cursor(row_position(message, 'created_at'))
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная пагинация по ключу (ordering_field, id) в порядке убывания.
+
+    Стоимость страницы не зависит от ее номера: нет OFFSET и COUNT(*),
+    каждая страница - это диапазонное чтение по индексу.
+    """
+    ordering_field = 'updated_at'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Некорректный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                position, direction = decode_cursor(cursor)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+        else:
+            position, direction = None, 'next'
+
+        field = self.ordering_field
+        forward = direction == 'next'
+        if forward:
+            queryset = queryset.order_by(f'-{field}', '-id')
+        else:
+            queryset = queryset.order_by(field, 'id')
+        if position is not None:
+            queryset = queryset.filter(keyset_filter(field, position, after=not forward))
+
+        # Одна лишняя запись показывает, есть ли продолжение в этом направлении
+        page = list(queryset[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if not forward:
+            page.reverse()
+
+        self.next_position = self.previous_position = None
+        if page:
+            first = row_position(page[0], field)
+            last = row_position(page[-1], field)
+            if forward:
+                self.next_position = last if has_more else None
+                self.previous_position = first if position is not None else None
+            else:
+                self.next_position = last
+                self.previous_position = first if has_more else None
+
+        return page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_cursor_link(self, position, direction):
+        if position is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, encode_cursor(position, direction))
+
+    def get_next_link(self):
+        return self.get_cursor_link(self.next_position, 'next')
+
+    def get_previous_link(self):
+        return self.get_cursor_link(self.previous_position, 'prev')
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+def estimate_rows(model, using='default'):
+    """
+    Примерное число строк таблицы без COUNT(*) или None:
+    PostgreSQL - статистика планировщика, SQLite - sqlite_stat1 после
+    ANALYZE, иначе MAX(rowid) (без учета удаленных строк).
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            # -1 - таблицу еще не анализировали
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+                row = cursor.fetchone()
+            except DatabaseError:
+                row = None
+            if row:
+                return int(row[0].split()[0])
+            cursor.execute(f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+            return cursor.fetchone()[0] or 0
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator без полного COUNT(*) на больших таблицах (админка).
+
+    Без фильтров число строк берется из статистики СУБД, если оно больше
+    exact_limit. С фильтрами строки считаются не дальше exact_limit: при
+    большем числе совпадений доступны только первые exact_limit строк.
+    """
+
+    exact_limit = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is None:
+            return super().count
+        if not query.where:
+            estimate = estimate_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.exact_limit:
+                return estimate
+            return super().count
+        return queryset.order_by().values('pk')[:self.exact_limit].count()
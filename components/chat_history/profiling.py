@@ -0,0 +1,259 @@
+"""
+Профилирование запросов по именам URL: число и время SQL-запросов, время
+сериализации DRF, размер ответа и общая длительность.
+
+Данные собирает ProfilingMiddleware (chat_history.middleware) и отдает
+эндпоинт metrics в текстовом формате Prometheus. Настройки:
+
+    CHAT_HISTORY_PROFILING = {
+        'enabled': True,
+        'slow_request_ms': 500,    # None - без журнала медленных запросов
+        'max_logged_queries': 50,  # SQL-запросов в записи журнала
+    }
+
+SQL учитывается через execute_wrapper соединений, сериализация - по
+внешнему вызову .data сериализаторов chat_history (ProfiledSerializerMixin,
+ProfiledListSerializer) и быстрых функций с serializer_timer; вложенные
+вызовы не считаются дважды. Классы DRF и сериализаторы других приложений
+не меняются. Текст SQL сохраняется только если включен журнал медленных
+запросов. Счетчики живут в памяти процесса, как и статистика кэша списка.
+"""
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework import serializers
+
+
+logger = logging.getLogger('chat_history.profiling')
+
+DEFAULTS = {'enabled': True, 'slow_request_ms': 500, 'max_logged_queries': 50}
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_current = contextvars.ContextVar('chat_history_profile', default=None)
+
+
+def get_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'CHAT_HISTORY_PROFILING', None) or {})
+    return options
+
+
+class RequestProfile:
+    """Счетчики одного запроса"""
+
+    __slots__ = ('started', 'sql_count', 'sql_time', 'serializer_time', 'serializer_depth', 'queries', 'max_queries')
+
+    def __init__(self, max_queries=0):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.queries = [] if max_queries else None
+        self.max_queries = max_queries
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        profile.sql_count += 1
+        profile.sql_time += elapsed
+        if profile.queries is not None and len(profile.queries) < profile.max_queries:
+            profile.queries.append((sql, elapsed))
+
+
+@contextmanager
+def serializer_timer():
+    """Время блока (или функции, как декоратор) учитывается как сериализация"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    profile.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.serializer_depth -= 1
+        if not profile.serializer_depth:
+            profile.serializer_time += time.perf_counter() - started
+
+
+class ProfiledSerializerMixin:
+    """Время .data попадает в профиль запроса"""
+
+    @property
+    def data(self):
+        with serializer_timer():
+            return super().data
+
+
+class ProfiledListSerializer(ProfiledSerializerMixin, serializers.ListSerializer):
+    """Для Meta.list_serializer_class: many=True создает ListSerializer, а не дочерний класс"""
+
+
+def _add_wrapper(connection, **kwargs):
+    if sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_wrapper)
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install():
+    """Подключает обертку SQL к новым соединениям (один раз на процесс)"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        connection_created.connect(_add_wrapper, dispatch_uid='chat_history_profiling')
+        _installed = True
+
+
+def start():
+    """Начинает профиль запроса; возвращает (profile, token) или (None, None)"""
+    options = get_options()
+    if not options['enabled']:
+        return None, None
+    # Соединения, открытые до install() или в другом потоке (async ORM),
+    # получают обертку здесь и в connection_created
+    for connection in connections.all(initialized_only=True):
+        _add_wrapper(connection)
+    max_queries = options['max_logged_queries'] if options['slow_request_ms'] is not None else 0
+    profile = RequestProfile(max_queries)
+    return profile, _current.set(profile)
+
+
+def cancel(token):
+    _current.reset(token)
+
+
+def finish(profile, token, request, response):
+    _current.reset(token)
+    duration = time.perf_counter() - profile.started
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match else 'unresolved'
+
+    if response.has_header('Content-Length'):
+        size = int(response['Content-Length'])
+    elif not getattr(response, 'streaming', False):
+        size = len(response.content)
+    else:
+        size = 0
+
+    slow_ms = get_options()['slow_request_ms']
+    slow = slow_ms is not None and duration * 1000 >= slow_ms
+    registry.record(view, request.method, duration, profile, size, slow)
+
+    if slow:
+        logger.warning(
+            'Медленный запрос %s %s (%s): %.0f мс, SQL %d за %.0f мс, сериализация %.0f мс, %d байт\n%s',
+            request.method, request.path, view, duration * 1000,
+            profile.sql_count, profile.sql_time * 1000, profile.serializer_time * 1000, size,
+            '\n'.join(f'  {elapsed * 1000:.1f} мс: {sql}' for sql, elapsed in profile.queries or [])
+        )
+
+
+class MetricsRegistry:
+    """Накопленные метрики по (имя URL, метод)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, method, duration, profile, size, slow):
+        with self.lock:
+            row = self.views.get((view, method))
+            if row is None:
+                row = self.views[(view, method)] = {
+                    'requests': 0, 'duration': 0.0, 'buckets': [0] * len(DURATION_BUCKETS),
+                    'sql_queries': 0, 'sql_time': 0.0, 'serializer_time': 0.0,
+                    'response_bytes': 0, 'slow': 0,
+                }
+            row['requests'] += 1
+            row['duration'] += duration
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    row['buckets'][index] += 1
+                    break
+            row['sql_queries'] += profile.sql_count
+            row['sql_time'] += profile.sql_time
+            row['serializer_time'] += profile.serializer_time
+            row['response_bytes'] += size
+            row['slow'] += int(slow)
+
+    def snapshot(self):
+        with self.lock:
+            return {key: dict(row, buckets=list(row['buckets'])) for key, row in self.views.items()}
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+
+registry = MetricsRegistry()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+COUNTERS = [
+    ('view_requests_total', 'requests', 'Число запросов'),
+    ('view_sql_queries_total', 'sql_queries', 'Число SQL-запросов'),
+    ('view_sql_duration_seconds_total', 'sql_time', 'Время SQL-запросов'),
+    ('view_serializer_duration_seconds_total', 'serializer_time', 'Время сериализации DRF'),
+    ('view_response_bytes_total', 'response_bytes', 'Размер ответов'),
+    ('view_slow_requests_total', 'slow', 'Число медленных запросов'),
+]
+
+
+def render_prometheus(extra=()):
+    """
+    Метрики в текстовом формате Prometheus 0.0.4.
+
+    extra - дополнительные строки (name, type, help, [(labels, value)]).
+    """
+    views = sorted(registry.snapshot().items())
+    lines = []
+    for name, field, help_text in COUNTERS:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for (view, method), row in views:
+            lines.append(f'{name}{_labels(view=view, method=method)} {row[field]}')
+
+    name = 'view_request_duration_seconds'
+    lines.append(f'# HELP {name} Длительность запроса')
+    lines.append(f'# TYPE {name} histogram')
+    for (view, method), row in views:
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS, row['buckets']):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(view=view, method=method, le=bound)} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(view=view, method=method, le="+Inf")} {row["requests"]}')
+        lines.append(f'{name}_sum{_labels(view=view, method=method)} {row["duration"]}')
+        lines.append(f'{name}_count{_labels(view=view, method=method)} {row["requests"]}')
+
+    for name, metric_type, help_text, samples in extra:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for labels, value in samples:
+            lines.append(f'{name}{_labels(**labels) if labels else ""} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,195 @@
+"""
+Ограничение частоты записи в чат по пользователю.
+
+Два лимита, оба настраиваются и по умолчанию выключены:
+
+    CHAT_HISTORY_RATE_LIMITS = {
+        'requests_per_second': 2,     # скорость пополнения ведра запросов
+        'burst': 10,                  # емкость ведра (допустимый всплеск)
+        'tokens_per_day': 200000,     # токенов ИИ на пользователя в сутки
+        'backend': 'cache',           # 'local' - в памяти процесса, 'cache' - общий Django cache
+        'cache_alias': 'default',
+    }
+
+Бэкенд 'local' - ведро токенов в пределах одного процесса. Бэкенд 'cache'
+общий для всех воркеров: то же ведро в виде GCRA на атомарном incr кэша.
+
+Оба лимита проверяются до расхода: запрос, отклоненный дневным лимитом,
+не забирает токен из ведра запросов (check_write_limits).
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+
+KEY_PREFIX = 'chat_history:ratelimit'
+LOCAL_MAX_KEYS = 10000
+
+
+class LocalBackend:
+    """Ведро токенов в памяти процесса, ограниченное LOCAL_MAX_KEYS ключами (LRU)"""
+
+    def __init__(self, max_keys=LOCAL_MAX_KEYS):
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+        self.counters = OrderedDict()
+
+    def _remember(self, store, key, value):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > self.max_keys:
+            store.popitem(last=False)
+
+    def take(self, key, rate, capacity, cost=1):
+        """Забирает cost из ведра; возвращает 0 или сколько секунд ждать"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens < cost:
+                self._remember(self.buckets, key, (tokens, now))
+                return (cost - tokens) / rate
+            self._remember(self.buckets, key, (tokens - cost, now))
+            return 0
+
+    def incr(self, key, amount, timeout):
+        now = time.monotonic()
+        with self.lock:
+            value, expires = self.counters.get(key, (0, now + timeout))
+            if expires <= now:
+                value, expires = 0, now + timeout
+            self._remember(self.counters, key, (value + amount, expires))
+            return value + amount
+
+    def get(self, key):
+        with self.lock:
+            value, expires = self.counters.get(key, (0, 0))
+            return value if expires > time.monotonic() else 0
+
+
+class CacheBackend:
+    """Общий для процессов лимит на Django cache (Redis, Memcached и т.п.)"""
+
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+
+    def take(self, key, rate, capacity, cost=1):
+        """
+        Ведро токенов в виде GCRA: ключ хранит теоретическое время прихода
+        (TAT, мс), и TAT - now = (capacity - tokens) / rate. Пополнение
+        считается при чтении, расход - один атомарный incr. Ключ живет, пока
+        TAT в будущем, поэтому отсутствие ключа означает полное ведро.
+        """
+        now = int(time.time() * 1000)
+        interval = 1000 / rate
+        step = math.ceil(cost * interval)
+        tolerance = capacity * interval
+        if self.cache.add(key, now + step, timeout=math.ceil(step / 1000) + 1):
+            tat = now + step
+        else:
+            try:
+                tat = self.cache.incr(key, step)
+            except ValueError:
+                # Ключ вытеснен между add и incr - ведро полное
+                self.cache.set(key, now + step, timeout=math.ceil(step / 1000) + 1)
+                tat = now + step
+            if tat - step < now:
+                # TAT прошел раньше, чем истек ключ: отсчет от now, а не от старого TAT
+                tat = self.cache.incr(key, now - (tat - step))
+        if tat - now > tolerance:
+            # Отказ ведро не расходует
+            self.cache.decr(key, step)
+            return (tat - now - tolerance) / 1000
+        self.cache.touch(key, timeout=math.ceil((tat - now) / 1000) + 1)
+        return 0
+
+    def incr(self, key, amount, timeout):
+        self.cache.add(key, 0, timeout=timeout)
+        try:
+            return self.cache.incr(key, amount)
+        except ValueError:
+            self.cache.set(key, amount, timeout=timeout)
+            return amount
+
+    def get(self, key):
+        return self.cache.get(key, 0)
+
+
+_local_backend = LocalBackend()
+
+
+def get_limits():
+    return getattr(settings, 'CHAT_HISTORY_RATE_LIMITS', None) or {}
+
+
+def get_backend(limits=None):
+    limits = get_limits() if limits is None else limits
+    if limits.get('backend', 'cache') == 'local':
+        return _local_backend
+    return CacheBackend(limits.get('cache_alias', 'default'))
+
+
+def daily_tokens_key(user_id, day=None):
+    day = day or timezone.localdate()
+    return f'{KEY_PREFIX}:tokens:{user_id}:{day.isoformat()}'
+
+
+def seconds_until_tomorrow():
+    now = timezone.localtime() if settings.USE_TZ else datetime.now()
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    if settings.USE_TZ:
+        tomorrow = timezone.make_aware(tomorrow)
+    return max((tomorrow - now).total_seconds(), 1)
+
+
+def check_request_rate(user_id):
+    """0, если запрос разрешен, иначе сколько секунд ждать"""
+    limits = get_limits()
+    rate = limits.get('requests_per_second')
+    if not rate:
+        return 0
+    capacity = limits.get('burst') or max(rate, 1)
+    return get_backend(limits).take(f'{KEY_PREFIX}:requests:{user_id}', rate, capacity)
+
+
+def check_daily_tokens(user_id):
+    """0, если дневной лимит токенов не исчерпан, иначе сколько секунд ждать"""
+    limits = get_limits()
+    limit = limits.get('tokens_per_day')
+    if not limit:
+        return 0
+    if get_backend(limits).get(daily_tokens_key(user_id)) >= limit:
+        return seconds_until_tomorrow()
+    return 0
+
+
+def check_write_limits(user_id):
+    """
+    Оба лимита записи: 0 или сколько секунд ждать. Дневной лимит только
+    читается и проверяется первым, чтобы отклоненный им запрос не расходовал
+    ведро запросов.
+    """
+    return check_daily_tokens(user_id) or check_request_rate(user_id)
+
+
+def record_tokens(user_id, tokens, using=None):
+    """
+    Учитывает потраченные токены в дневном лимите пользователя после
+    фиксации транзакции: откаченная запись лимит не расходует.
+    """
+    limits = get_limits()
+    if not tokens or not limits.get('tokens_per_day'):
+        return
+    backend = get_backend(limits)
+    transaction.on_commit(
+        lambda: backend.incr(daily_tokens_key(user_id), tokens, timeout=2 * 24 * 3600),
+        using=using, robust=True
+    )
@@ -0,0 +1,383 @@
+"""
+Полнотекстовый поиск по истории чатов.
+
+Индекс поддерживается самой базой данных, поэтому обновляется инкрементально
+при любой записи (save, bulk_create, update):
+
+* PostgreSQL - GIN-индексы по выражению to_tsvector('simple', ...) для
+  chat_messages.content и chat_sessions.title;
+* SQLite - таблицы FTS5 с внешним содержимым и триггерами синхронизации.
+
+Для остальных СУБД поиск откатывается на icontains (см. views).
+FullTextMatch - то же условие без ранжирования для обычных queryset
+(поиск в админке). Индекс создается и перестраивается командой ``manage.py chat_search_index``.
+"""
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, NotSupportedError, connection, transaction
+from django.db.models import BooleanField, F, Func
+from django.utils.html import escape
+
+from .fields import compression_algorithm
+from .models import ChatSession
+
+
+SNIPPET_START = '<mark>'
+SNIPPET_STOP = '</mark>'
+
+# СУБД размечает совпадения символами из области частного использования,
+# текст экранируется в Python и только потом они заменяются на теги
+MATCH_START = '\ue000'
+MATCH_STOP = '\ue001'
+
+# Совпадение в заголовке весит больше, чем совпадение в тексте сообщения
+TITLE_WEIGHT = 2.0
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Таблица -> (индексируемое поле, таблица FTS5)
+FULLTEXT_FIELDS = {
+    'chat_messages': ('content', 'chat_message_fts'),
+    'chat_sessions': ('title', 'chat_session_fts'),
+}
+
+
+class PostgresSearchBackend:
+    """tsvector + GIN по выражению, без дополнительных таблиц"""
+
+    vendor = 'postgresql'
+
+    install_sql = [
+        "CREATE INDEX IF NOT EXISTS chat_messages_content_fts "
+        "ON chat_messages USING gin (to_tsvector('simple', content))",
+        "CREATE INDEX IF NOT EXISTS chat_sessions_title_fts "
+        "ON chat_sessions USING gin (to_tsvector('simple', title))",
+    ]
+
+    drop_sql = [
+        "DROP INDEX IF EXISTS chat_messages_content_fts",
+        "DROP INDEX IF EXISTS chat_sessions_title_fts",
+    ]
+
+    rebuild_sql = [
+        "REINDEX INDEX chat_messages_content_fts",
+        "REINDEX INDEX chat_sessions_title_fts",
+    ]
+
+    # Индекс по выражению не расходится с таблицей
+    check_sql = []
+
+    search_sql = """
+        WITH q AS (SELECT websearch_to_tsquery('simple', %s) AS query),
+        hit AS (
+            SELECT m.session_id, m.content AS body,
+                   ts_rank(to_tsvector('simple', m.content), q.query) AS score
+            FROM chat_messages m
+            JOIN chat_sessions s ON s.id = m.session_id, q
+            WHERE s.user_id = %s AND s.is_active = %s
+              AND to_tsvector('simple', m.content) @@ q.query
+            UNION ALL
+            SELECT s.id, s.title,
+                   ts_rank(to_tsvector('simple', s.title), q.query) * %s
+            FROM chat_sessions s, q
+            WHERE s.user_id = %s AND s.is_active = %s
+              AND to_tsvector('simple', s.title) @@ q.query
+        ),
+        best AS (
+            SELECT DISTINCT ON (hit.session_id) hit.session_id, hit.body, hit.score
+            FROM hit
+            ORDER BY hit.session_id, hit.score DESC
+        )
+        SELECT page.session_id, page.score, ts_headline('simple', page.body, q.query, %s)
+        FROM (
+            SELECT * FROM best ORDER BY score DESC, session_id LIMIT %s OFFSET %s
+        ) page, q
+        ORDER BY page.score DESC, page.session_id
+    """
+
+    def is_installed(self, cursor):
+        # Запрос корректен и без индексов, они лишь ускоряют его
+        return True
+
+    def search_params(self, user_id, query, limit, offset):
+        headline_options = (
+            f'StartSel={MATCH_START}, StopSel={MATCH_STOP}, '
+            'MaxFragments=1, MaxWords=24, MinWords=8'
+        )
+        return [query, user_id, True, TITLE_WEIGHT, user_id, True, headline_options, limit, offset]
+
+    def normalize(self, score):
+        return float(score)
+
+
+class SQLiteSearchBackend:
+    """FTS5 с внешним содержимым, синхронизируется триггерами"""
+
+    vendor = 'sqlite'
+
+    install_sql = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chat_message_fts USING fts5("
+        "content, content='chat_messages', content_rowid='rowid', "
+        "tokenize='unicode61 remove_diacritics 2')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chat_session_fts USING fts5("
+        "title, content='chat_sessions', content_rowid='rowid', "
+        "tokenize='unicode61 remove_diacritics 2')",
+        """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ai AFTER INSERT ON chat_messages BEGIN
+            INSERT INTO chat_message_fts(rowid, content) VALUES (new.rowid, new.content);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ad AFTER DELETE ON chat_messages BEGIN
+            INSERT INTO chat_message_fts(chat_message_fts, rowid, content)
+            VALUES ('delete', old.rowid, old.content);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_au AFTER UPDATE OF content ON chat_messages BEGIN
+            INSERT INTO chat_message_fts(chat_message_fts, rowid, content)
+            VALUES ('delete', old.rowid, old.content);
+            INSERT INTO chat_message_fts(rowid, content) VALUES (new.rowid, new.content);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS chat_sessions_fts_ai AFTER INSERT ON chat_sessions BEGIN
+            INSERT INTO chat_session_fts(rowid, title) VALUES (new.rowid, new.title);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS chat_sessions_fts_ad AFTER DELETE ON chat_sessions BEGIN
+            INSERT INTO chat_session_fts(chat_session_fts, rowid, title)
+            VALUES ('delete', old.rowid, old.title);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS chat_sessions_fts_au AFTER UPDATE OF title ON chat_sessions BEGIN
+            INSERT INTO chat_session_fts(chat_session_fts, rowid, title)
+            VALUES ('delete', old.rowid, old.title);
+            INSERT INTO chat_session_fts(rowid, title) VALUES (new.rowid, new.title);
+        END""",
+    ]
+
+    drop_sql = [
+        "DROP TRIGGER IF EXISTS chat_messages_fts_ai",
+        "DROP TRIGGER IF EXISTS chat_messages_fts_ad",
+        "DROP TRIGGER IF EXISTS chat_messages_fts_au",
+        "DROP TRIGGER IF EXISTS chat_sessions_fts_ai",
+        "DROP TRIGGER IF EXISTS chat_sessions_fts_ad",
+        "DROP TRIGGER IF EXISTS chat_sessions_fts_au",
+        "DROP TABLE IF EXISTS chat_message_fts",
+        "DROP TABLE IF EXISTS chat_session_fts",
+    ]
+
+    # rowid неявный и может измениться после VACUUM - тогда нужен rebuild
+    rebuild_sql = [
+        "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+        "INSERT INTO chat_session_fts(chat_session_fts) VALUES ('rebuild')",
+    ]
+
+    # rank = 1: сверка с таблицей-источником, а не только целостность индекса
+    check_sql = [
+        "INSERT INTO chat_message_fts(chat_message_fts, rank) VALUES ('integrity-check', 1)",
+        "INSERT INTO chat_session_fts(chat_session_fts, rank) VALUES ('integrity-check', 1)",
+    ]
+
+    # Пользователь проверяется внутри ветвей: bm25 и snippet считаются только
+    # для его строк, а не для совпадений по всей базе. Голые столбцы рядом
+    # с MIN() берутся из строки с минимальным значением
+    search_sql = """
+        SELECT hit.session_id, MIN(hit.score) AS score, hit.snippet
+        FROM (
+            SELECT m.session_id AS session_id,
+                   bm25(chat_message_fts) AS score,
+                   snippet(chat_message_fts, 0, %s, %s, '…', 16) AS snippet
+            FROM chat_message_fts
+            JOIN chat_messages m ON m.rowid = chat_message_fts.rowid
+            JOIN chat_sessions s ON s.id = m.session_id
+            WHERE chat_message_fts MATCH %s AND s.user_id = %s AND s.is_active = %s
+            UNION ALL
+            SELECT s.id,
+                   bm25(chat_session_fts) * %s,
+                   snippet(chat_session_fts, 0, %s, %s, '…', 16)
+            FROM chat_session_fts
+            JOIN chat_sessions s ON s.rowid = chat_session_fts.rowid
+            WHERE chat_session_fts MATCH %s AND s.user_id = %s AND s.is_active = %s
+        ) AS hit
+        GROUP BY hit.session_id
+        ORDER BY score, hit.session_id
+        LIMIT %s OFFSET %s
+    """
+
+    def is_installed(self, cursor):
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' "
+            "AND name IN ('chat_message_fts', 'chat_session_fts')"
+        )
+        return cursor.fetchone()[0] == 2
+
+    def search_params(self, user_id, query, limit, offset):
+        match = self.to_match_expression(query)
+        return [
+            MATCH_START, MATCH_STOP, match, user_id, True,
+            TITLE_WEIGHT, MATCH_START, MATCH_STOP, match, user_id, True,
+            limit, offset,
+        ]
+
+    def normalize(self, score):
+        # bm25 возвращает отрицательные значения: чем меньше, тем релевантнее
+        return -float(score)
+
+    @staticmethod
+    def to_match_expression(query):
+        """Экранирует ввод пользователя: все слова обязательны, последнее - по префиксу"""
+        words = _WORD_RE.findall(query)
+        if not words:
+            return None
+        terms = [f'"{word}"' for word in words]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+
+BACKENDS = {
+    backend.vendor: backend
+    for backend in (PostgresSearchBackend(), SQLiteSearchBackend())
+}
+
+_installed = {}
+
+
+def get_backend():
+    """Бэкенд для текущей СУБД или None, если полнотекстовый индекс недоступен"""
+    backend = BACKENDS.get(connection.vendor)
+    if backend is None:
+        return None
+    if connection.alias not in _installed:
+        with connection.cursor() as cursor:
+            _installed[connection.alias] = backend.is_installed(cursor)
+    return backend if _installed[connection.alias] else None
+
+
+def install(rebuild=False):
+    """Создает индекс (идемпотентно) и при необходимости перестраивает его"""
+    backend = BACKENDS.get(connection.vendor)
+    if backend is None:
+        raise NotImplementedError(f'Полнотекстовый поиск не поддерживается для {connection.vendor}')
+    if compression_algorithm() is not None:
+        # Триггеры индексировали бы сжатый base64 вместо текста
+        raise ImproperlyConfigured('Полнотекстовый индекс несовместим с CHAT_HISTORY_COMPRESSION')
+    with connection.cursor() as cursor:
+        for sql in backend.install_sql:
+            cursor.execute(sql)
+        if rebuild:
+            for sql in backend.rebuild_sql:
+                cursor.execute(sql)
+    _installed.pop(connection.alias, None)
+    return backend
+
+
+def verify():
+    """
+    Проверяет, что индекс совпадает с данными (например, после
+    восстановления из архива). None - индекс не установлен.
+    """
+    backend = get_backend()
+    if backend is None:
+        return None
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            for sql in backend.check_sql:
+                cursor.execute(sql)
+    except DatabaseError:
+        return False
+    return True
+
+
+def uninstall():
+    backend = BACKENDS.get(connection.vendor)
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        for sql in backend.drop_sql:
+            cursor.execute(sql)
+    _installed.pop(connection.alias, None)
+
+
+class FullTextMatch(Func):
+    """
+    Совпадение поля с запросом по полнотекстовому индексу: в PostgreSQL -
+    выражение индекса, в SQLite - rowid из таблицы FTS5.
+    """
+
+    conditional = True
+    output_field = BooleanField()
+
+    def __init__(self, field, query, any_word=False):
+        super().__init__(F(field))
+        self.query = query
+        # Любое из слов (по префиксу) вместо всех слов запроса
+        self.any_word = any_word
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(f'Полнотекстовый поиск не поддерживается для {connection.vendor}')
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        column, params = compiler.compile(self.source_expressions[0])
+        if self.any_word:
+            # Слова из \w+ не содержат операторов tsquery
+            query = ' | '.join(f'{word}:*' for word in _WORD_RE.findall(self.query))
+            return f"to_tsvector('simple', {column}) @@ to_tsquery('simple', %s)", [*params, query]
+        sql = f"to_tsvector('simple', {column}) @@ websearch_to_tsquery('simple', %s)"
+        return sql, [*params, self.query]
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        column = self.source_expressions[0]
+        _, fts_table = FULLTEXT_FIELDS[column.target.model._meta.db_table]
+        alias = compiler.quote_name_unless_alias(column.alias)
+        sql = f'{alias}.rowid IN (SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH %s)'
+        if self.any_word:
+            return sql, [' OR '.join(f'"{word}"*' for word in _WORD_RE.findall(self.query))]
+        return sql, [SQLiteSearchBackend.to_match_expression(self.query)]
+
+
+def match(model, query, any_word=False):
+    """
+    Условие для queryset ChatMessage (content) или ChatSession (title);
+    None, если индекс не установлен или в запросе нет слов.
+    """
+    if not _WORD_RE.search(query) or get_backend() is None:
+        return None
+    field, _ = FULLTEXT_FIELDS[model._meta.db_table]
+    return FullTextMatch(field, query, any_word)
+
+
+def highlight(snippet):
+    """
+    HTML-фрагмент: текст сообщения экранирован, совпадения в <mark>.
+    Символы-разделители в самом тексте тоже станут <mark> - другой
+    разметки так не вставить.
+    """
+    if snippet is None:
+        return None
+    return escape(snippet).replace(MATCH_START, SNIPPET_START).replace(MATCH_STOP, SNIPPET_STOP)
+
+
+def search_sessions(user, query, limit=20, offset=0):
+    """
+    Ранжированный поиск по сессиям пользователя.
+
+    Возвращает список кортежей (session, rank, snippet) в порядке
+    релевантности или None, если индекс не установлен.
+    """
+    backend = get_backend()
+    if backend is None:
+        return None
+
+    params = backend.search_params(user.pk, query, limit, offset)
+    if None in params:
+        return []
+
+    with connection.cursor() as cursor:
+        cursor.execute(backend.search_sql, params)
+        rows = cursor.fetchall()
+
+    to_python = ChatSession._meta.pk.to_python
+    hits = [
+        (to_python(session_id), backend.normalize(score), highlight(snippet))
+        for session_id, score, snippet in rows
+    ]
+    sessions = ChatSession.objects.in_bulk([session_id for session_id, _, _ in hits])
+    return [
+        (sessions[session_id], rank, snippet)
+        for session_id, rank, snippet in hits
+        if session_id in sessions
+    ]
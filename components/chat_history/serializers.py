@@ -1,11 +1,21 @@
 from rest_framework import serializers
+from rest_framework.settings import ISO_8601, api_settings
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
+from datetime import timezone as dt_timezone
 from .models import ChatSession, ChatMessage, ChatAnalytics
+from .pagination import message_window, message_cursor
+from . import writebehind
+from .profiling import ProfiledListSerializer, ProfiledSerializerMixin, serializer_timer
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
-class ChatMessageSerializer(serializers.ModelSerializer):
+# Сколько последних сообщений отдается вместе с деталями сессии
+DEFAULT_MESSAGES_WINDOW = 50
+
+class ChatMessageSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     timestamp = serializers.SerializerMethodField()
     
     class Meta:
@@ -16,13 +26,14 @@ class ChatMessageSerializer(serializers.ModelSerializer):
             'response_time_ms', 'metadata'
         ]
         read_only_fields = ['id', 'created_at', 'timestamp']
+        list_serializer_class = ProfiledListSerializer
     
     def get_timestamp(self, obj):
         """Возвращает время в формате HH:MM для фронтенда"""
         return obj.created_at.strftime('%H:%M')
 
 
-class ChatSessionListSerializer(serializers.ModelSerializer):
+class ChatSessionListSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для списка сессий (краткая информация)"""
     date = serializers.SerializerMethodField()
     last_message = serializers.CharField(source='last_message_preview', read_only=True)
@@ -34,15 +45,23 @@ class ChatSessionListSerializer(serializers.ModelSerializer):
             'id', 'title', 'date', 'created_at', 'updated_at',
             'last_message', 'messages_count', 'total_tokens_used'
         ]
+        list_serializer_class = ProfiledListSerializer
     
     def get_date(self, obj):
         """Возвращает дату в формате YYYY-MM-DD"""
         return obj.created_at.strftime('%Y-%m-%d')
 
 
-class ChatSessionDetailSerializer(serializers.ModelSerializer):
-    """Сериализатор для детальной информации о сессии"""
-    messages = ChatMessageSerializer(many=True, read_only=True)
+class ChatSessionDetailSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
+    """
+    Сериализатор для детальной информации о сессии.
+    
+    Отдает только последние сообщения (context['messages_limit'], None - все),
+    более ранние подгружаются через окно сообщений по курсору messages_cursor.
+    """
+    messages = serializers.SerializerMethodField()
+    has_more_messages = serializers.SerializerMethodField()
+    messages_cursor = serializers.SerializerMethodField()
     date = serializers.SerializerMethodField()
     last_message = serializers.CharField(source='last_message_preview', read_only=True)
     messages_count = serializers.IntegerField(source='total_messages', read_only=True)
@@ -52,15 +71,41 @@ class ChatSessionDetailSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'title', 'date', 'created_at', 'updated_at',
             'last_message', 'messages_count', 'total_tokens_used',
-            'messages', 'is_active'
+            'messages', 'has_more_messages', 'messages_cursor', 'is_active'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'total_messages', 'total_tokens_used']
     
     def get_date(self, obj):
         return obj.created_at.strftime('%Y-%m-%d')
+    
+    def _get_window(self, obj):
+        # Окно может быть загружено заранее (например, асинхронным ORM)
+        # и передано в context['messages_windows'] = {pk: (messages, has_older)}
+        cache = self.__dict__.setdefault('_windows', dict(self.context.get('messages_windows', {})))
+        if obj.pk not in cache:
+            limit = self.context.get('messages_limit', DEFAULT_MESSAGES_WINDOW)
+            rows = obj.messages.values(*MESSAGE_VALUES)
+            if limit is None:
+                cache[obj.pk] = (list(rows.order_by('created_at', 'id')), False)
+            else:
+                messages, has_older, _ = message_window(rows, limit=limit)
+                cache[obj.pk] = (messages, has_older)
+        return cache[obj.pk]
+    
+    def get_messages(self, obj):
+        messages, _ = self._get_window(obj)
+        return serialize_messages(messages)
+    
+    def get_has_more_messages(self, obj):
+        _, has_older = self._get_window(obj)
+        return has_older
+    
+    def get_messages_cursor(self, obj):
+        messages, has_older = self._get_window(obj)
+        return message_cursor(messages[0]) if has_older else None
 
 
-class ChatSessionCreateSerializer(serializers.ModelSerializer):
+class ChatSessionCreateSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для создания новой сессии"""
     
     class Meta:
@@ -72,7 +117,22 @@ class ChatSessionCreateSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class ChatMessageCreateSerializer(serializers.ModelSerializer):
+class ChatMessageBulkCreateSerializer(ProfiledSerializerMixin, serializers.ListSerializer):
+    """Пакетное создание сообщений: один bulk_create и одно обновление сессии"""
+    
+    def create(self, validated_data):
+        session = self.context['session']
+        messages = [
+            ChatMessage(session=session, **attrs)
+            for attrs in validated_data
+        ]
+        with transaction.atomic():
+            ChatMessage.objects.bulk_create(messages)
+            ChatSession.register_messages(session, messages)
+        return messages
+
+
+class ChatMessageCreateSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для создания нового сообщения"""
     
     class Meta:
@@ -81,15 +141,29 @@ class ChatMessageCreateSerializer(serializers.ModelSerializer):
             'role', 'content', 'tokens_used', 'is_error', 
             'is_fallback', 'response_time_ms', 'metadata'
         ]
+        list_serializer_class = ChatMessageBulkCreateSerializer
     
     def create(self, validated_data):
         session_id = self.context.get('session_id')
         if session_id:
             validated_data['session_id'] = session_id
-        return super().create(validated_data)
+        # При включенном write-behind сообщение уходит в групповую запись
+        return writebehind.save_message(ChatMessage(**validated_data))
+
+
+class ChatMessageFinalizeSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
+    """Сериализатор для завершения потокового сообщения"""
+
+    class Meta:
+        model = ChatMessage
+        fields = [
+            'content', 'tokens_used', 'is_error',
+            'is_fallback', 'response_time_ms', 'metadata'
+        ]
+        extra_kwargs = {'content': {'required': False, 'allow_blank': True}}
 
 
-class ChatAnalyticsSerializer(serializers.ModelSerializer):
+class ChatAnalyticsSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для аналитики чатов"""
     
     class Meta:
@@ -100,9 +174,10 @@ class ChatAnalyticsSerializer(serializers.ModelSerializer):
             'error_messages', 'fallback_messages'
         ]
         read_only_fields = ['date']
+        list_serializer_class = ProfiledListSerializer
 
 
-class ChatStatsSerializer(serializers.Serializer):
+class ChatStatsSerializer(ProfiledSerializerMixin, serializers.Serializer):
     """Сериализатор для общей статистики пользователя"""
     total_sessions = serializers.IntegerField()
     total_messages = serializers.IntegerField()
@@ -111,3 +186,104 @@ class ChatStatsSerializer(serializers.Serializer):
     most_active_day = serializers.CharField()
     sessions_this_week = serializers.IntegerField()
     sessions_this_month = serializers.IntegerField()
+
+
+# Быстрый путь чтения: словари строятся напрямую из строк .values()
+# (или атрибутов моделей) без полей DRF. Вывод совпадает с
+# ChatMessageSerializer / ChatSessionListSerializer байт в байт - это
+# проверяет tests/test_serializers.py, при изменении полей правьте оба места.
+
+MESSAGE_VALUES = (
+    'id', 'role', 'content', 'created_at', 'tokens_used', 'is_error',
+    'is_fallback', 'response_time_ms', 'metadata'
+)
+SESSION_LIST_VALUES = (
+    'id', 'title', 'created_at', 'updated_at', 'last_message_preview',
+    'total_messages', 'total_tokens_used'
+)
+
+
+def datetime_formatter():
+    """
+    Функция форматирования datetime как у serializers.DateTimeField.
+    
+    Часовой пояс определяется один раз на вызов, а не на каждое поле.
+    """
+    output_format = api_settings.DATETIME_FORMAT
+    if output_format is None or output_format.lower() != ISO_8601:
+        field = serializers.DateTimeField()
+        return lambda value, isoformat=None: field.to_representation(value)
+    
+    field_timezone = timezone.get_current_timezone() if settings.USE_TZ else None
+    # База отдает значения в UTC: при TIME_ZONE='UTC' перевод не нужен
+    utc_output = field_timezone is not None and str(field_timezone) in ('UTC', 'Etc/UTC')
+    
+    def to_representation(value, isoformat=None):
+        """isoformat - уже посчитанный value.isoformat(), если есть"""
+        if value is None:
+            return None
+        if utc_output and value.tzinfo is dt_timezone.utc:
+            return (isoformat or value.isoformat())[:-6] + 'Z'
+        if field_timezone is not None:
+            if value.utcoffset() is None:
+                value = timezone.make_aware(value, field_timezone)
+            else:
+                value = value.astimezone(field_timezone)
+        elif value.utcoffset() is not None:
+            value = timezone.make_naive(value, dt_timezone.utc)
+        value = value.isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    
+    return to_representation
+
+
+def as_rows(objects, fields):
+    """Строки .values() пропускаются как есть, модели превращаются в словари"""
+    return [
+        obj if isinstance(obj, dict) else {name: getattr(obj, name) for name in fields}
+        for obj in objects
+    ]
+
+
+@serializer_timer()
+def serialize_messages(rows):
+    """Быстрый аналог ChatMessageSerializer(rows, many=True).data"""
+    fmt = datetime_formatter()
+    result = []
+    for row in as_rows(rows, MESSAGE_VALUES):
+        created_at = row['created_at']
+        isoformat = created_at.isoformat()
+        result.append({
+            'id': str(row['id']),
+            'role': row['role'],
+            'content': row['content'],
+            'created_at': fmt(created_at, isoformat),
+            # strftime('%H:%M') исходного значения, без перевода в часовой пояс
+            'timestamp': isoformat[11:16],
+            'tokens_used': row['tokens_used'],
+            'is_error': row['is_error'],
+            'is_fallback': row['is_fallback'],
+            'response_time_ms': row['response_time_ms'],
+            'metadata': row['metadata'],
+        })
+    return result
+
+
+@serializer_timer()
+def serialize_session_list(rows):
+    """Быстрый аналог ChatSessionListSerializer(rows, many=True).data"""
+    fmt = datetime_formatter()
+    return [
+        {
+            'id': str(row['id']),
+            'title': row['title'],
+            'date': row['created_at'].isoformat()[:10],
+            'created_at': fmt(row['created_at']),
+            'updated_at': fmt(row['updated_at']),
+            'last_message': row['last_message_preview'],
+            'messages_count': row['total_messages'],
+            'total_tokens_used': row['total_tokens_used'],
+        }
+        for row in as_rows(rows, SESSION_LIST_VALUES)
+    ]
+
@@ -0,0 +1,348 @@
+"""
+Потоковое добавление ответа ассистента.
+
+Черновик сообщения создается сразу (metadata['streaming'] = True), но не
+учитывается в счетчиках сессии. Фрагменты ответа копятся в памяти процесса
+и записываются в content периодически - по времени или по объему, а не на
+каждый фрагмент. При завершении сообщение сохраняется окончательно, и
+счетчики, превью и аналитика обновляются один раз (register_messages).
+
+Подписчики получают фрагменты через Server-Sent Events. Настройки:
+
+    CHAT_HISTORY_STREAMING = {
+        'flush_interval': 1.0,    # секунд между записями content в базу
+        'flush_chars': 2000,      # или столько новых символов
+        'idle_timeout': 300,      # черновик без активности выгружается из памяти,
+                                  # а подписчик получает событие error
+        'keepalive': 15,          # секунд между комментариями-пингами SSE
+        'max_lifetime': 120,      # после этого подписка закрывается событием error
+        'draft_max_age': 3600,    # черновик старше этого завершает sweep_drafts
+    }
+
+Подписка SSE занимает синхронный воркер, поэтому max_lifetime короткий:
+после error клиент переподключается с Last-Event-ID, если ответ еще
+генерируется. Черновики, которые клиент так и не завершил, остаются в
+базе до sweep_drafts (команда purge_chat_sessions).
+
+Буфер живет в процессе, открывшем черновик, поэтому запросы одного потока
+нужно направлять в тот же процесс (sticky-сессии). Другой процесс подхватит
+черновик из базы, но потеряет незаписанный хвост. Подписчики из других
+процессов получают текст с частотой записи в базу.
+"""
+import json
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .caching import bump_user_version
+from .models import ChatMessage, ChatSession
+
+
+DEFAULTS = {
+    'flush_interval': 1.0, 'flush_chars': 2000, 'idle_timeout': 300, 'keepalive': 15, 'max_lifetime': 120,
+    'draft_max_age': 3600,
+}
+FINAL_FIELDS = ('tokens_used', 'is_error', 'is_fallback', 'response_time_ms')
+
+
+class StreamFinished(Exception):
+    """Сообщение уже завершено или не является черновиком"""
+
+
+def get_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'CHAT_HISTORY_STREAMING', None) or {})
+    return options
+
+
+class StreamBuffer:
+    """Текст черновика в памяти и уведомление подписчиков о новых фрагментах"""
+
+    def __init__(self, message_id, session_id, user_id, text=''):
+        self.message_id = message_id
+        self.session_id = session_id
+        self.user_id = user_id
+        self.parts = [text] if text else []
+        self.length = len(text)
+        self.flushed_length = self.length
+        self.flushed_at = time.monotonic()
+        self.touched_at = self.flushed_at
+        self.finished = False
+        self.result = None
+        self.condition = threading.Condition()
+
+    @property
+    def text(self):
+        if len(self.parts) > 1:
+            self.parts = [''.join(self.parts)]
+        return self.parts[0] if self.parts else ''
+
+    def append(self, chunk, options):
+        with self.condition:
+            if self.finished:
+                raise StreamFinished()
+            self.parts.append(chunk)
+            self.length += len(chunk)
+            self.touched_at = time.monotonic()
+            due = (self.length - self.flushed_length >= options['flush_chars'] or
+                   self.touched_at - self.flushed_at >= options['flush_interval'])
+            if due:
+                self.flush()
+            self.condition.notify_all()
+            return self.length
+
+    def flush(self):
+        """Записывает накопленный текст; вызывается под self.condition"""
+        if self.length == self.flushed_length:
+            return
+        ChatMessage.objects.filter(pk=self.message_id).update(content=self.text)
+        # update() не трогает updated_at сессии - ETag и кэши страниц сбрасываем версией
+        bump_user_version(self.user_id)
+        self.flushed_length = self.length
+        self.flushed_at = time.monotonic()
+
+    def read(self, offset):
+        """Текст после offset; вызывается под self.condition"""
+        return self.text[offset:] if offset < self.length else ''
+
+
+class StreamRegistry:
+    """Черновики, открытые в этом процессе"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buffers = {}
+
+    def add(self, buffer):
+        with self.lock:
+            self.buffers[buffer.message_id] = buffer
+        self.expire()
+
+    def get(self, message_id):
+        with self.lock:
+            return self.buffers.get(message_id)
+
+    def remove(self, message_id):
+        with self.lock:
+            self.buffers.pop(message_id, None)
+
+    def expire(self):
+        """Записывает и выгружает черновики, брошенные клиентами"""
+        deadline = time.monotonic() - get_options()['idle_timeout']
+        with self.lock:
+            idle = [b for b in self.buffers.values() if b.touched_at < deadline]
+            for buffer in idle:
+                del self.buffers[buffer.message_id]
+        for buffer in idle:
+            with buffer.condition:
+                buffer.flush()
+                buffer.condition.notify_all()
+
+
+registry = StreamRegistry()
+
+
+def drafts():
+    return ChatMessage.objects.filter(metadata__streaming=True)
+
+
+def open_draft(session):
+    """Создает черновик ответа ассистента без обновления счетчиков сессии"""
+    message = ChatMessage(session=session, role='assistant', content='', metadata={'streaming': True})
+    # bulk_create не вызывает ChatMessage.save, счетчики обновятся при завершении
+    ChatMessage.objects.bulk_create([message])
+    registry.add(StreamBuffer(message.pk, session.pk, session.user_id))
+    return message
+
+
+def get_buffer(session, message_id):
+    """Буфер черновика; если черновик открыт другим процессом - загружается из базы"""
+    buffer = registry.get(message_id)
+    if buffer is not None and buffer.session_id == session.pk:
+        return buffer
+    row = drafts().filter(pk=message_id, session=session).values('content').first()
+    if row is None:
+        raise StreamFinished()
+    buffer = StreamBuffer(message_id, session.pk, session.user_id, row['content'])
+    registry.add(buffer)
+    return buffer
+
+
+def append(session, message_id, chunk):
+    """Добавляет фрагмент; возвращает текущую длину текста"""
+    return get_buffer(session, message_id).append(chunk, get_options())
+
+
+def finalize(session, message_id, content=None, metadata=None, **fields):
+    """
+    Завершает черновик: одна запись сообщения и одно обновление сессии.
+
+    content заменяет накопленный текст, если передан. Повторное завершение
+    (в том числе из другого процесса) вызывает StreamFinished.
+    """
+    buffer = get_buffer(session, message_id)
+    with buffer.condition:
+        if buffer.finished:
+            raise StreamFinished()
+        text = buffer.text if content is None else content
+        values = {field: value for field, value in fields.items() if field in FINAL_FIELDS}
+
+        with transaction.atomic():
+            # Условие на флаг черновика защищает от двойного учета
+            updated = drafts().filter(pk=message_id).update(
+                content=text, metadata=metadata or {}, **values
+            )
+            if not updated:
+                raise StreamFinished()
+            message = ChatMessage.objects.get(pk=message_id)
+            ChatSession.register_messages(session, [message])
+
+        buffer.finished = True
+        buffer.parts = [text]
+        buffer.length = buffer.flushed_length = len(text)
+        buffer.result = message
+        buffer.condition.notify_all()
+    registry.remove(message_id)
+    return message
+
+
+def abandoned_drafts(max_age=None):
+    max_age = get_options()['draft_max_age'] if max_age is None else max_age
+    return drafts().filter(created_at__lt=timezone.now() - timedelta(seconds=max_age))
+
+
+def sweep_drafts(max_age=None, batch_size=500):
+    """
+    Завершает черновики старше draft_max_age, брошенные без finalize:
+    пустые удаляются, остальные сохраняются как ответ с ошибкой
+    (metadata['interrupted']) и попадают в счетчики сессии. Возвращает
+    (завершено, удалено).
+    """
+    stale = abandoned_drafts(max_age)
+    deleted, _ = stale.filter(content='').delete()
+    finalized = 0
+    while True:
+        batch = list(stale.select_related('session')[:batch_size])
+        if not batch:
+            break
+        for message in batch:
+            with transaction.atomic():
+                # Как и в finalize, условие на флаг черновика защищает от двойного учета
+                if not drafts().filter(pk=message.pk).update(is_error=True, metadata={'interrupted': True}):
+                    continue
+                message.is_error = True
+                message.metadata = {'interrupted': True}
+                ChatSession.register_messages(message.session, [message])
+            finalized += 1
+    return finalized, deleted
+
+
+def sse_event(event, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False, cls=JSONEncoder)}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def timeout_event(offset, reason):
+    return sse_event('error', {'success': False, 'error': reason}, offset)
+
+
+def events(session, message_id, offset=0, serialize=None):
+    """
+    Генератор SSE: фрагменты после offset (id события - длина текста после
+    фрагмента, подходит для Last-Event-ID), затем событие done с сообщением.
+    Брошенный черновик (idle_timeout) и слишком долгая подписка
+    (max_lifetime) завершают поток событием error.
+    """
+    options = get_options()
+    deadline = time.monotonic() + options['max_lifetime']
+    buffer = registry.get(message_id)
+    if buffer is None or buffer.session_id != session.pk:
+        yield from _poll_events(session, message_id, offset, options, serialize, deadline)
+        return
+
+    while True:
+        with buffer.condition:
+            if not buffer.finished and buffer.length <= offset:
+                buffer.condition.wait(options['keepalive'])
+            text = buffer.read(offset)
+            finished, result = buffer.finished, buffer.result
+            length = buffer.length
+        if text:
+            offset = length
+            yield sse_event('chunk', {'text': text}, offset)
+        if finished:
+            yield sse_event('done', serialize(result) if serialize else {'id': str(message_id)})
+            return
+        if not text:
+            if time.monotonic() >= deadline:
+                yield timeout_event(offset, 'Превышено время подписки, переподключитесь')
+                return
+            # Брошенные черновики выгружаются и без новых подписчиков
+            registry.expire()
+            if registry.get(message_id) is not buffer:
+                # Черновик выгружен по простою - дальше читаем из базы
+                yield from _poll_events(
+                    session, message_id, offset, options, serialize, deadline, buffer.touched_at
+                )
+                return
+            yield b': keepalive\n\n'
+
+
+def _poll_events(session, message_id, offset, options, serialize, deadline, active_at=None):
+    """SSE для черновика из другого процесса: опрос базы с частотой записи"""
+    waited = 0
+    active_at = time.monotonic() if active_at is None else active_at
+    while True:
+        message = ChatMessage.objects.filter(pk=message_id, session=session).first()
+        if message is None:
+            return
+        if len(message.content) > offset:
+            yield sse_event('chunk', {'text': message.content[offset:]}, len(message.content))
+            offset = len(message.content)
+            waited = 0
+            active_at = time.monotonic()
+        if not (message.metadata or {}).get('streaming'):
+            yield sse_event('done', serialize(message) if serialize else {'id': str(message_id)})
+            return
+        now = time.monotonic()
+        if now - active_at >= options['idle_timeout']:
+            yield timeout_event(offset, 'Ответ не генерируется: черновик брошен')
+            return
+        if now >= deadline:
+            yield timeout_event(offset, 'Превышено время подписки, переподключитесь')
+            return
+        time.sleep(options['flush_interval'])
+        waited += options['flush_interval']
+        if waited >= options['keepalive']:
+            waited = 0
+            yield b': keepalive\n\n'
+
+
+def event_stream_response(session, message_id, offset=0, serialize=None):
+    response = StreamingHttpResponse(
+        events(session, message_id, offset, serialize), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Отключает буферизацию ответа в nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Позволяет запросам с Accept: text/event-stream пройти согласование DRF"""
+
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Сюда попадают только ответы с ошибками, сам поток - StreamingHttpResponse
+        return sse_event('error', data)
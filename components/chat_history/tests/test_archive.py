@@ -0,0 +1,75 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from chat_history import archive, streaming
+from chat_history.caching import get_user_version
+from chat_history.models import ChatMessage, ChatSession, ChatSessionArchive
+
+
+class ArchiveTests(TestCase):
+    """Очистка не теряет сессии, занятые в архиве; восстановление сбрасывает кэш"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', 'doctor@example.com', 'pw')
+
+    def setUp(self):
+        cache.clear()
+
+    def deleted_session(self, title):
+        session = ChatSession.objects.create(user=self.user, title=title)
+        ChatMessage.objects.create(session=session, role='user', content=title)
+        ChatSession.objects.filter(pk=session.pk).update(
+            is_active=False, updated_at=timezone.now() - timedelta(days=365)
+        )
+        return session
+
+    def test_conflicting_archive_row_keeps_session(self):
+        kept = self.deleted_session('Кардиология')
+        purged = self.deleted_session('Неврология')
+        ChatSessionArchive.objects.create(
+            id=kept.pk, user=self.user, title='старая копия', created_at=timezone.now(),
+            deleted_at=timezone.now(), total_messages=0, payload=archive.pack({}, []),
+        )
+
+        queryset = archive.expired_sessions()
+        self.assertEqual(archive.purge_batch(queryset), (1, 1))
+        self.assertEqual(archive.purge_batch(queryset), (0, 0))
+        self.assertTrue(ChatMessage.objects.filter(session=kept).exists())
+        self.assertFalse(ChatSession.objects.filter(pk=purged.pk).exists())
+        self.assertEqual(list(archive.archive_conflicts(queryset).values_list('pk', flat=True)), [kept.pk])
+
+    def test_restore_bumps_version_on_commit(self):
+        session = self.deleted_session('Эндокринология')
+        archive.purge_batch(archive.expired_sessions())
+        version = get_user_version(self.user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            archive.restore(ChatSessionArchive.objects.get(pk=session.pk), activate=True)
+        self.assertGreater(get_user_version(self.user.pk), version)
+        self.assertTrue(ChatSession.objects.get(pk=session.pk).is_active)
+
+    def test_purge_finalizes_abandoned_drafts(self):
+        session = ChatSession.objects.create(user=self.user, title='Кардиология')
+        partial = streaming.open_draft(session)
+        streaming.append(session, partial.pk, 'Ритм синусовый')
+        streaming.registry.get(partial.pk).flush()
+        empty = streaming.open_draft(session)
+        fresh = streaming.open_draft(session)
+        ChatMessage.objects.filter(pk__in=[partial.pk, empty.pk]).update(
+            created_at=timezone.now() - timedelta(days=1)
+        )
+
+        call_command('purge_chat_sessions', stdout=StringIO())
+        partial.refresh_from_db()
+        self.assertEqual(partial.metadata, {'interrupted': True})
+        self.assertTrue(partial.is_error)
+        self.assertFalse(ChatMessage.objects.filter(pk=empty.pk).exists())
+        self.assertTrue(streaming.drafts().filter(pk=fresh.pk).exists())
+        self.assertEqual(ChatSession.objects.get(pk=session.pk).total_messages, 1)
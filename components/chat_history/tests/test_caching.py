@@ -0,0 +1,181 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+import api_encoding
+
+from chat_history import idempotency, ratelimit, streaming
+from chat_history.caching import get_user_version
+from chat_history.models import ChatMessage, ChatSession
+
+
+@override_settings(CHAT_HISTORY_RATE_LIMITS={'tokens_per_day': 1000, 'backend': 'cache'})
+class CommitOnlyInvalidationTests(TestCase):
+    """Версия кэша и лимит токенов меняются только после фиксации записи"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', 'doctor@example.com', 'pw')
+        cls.session = ChatSession.objects.create(user=cls.user, title='Кардиология')
+
+    def setUp(self):
+        cache.clear()
+
+    def add_message(self):
+        # save() нового сообщения вызывает ChatSession.register_messages
+        ChatMessage.objects.create(session=self.session, role='user', content='ЭКГ', tokens_used=40)
+
+    def tokens(self):
+        return ratelimit.get_backend().get(ratelimit.daily_tokens_key(self.user.pk))
+
+    def test_bump_waits_for_commit(self):
+        version = get_user_version(self.user.pk)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.add_message()
+            self.assertEqual(get_user_version(self.user.pk), version)
+            self.assertEqual(self.tokens(), 0)
+        for callback in callbacks:
+            callback()
+        self.assertGreater(get_user_version(self.user.pk), version)
+        self.assertEqual(self.tokens(), 40)
+
+    def test_rollback_keeps_version_and_tokens(self):
+        version = get_user_version(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    self.add_message()
+                    raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(get_user_version(self.user.pk), version)
+        self.assertEqual(self.tokens(), 0)
+        self.assertEqual(ChatSession.objects.get(pk=self.session.pk).total_messages, 0)
+
+
+@override_settings(ROOT_URLCONF='chat_history.urls')
+class ConditionalGetTests(TestCase):
+    """ETag зависит от формата ответа: 304 только для того же представления"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', 'doctor@example.com', 'pw')
+        cls.session = ChatSession.objects.create(user=cls.user, title='Кардиология')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_not_modified_for_same_format(self):
+        url = f'/sessions/{self.session.pk}/'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        if api_encoding.msgpack is not None:
+            response = self.client.get(url, HTTP_ACCEPT='application/msgpack', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_same_second_draft_flush_invalidates_etag(self):
+        url = f'/sessions/{self.session.pk}/'
+        first = self.client.get(url)
+        draft = streaming.open_draft(self.session)
+        streaming.append(self.session, draft.pk, 'Ритм синусовый')
+        streaming.registry.get(draft.pk).flush()
+
+        # updated_at сессии не изменился, If-Modified-Since не учитывается
+        response = self.client.get(
+            url, HTTP_IF_NONE_MATCH=first['ETag'], HTTP_IF_MODIFIED_SINCE=first['Last-Modified'],
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified_repeats_weak_etag(self):
+        url = f'/sessions/{self.session.pk}/'
+        etag = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+
+@override_settings(
+    ROOT_URLCONF='chat_history.urls',
+    CHAT_HISTORY_RATE_LIMITS={'tokens_per_day': 50, 'backend': 'cache'},
+)
+class IdempotentReplayThrottleTests(TestCase):
+    """Повтор с сохраненным ответом не упирается в лимиты записи"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', 'doctor@example.com', 'pw')
+        cls.session = ChatSession.objects.create(user=cls.user, title='Кардиология')
+
+    def setUp(self):
+        cache.clear()
+        idempotency.store.store.entries.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, key):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                f'/sessions/{self.session.pk}/messages/',
+                {'role': 'user', 'content': 'ЭКГ', 'tokens_used': 60},
+                format='json', HTTP_IDEMPOTENCY_KEY=key,
+            )
+
+    def test_replay_bypasses_exhausted_limit(self):
+        first = self.post('retry-1')
+        self.assertEqual(first.status_code, 201)
+
+        replay = self.post('retry-1')
+        self.assertEqual(replay.status_code, 201)
+        self.assertEqual(replay[idempotency.REPLAYED_HEADER], 'true')
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(self.post('retry-2').status_code, 429)
+
+
+class CacheTokenBucketTests(TestCase):
+    """Общее ведро пополняется со скоростью rate, а не окнами целиком"""
+
+    def setUp(self):
+        cache.clear()
+        self.backend = ratelimit.CacheBackend()
+        self.now = 1000.0
+        patcher = mock.patch.object(ratelimit.time, 'time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def take(self):
+        return self.backend.take('bucket', rate=1, capacity=3)
+
+    def test_refill_after_burst(self):
+        self.assertEqual([self.take() for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(self.take(), 1)
+
+        self.now += 1
+        self.assertEqual(self.take(), 0)
+        self.assertAlmostEqual(self.take(), 1)
+
+        self.now += 60
+        self.assertEqual([self.take() for _ in range(3)], [0, 0, 0])
+        self.assertGreater(self.take(), 0)
+
+    @override_settings(CHAT_HISTORY_RATE_LIMITS={
+        'requests_per_second': 1, 'burst': 1, 'tokens_per_day': 50, 'backend': 'cache',
+    })
+    def test_daily_rejection_keeps_request_token(self):
+        ratelimit.get_backend().incr(ratelimit.daily_tokens_key(7), 50, timeout=60)
+        self.assertGreater(ratelimit.check_write_limits(7), 0)
+        self.assertGreater(ratelimit.check_write_limits(7), 0)
+
+        cache.delete(ratelimit.daily_tokens_key(7))
+        self.assertEqual(ratelimit.check_write_limits(7), 0)
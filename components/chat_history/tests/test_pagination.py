@@ -0,0 +1,62 @@
+import base64
+import datetime
+import json
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chat_history.models import ChatMessage, ChatSession
+from chat_history.pagination import decode_cursor, encode_cursor
+
+
+def raw_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+class DecodeCursorTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        position = (timezone.now(), uuid.uuid4())
+        self.assertEqual(decode_cursor(encode_cursor(position, 'prev')), (position, 'prev'))
+
+    def test_invalid_cursors(self):
+        valid = {'v': '2026-10-18T12:00:00+00:00', 'i': str(uuid.uuid4()), 'd': 'next'}
+        cursors = [
+            'не base64', raw_cursor([]), raw_cursor('строка'),
+            raw_cursor({**valid, 'i': 'zzz'}), raw_cursor({**valid, 'i': 5}),
+            raw_cursor({**valid, 'v': '2024-13-01T00:00:00'}), raw_cursor({**valid, 'd': 'up'}),
+            raw_cursor({'v': valid['v'], 'd': 'next'}),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                with self.assertRaisesMessage(ValueError, 'Некорректный курсор'):
+                    decode_cursor(cursor)
+
+
+@override_settings(ROOT_URLCONF='chat_history.urls')
+class InvalidCursorResponseTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', 'doctor@example.com', 'pw')
+        cls.session = ChatSession.objects.create(user=cls.user, title='Кардиология')
+        ChatMessage.objects.create(session=cls.session, role='user', content='ЭКГ')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.cursor = raw_cursor({'v': datetime.datetime(2026, 10, 18).isoformat(), 'i': 'zzz', 'd': 'next'})
+
+    def test_session_list(self):
+        response = self.client.get('/sessions/', {'cursor': self.cursor})
+        self.assertEqual(response.status_code, 404)
+
+    def test_messages_window(self):
+        for param in ('before', 'after'):
+            with self.subTest(param=param):
+                response = self.client.get(f'/sessions/{self.session.pk}/messages/history/', {param: self.cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['error'], f'Некорректный курсор {param}')
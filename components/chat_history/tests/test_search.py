@@ -0,0 +1,84 @@
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.test import TestCase, override_settings
+
+from chat_history import fields, search
+from chat_history.models import ChatMessage, ChatSession
+
+
+class SnippetEscapingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        if connection.vendor not in search.BACKENDS:
+            return
+        search.install()
+        cls.user = get_user_model().objects.create_user('doctor', 'doctor@example.com', 'pw')
+        session = ChatSession.objects.create(user=cls.user, title='Без совпадений')
+        ChatMessage.objects.create(
+            session=session, role='user',
+            content='Анализ <script>alert(1)</script> & гемоглобин <img src=x onerror=alert(2)>'
+        )
+        cls.other = get_user_model().objects.create_user('nurse', 'nurse@example.com', 'pw')
+        other_session = ChatSession.objects.create(user=cls.other, title='Гемоглобин')
+        ChatMessage.objects.create(session=other_session, role='user', content='гемоглобин')
+        archived = ChatSession.objects.create(user=cls.user, title='Гемоглобин', is_active=False)
+        ChatMessage.objects.create(session=archived, role='user', content='гемоглобин')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if connection.vendor in search.BACKENDS:
+            search.uninstall()
+
+    def setUp(self):
+        if connection.vendor not in search.BACKENDS:
+            self.skipTest('Полнотекстовый поиск не поддерживается')
+
+    def test_message_markup_is_escaped(self):
+        [(_, _, snippet)] = search.search_sessions(self.user, 'гемоглобин')
+        self.assertNotIn('<script>', snippet)
+        self.assertNotIn('<img', snippet)
+        self.assertIn('&lt;script&gt;', snippet)
+        self.assertIn('&amp;', snippet)
+        self.assertIn(f'{search.SNIPPET_START}гемоглобин{search.SNIPPET_STOP}', snippet)
+
+    def test_results_are_limited_to_users_active_sessions(self):
+        [(session, _, _)] = search.search_sessions(self.other, 'гемоглобин')
+        self.assertEqual(session.user_id, self.other.pk)
+
+    def test_highlight(self):
+        text = f'<b>{search.MATCH_START}x{search.MATCH_STOP}</b>'
+        self.assertEqual(search.highlight(text), '&lt;b&gt;<mark>x</mark>&lt;/b&gt;')
+        self.assertIsNone(search.highlight(None))
+
+
+@override_settings(CHAT_HISTORY_COMPRESSION='zlib', CHAT_HISTORY_COMPRESSION_THRESHOLD=16)
+class CompressionTests(TestCase):
+    """Сжатие не ломает фильтры по metadata и не уживается с полнотекстовым индексом"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', 'doctor@example.com', 'pw')
+        cls.session = ChatSession.objects.create(user=cls.user, title='Кардиология')
+
+    def test_metadata_stays_queryable(self):
+        message = ChatMessage.objects.create(
+            session=self.session, role='assistant', content='ЭКГ ' * 100,
+            metadata={'model': 'large', 'sources': ['ЭКГ'] * 100},
+        )
+        self.assertEqual(ChatMessage.objects.get(metadata__model='large'), message)
+        message.refresh_from_db()
+        self.assertEqual(message.content, 'ЭКГ ' * 100)
+
+    def test_fulltext_index_is_rejected(self):
+        if connection.vendor not in search.BACKENDS:
+            self.skipTest('Полнотекстовый поиск не поддерживается')
+        with self.assertRaises(ImproperlyConfigured):
+            search.install()
+        with override_settings(CHAT_HISTORY_COMPRESSION=None):
+            search.install()
+        self.addCleanup(search.uninstall)
+        errors = fields.check_compression(databases=[DEFAULT_DB_ALIAS])
+        self.assertEqual([error.id for error in errors], ['chat_history.E001'])
@@ -0,0 +1,143 @@
+"""
+Быстрый путь сериализации (serialize_messages, serialize_session_list)
+должен давать те же байты JSON, что и сериализаторы DRF.
+"""
+import datetime
+import uuid
+from zoneinfo import ZoneInfo
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+
+from chat_history.models import ChatMessage, ChatSession
+from chat_history.serializers import (
+    MESSAGE_VALUES, SESSION_LIST_VALUES, ChatMessageSerializer,
+    ChatSessionListSerializer, serialize_messages, serialize_session_list,
+)
+
+
+TASHKENT = ZoneInfo('Asia/Tashkent')
+NEW_YORK = ZoneInfo('America/New_York')
+
+
+def render(data):
+    return JSONRenderer().render(data)
+
+
+def as_values(objects, fields):
+    return [{name: getattr(obj, name) for name in fields} for obj in objects]
+
+
+class FastSerializationMixin:
+    """Сравнение на объектах в памяти: строки .values() и модели"""
+
+    # Значения created_at, которые проверяет подкласс
+    datetimes = ()
+
+    def messages(self):
+        messages = []
+        for index, created_at in enumerate(self.datetimes):
+            messages.append(ChatMessage(
+                id=uuid.uuid4(), role='user' if index % 2 else 'assistant',
+                content=f'Сообщение {index} <b>"кавычки"</b>  ',
+                created_at=created_at, tokens_used=index, is_error=bool(index % 3),
+                is_fallback=False, response_time_ms=index * 10 or None,
+                metadata=None if index % 2 else {'model': 'gpt', 'n': index, 'nested': {'a': [1, 2]}},
+            ))
+        return messages
+
+    def sessions(self):
+        return [
+            ChatSession(
+                id=uuid.uuid4(), title=f'Сессия {index}', created_at=created_at,
+                updated_at=created_at + datetime.timedelta(hours=5, microseconds=17),
+                last_message_preview='превью', total_messages=index, total_tokens_used=index * 100,
+            )
+            for index, created_at in enumerate(self.datetimes)
+        ]
+
+    def assert_messages_identical(self):
+        messages = self.messages()
+        expected = render(ChatMessageSerializer(messages, many=True).data)
+        self.assertEqual(render(serialize_messages(as_values(messages, MESSAGE_VALUES))), expected)
+        self.assertEqual(render(serialize_messages(messages)), expected)
+
+    def assert_session_list_identical(self):
+        sessions = self.sessions()
+        expected = render(ChatSessionListSerializer(sessions, many=True).data)
+        self.assertEqual(render(serialize_session_list(as_values(sessions, SESSION_LIST_VALUES))), expected)
+        self.assertEqual(render(serialize_session_list(sessions)), expected)
+
+    def test_messages(self):
+        self.assert_messages_identical()
+
+    def test_session_list(self):
+        self.assert_session_list_identical()
+
+    def test_non_utc_time_zone(self):
+        with override_settings(TIME_ZONE='Asia/Tashkent'):
+            self.assert_messages_identical()
+            self.assert_session_list_identical()
+
+
+@override_settings(USE_TZ=True, TIME_ZONE='UTC')
+class AwareDatetimeTests(FastSerializationMixin, SimpleTestCase):
+
+    datetimes = [
+        datetime.datetime(2026, 10, 18, 23, 59, 30, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2026, 1, 1, 0, 0, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2026, 3, 8, 1, 30, 0, 123456, tzinfo=TASHKENT),
+        datetime.datetime(2026, 11, 1, 1, 30, tzinfo=NEW_YORK),
+    ]
+
+
+@override_settings(USE_TZ=False, TIME_ZONE='UTC')
+class NaiveDatetimeTests(FastSerializationMixin, SimpleTestCase):
+
+    datetimes = [
+        datetime.datetime(2026, 10, 18, 23, 59, 30),
+        datetime.datetime(2026, 1, 1, 0, 0, 0, 500),
+        datetime.datetime(2026, 3, 8, 1, 30),
+    ]
+
+
+@override_settings(USE_TZ=True, TIME_ZONE='UTC')
+class NaiveDatetimeWithUseTzTests(FastSerializationMixin, SimpleTestCase):
+    """Наивные значения при USE_TZ=True (например, из сторонних данных)"""
+
+    datetimes = [datetime.datetime(2026, 10, 18, 23, 59, 30), datetime.datetime(2026, 6, 1, 12, 0)]
+
+
+@override_settings(USE_TZ=True, TIME_ZONE='Asia/Tashkent')
+class DatabaseRowsTests(TestCase):
+    """Строки .values() из базы против моделей из того же запроса"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user('doctor', 'doctor@example.com', 'pw')
+        cls.session = ChatSession.objects.create(user=user, title='Кардиология')
+        ChatMessage.objects.create(session=cls.session, role='user', content='Боль в груди', metadata={})
+        ChatMessage.objects.create(
+            session=cls.session, role='assistant', content='Нужна ЭКГ',
+            tokens_used=12, response_time_ms=340, metadata={'model': 'gpt', 'has_image': False}
+        )
+
+    def test_messages(self):
+        messages = self.session.messages.order_by('created_at', 'id')
+        self.assertEqual(
+            render(serialize_messages(messages.values(*MESSAGE_VALUES))),
+            render(ChatMessageSerializer(messages, many=True).data)
+        )
+
+    def test_session_list(self):
+        sessions = ChatSession.objects.filter(pk=self.session.pk)
+        self.assertEqual(
+            render(serialize_session_list(sessions.values(*SESSION_LIST_VALUES))),
+            render(ChatSessionListSerializer(sessions, many=True).data)
+        )
+
+
+@override_settings(USE_TZ=True, TIME_ZONE='UTC')
+class DatabaseRowsUtcTests(DatabaseRowsTests):
+    """При TIME_ZONE='UTC' форматирование идет коротким путем без перевода"""
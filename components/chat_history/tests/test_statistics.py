@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from chat_history.models import ChatMessage, ChatSession
+
+
+@override_settings(ROOT_URLCONF='chat_history.urls')
+class DateRangeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', 'doctor@example.com', 'pw')
+        session = ChatSession.objects.create(user=cls.user, title='Кардиология')
+        ChatMessage.objects.create(session=session, role='assistant', content='ЭКГ', response_time_ms=300)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_impossible_date_is_rejected(self):
+        for url in ('/statistics/', '/analytics/', '/analytics/latency/', '/async/statistics/'):
+            for name in ('date_from', 'date_to'):
+                with self.subTest(url=url, param=name):
+                    response = self.client.get(url, {name: '2024-13-01'})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertEqual(response.json()['error'], f'Некорректная дата {name}')
+
+    def test_valid_and_missing_dates(self):
+        for url in ('/statistics/', '/analytics/', '/analytics/latency/', '/async/statistics/'):
+            for params in ({}, {'date_from': '2024-01-01', 'date_to': '2030-12-31'}, {'date_from': 'вчера'}):
+                with self.subTest(url=url, params=params):
+                    self.assertEqual(self.client.get(url, params).status_code, 200)
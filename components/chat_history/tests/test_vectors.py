@@ -0,0 +1,68 @@
+import shutil
+import tempfile
+import unittest
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chat_history import vectors
+from chat_history.models import ChatMessage, ChatSession
+
+
+@unittest.skipIf(vectors.np is None, 'нужен numpy')
+class VectorIndexTests(TestCase):
+    """Пополнение индекса не теряет сообщения, зафиксированные с опозданием"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', 'doctor@example.com', 'pw')
+        cls.session = ChatSession.objects.create(user=cls.user, title='Эндокринология')
+        ChatMessage.objects.create(session=cls.session, role='user', content='Сахар крови натощак, диабет')
+
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        settings = override_settings(CHAT_HISTORY_VECTORS={'path': path, 'background': False})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.index = vectors.VectorIndex(self.user.pk)
+
+    def test_late_commit_is_indexed_once(self):
+        self.assertEqual(self.index.update(), (1, True))
+        late = ChatMessage.objects.create(session=self.session, role='user', content='Гемоглобин, анемия')
+        ChatMessage.objects.filter(pk=late.pk).update(created_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(self.index.update(), (1, True))
+        self.assertEqual(self.index.update(), (0, True))
+        self.assertEqual(self.index.search('анемия', k=1)[0][0], late.pk)
+
+    def test_limit_leaves_index_not_ready(self):
+        ChatMessage.objects.create(session=self.session, role='assistant', content='Контроль HbA1c')
+        with override_settings(CHAT_HISTORY_VECTORS={**vectors.get_options(), 'batch_size': 1}):
+            index = vectors.VectorIndex(self.user.pk)
+            self.assertEqual(index.update(limit=1), (1, False))
+            self.assertFalse(index.read_state()['ready'])
+            self.assertEqual(index.update(), (1, True))
+            self.assertTrue(index.read_state()['ready'])
+
+
+@override_settings(ROOT_URLCONF='chat_history.urls')
+class SimilarMessagesViewTests(TestCase):
+    """Ошибки параметров поиска похожих сообщений"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('doctor', 'doctor@example.com', 'pw')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @unittest.skipIf(vectors.np is None, 'нужен numpy')
+    def test_missing_message_is_not_found(self):
+        response = self.client.get('/similar/', {'message_id': str(uuid.uuid4())})
+        self.assertEqual(response.status_code, 404)
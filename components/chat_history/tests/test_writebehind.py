@@ -0,0 +1,35 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase, override_settings
+
+from chat_history import writebehind
+from chat_history.models import ChatMessage, ChatSession
+
+
+@override_settings(
+    ROOT_URLCONF='chat_history.urls',
+    CHAT_HISTORY_WRITE_BEHIND={'enabled': True, 'max_batch': 50, 'max_delay_ms': 200},
+)
+class AsyncGroupCommitTests(TransactionTestCase):
+    """Параллельные async-запросы попадают в одну пачку write-behind"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('doctor', 'doctor@example.com', 'pw')
+        self.session = ChatSession.objects.create(user=self.user, title='Кардиология')
+        self.addCleanup(writebehind.queue.stop, 5)
+
+    async def test_concurrent_posts_share_batch(self):
+        await self.async_client.aforce_login(self.user)
+        url = f'/async/sessions/{self.session.pk}/messages/'
+        batches = writebehind.queue.batches
+
+        responses = await asyncio.gather(*[
+            self.async_client.post(url, {'role': 'user', 'content': f'ЭКГ {n}'}, content_type='application/json')
+            for n in range(5)
+        ])
+        self.assertEqual([response.status_code for response in responses], [201] * 5)
+        self.assertEqual(writebehind.queue.batches - batches, 1)
+        count = await sync_to_async(ChatMessage.objects.filter(session=self.session).count)()
+        self.assertEqual(count, 5)
@@ -0,0 +1,60 @@
+from abc import ABC, abstractmethod
+
+from rest_framework.throttling import BaseThrottle
+
+from . import idempotency, ratelimit
+
+
+class ChatLimitThrottle(BaseThrottle, ABC):
+    """
+    Базовый троттлинг по лимитам ratelimit: 429 с заголовком Retry-After.
+    Повтор с уже сохраненным ответом Idempotency-Key ничего не записывает
+    и лимиты не расходует.
+    """
+
+    @abstractmethod
+    def check(self, user_id):
+        """0, если запрос разрешен (с расходом лимита), иначе секунды до разрешения"""
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        if not request.user or not request.user.is_authenticated:
+            return True
+        if idempotency.has_stored_response(request):
+            return True
+        wait = self.check(request.user.pk)
+        if wait:
+            self.wait_seconds = wait
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ChatRequestRateThrottle(ChatLimitThrottle):
+    """Частота запросов на запись (ведро токенов на пользователя)"""
+
+    def check(self, user_id):
+        return ratelimit.check_request_rate(user_id)
+
+
+class ChatDailyTokensThrottle(ChatLimitThrottle):
+    """Дневной лимит токенов ИИ на пользователя"""
+
+    def check(self, user_id):
+        return ratelimit.check_daily_tokens(user_id)
+
+
+class ChatWriteThrottle(ChatLimitThrottle):
+    """
+    Оба лимита записи одним троттлингом: DRF вызывает все throttle_classes
+    даже после отказа, и отдельный ChatRequestRateThrottle расходовал бы
+    ведро на запросах, отклоненных дневным лимитом.
+    """
+
+    def check(self, user_id):
+        return ratelimit.check_write_limits(user_id)
+
+
+CHAT_WRITE_THROTTLES = [ChatWriteThrottle]
@@ -1,10 +1,17 @@
 from django.urls import path
 from .views import (
     ChatSessionListCreateView, ChatSessionDetailView,
-    add_message_to_session, chat_statistics,
-    search_chat_sessions, bulk_delete_sessions,
+    add_message_to_session, add_messages_batch, session_messages_window,
+    open_message_stream, append_message_chunks, finalize_message_stream,
+    message_stream_events,
+    chat_statistics, chat_analytics_daily, chat_latency_percentiles,
+    list_cache_stats, metrics, search_chat_sessions, similar_chat_messages, bulk_delete_sessions,
     export_chat_session
 )
+from .async_views import (
+    async_session_list, async_session_detail, async_add_message,
+    async_search_sessions, async_chat_statistics
+)
 
 app_name = 'chat_history'
 
@@ -15,16 +22,36 @@ urlpatterns = [
     
     # Работа с сообщениями
     path('sessions/<uuid:session_id>/messages/', add_message_to_session, name='add-message'),
+    path('sessions/<uuid:session_id>/messages/batch/', add_messages_batch, name='add-messages-batch'),
+    path('sessions/<uuid:session_id>/messages/history/', session_messages_window, name='messages-window'),
+    
+    # Потоковый ответ ассистента: черновик, фрагменты, завершение, SSE
+    path('sessions/<uuid:session_id>/stream/', open_message_stream, name='stream-open'),
+    path('sessions/<uuid:session_id>/stream/<uuid:message_id>/chunks/', append_message_chunks, name='stream-chunks'),
+    path('sessions/<uuid:session_id>/stream/<uuid:message_id>/finalize/', finalize_message_stream, name='stream-finalize'),
+    path('sessions/<uuid:session_id>/stream/<uuid:message_id>/events/', message_stream_events, name='stream-events'),
     
     # Статистика и аналитика
     path('statistics/', chat_statistics, name='statistics'),
+    path('analytics/', chat_analytics_daily, name='analytics'),
+    path('analytics/latency/', chat_latency_percentiles, name='analytics-latency'),
+    path('cache-stats/', list_cache_stats, name='cache-stats'),
+    path('metrics/', metrics, name='metrics'),
     
     # Поиск и фильтрация
     path('search/', search_chat_sessions, name='search'),
+    path('similar/', similar_chat_messages, name='similar'),
     
     # Массовые операции
     path('bulk-delete/', bulk_delete_sessions, name='bulk-delete'),
     
     # Экспорт
     path('sessions/<uuid:session_id>/export/', export_chat_session, name='export-session'),
+
+    # Асинхронные (ASGI) версии основных эндпоинтов
+    path('async/sessions/', async_session_list, name='async-session-list'),
+    path('async/sessions/<uuid:id>/', async_session_detail, name='async-session-detail'),
+    path('async/sessions/<uuid:session_id>/messages/', async_add_message, name='async-add-message'),
+    path('async/search/', async_search_sessions, name='async-search'),
+    path('async/statistics/', async_chat_statistics, name='async-statistics'),
 ]
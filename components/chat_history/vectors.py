@@ -0,0 +1,497 @@
+"""
+Локальный векторный поиск похожих сообщений без внешних моделей и сервисов.
+
+Тексты превращаются в векторы хешированием признаков (feature hashing):
+основы слов (первые STEM_LENGTH символов, грубая замена стеммингу для
+русского) и пары соседних основ раскладываются по dim корзинам со знаком,
+частоты сглаживаются log(1 + tf), вектор нормируется. Словарь не нужен,
+поэтому индекс пополняется инкрементально. IDF считается по частотам
+корзин и применяется к запросу: score = (запрос * idf) . документ.
+
+Индекс у каждого пользователя свой - файлы в каталоге path/<user_id>:
+
+    state.json        - поколение, число строк, водяной знак (created_at, id)
+    vectors.<N>.f32   - матрица rows x dim (float32), читается через memmap
+    messages.<N>.bin  - id сообщений по 16 байт, в порядке строк
+    sessions.<N>.bin  - id сессий по 16 байт
+    df.<N>.npy        - в скольких сообщениях встречалась каждая корзина
+
+Перестроение пишет файлы нового поколения N и переключает state.json
+атомарно, df заменяется через временный файл: читатели не видят файлов
+в промежуточном состоянии и не берут блокировку писателя.
+
+Пополнение. Перед поиском (update_on_search) индекс дописывается, если у
+пользователя были записи (версия кэша изменилась), но не больше
+max_sync_rows строк в самом запросе - остальное и первое построение идут в
+фоновом потоке процесса или командой ``manage.py chat_vector_index``.
+Пока первое построение не закончено, поиск откатывается на полнотекстовый
+индекс (search) без оценки сходства.
+
+Новые строки ищутся от водяного знака минус lag_seconds: сообщения,
+зафиксированные позже своего created_at (write-behind, параллельные
+транзакции), не теряются, уже проиндексированные в этом окне
+пропускаются. Более поздние вставки со старыми датами (восстановление из
+архива) сбрасывают индекс пользователя - см. reset_user. Черновики
+потоковых ответов откладываются до завершения, удаленные сообщения и
+неактивные сессии отбрасываются при выдаче.
+
+Поиск - умножение матрицы на вектор запроса блоками по chunk_rows строк и
+argpartition для top-k. Нужен numpy (необязательная зависимость). Настройки:
+
+    CHAT_HISTORY_VECTORS = {
+        'path': None,             # по умолчанию BASE_DIR/chat_vectors
+        'dim': 256,               # смена размерности перестраивает индекс
+        'roles': ['user', 'assistant'],
+        'max_chars': 4000,        # длиннее - индексируется только начало
+        'batch_size': 1000,
+        'chunk_rows': 65536,
+        'update_on_search': True,
+        'max_sync_rows': 1000,    # сколько строк дописывать в самом запросе
+        'background': True,       # остальное - в фоновом потоке процесса
+        'lag_seconds': 300,       # насколько поздно может фиксироваться запись
+    }
+"""
+import datetime
+import functools
+import json
+import logging
+import operator
+import os
+import re
+import threading
+import uuid
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from . import search
+from .caching import get_user_version
+from .models import ChatMessage, ChatSession
+
+try:
+    import numpy as np
+except ImportError:  # numpy - необязательная зависимость
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # не POSIX - блокировка только внутри процесса
+    fcntl = None
+
+
+DEFAULTS = {
+    'path': None, 'dim': 256, 'roles': ['user', 'assistant'], 'max_chars': 4000,
+    'batch_size': 1000, 'chunk_rows': 65536, 'update_on_search': True,
+    'max_sync_rows': 1000, 'background': True, 'lag_seconds': 300,
+}
+STEM_LENGTH = 5
+ID_SIZE = 16
+MAX_DRAFTS = 1000
+# Сколько самых длинных слов текста берется для полнотекстового отката
+FALLBACK_WORDS = 8
+
+DATA_FILES = (('vectors', 'f32'), ('messages', 'bin'), ('sessions', 'bin'), ('df', 'npy'))
+
+logger = logging.getLogger('chat_history.vectors')
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_locks = {}
+_locks_guard = threading.Lock()
+_building = set()
+
+
+def get_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'CHAT_HISTORY_VECTORS', None) or {})
+    if options['path'] is None:
+        options['path'] = os.path.join(str(getattr(settings, 'BASE_DIR', os.getcwd())), 'chat_vectors')
+    return options
+
+
+def features(text, max_chars):
+    stems = [word[:STEM_LENGTH] for word in _WORD_RE.findall(text[:max_chars].lower())]
+    return stems + [f'{first} {second}' for first, second in zip(stems, stems[1:])]
+
+
+def vectorize(texts, dim, max_chars=DEFAULTS['max_chars']):
+    """Нормированные векторы текстов, матрица len(texts) x dim"""
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        counts = {}
+        for feature in features(text or '', max_chars):
+            digest = zlib.crc32(feature.encode('utf-8'))
+            bucket = digest % dim
+            counts[bucket] = counts.get(bucket, 0) + (1 if digest & 0x80000000 else -1)
+        if counts:
+            buckets = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            matrix[row, buckets] = np.sign(values) * np.log1p(np.abs(values))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    matrix /= norms
+    return matrix
+
+
+class VectorIndex:
+    """Файловый индекс одного пользователя"""
+
+    def __init__(self, user_id, options=None):
+        self.user_id = user_id
+        self.options = options or get_options()
+        self.dim = self.options['dim']
+        self.path = os.path.join(self.options['path'], str(user_id))
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def data_file(self, state, name):
+        extension = dict(DATA_FILES)[name]
+        return self.file(f"{name}.{state['generation']}.{extension}")
+
+    @contextmanager
+    def locked(self, blocking=True):
+        """
+        Запись индекса - по одному писателю на пользователя (поток и процесс).
+        Отдает False, если blocking=False и индекс уже пополняется.
+        """
+        with _locks_guard:
+            lock = _locks.setdefault(self.path, threading.Lock())
+        if not lock.acquire(blocking):
+            yield False
+            return
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self.file('lock'), 'w') as handle:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(handle, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        yield False
+                        return
+                yield True
+        finally:
+            lock.release()
+
+    def read_state(self):
+        try:
+            with open(self.file('state.json'), encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get('dim') != self.dim or 'generation' not in state:
+            return None
+        return state
+
+    def _write_state(self, state):
+        temporary = self.file('state.json.tmp')
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temporary, self.file('state.json'))
+
+    def _save_df(self, state, df):
+        temporary = self.data_file(state, 'df') + '.tmp'
+        with open(temporary, 'wb') as f:
+            np.save(f, df)
+        os.replace(temporary, self.data_file(state, 'df'))
+
+    def _reset(self, previous=None):
+        """Новое пустое поколение файлов; старое удаляется после переключения"""
+        generation = (previous or {}).get('generation', 0) + 1
+        state = {
+            'dim': self.dim, 'generation': generation, 'rows': 0, 'ready': False,
+            'watermark': None, 'recent': {}, 'drafts': [], 'version': None,
+        }
+        for name, _ in DATA_FILES[:3]:
+            open(self.data_file(state, name), 'wb').close()
+        self._save_df(state, np.zeros(self.dim, dtype=np.float64))
+        self._write_state(state)
+        self._remove_generations(keep=generation)
+        return state
+
+    def _remove_generations(self, keep=None):
+        # Открытые читателями memmap продолжают работать с удаленными файлами
+        suffixes = tuple(f'.{extension}' for _, extension in DATA_FILES)
+        for name in os.listdir(self.path):
+            parts = name.split('.')
+            if (name.endswith(suffixes + ('.tmp',)) and len(parts) >= 3 and
+                    parts[1].isdigit() and int(parts[1]) != keep):
+                try:
+                    os.remove(self.file(name))
+                except FileNotFoundError:
+                    pass
+
+    def _truncate(self, state):
+        # Хвост от прерванной записи, не учтенный в state.json
+        for name, size in (('vectors', self.dim * 4), ('messages', ID_SIZE), ('sessions', ID_SIZE)):
+            with open(self.data_file(state, name), 'r+b') as f:
+                f.truncate(state['rows'] * size)
+
+    def messages(self):
+        # Из metadata нужен только флаг черновика - документ не загружается
+        return ChatMessage.objects.filter(
+            session__user_id=self.user_id, role__in=self.options['roles']
+        ).values_list('id', 'session_id', 'created_at', 'content', 'metadata__streaming')
+
+    def pending_messages(self, position):
+        """Сообщения после позиции (created_at, id) или с created_at >= since"""
+        queryset = self.messages()
+        created_at, message_id = position
+        if created_at is None:
+            pass
+        elif message_id is None:
+            queryset = queryset.filter(created_at__gte=created_at)
+        else:
+            queryset = queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id)
+            )
+        return queryset.order_by('created_at', 'id')
+
+    def is_current(self, state=None):
+        """Индекс построен и с момента пополнения пользователь ничего не записывал"""
+        state = state or self.read_state()
+        return bool(state and state['ready'] and state.get('version') == get_user_version(self.user_id))
+
+    def _append(self, state, df, rows):
+        """Дописывает готовые сообщения, черновики запоминает в state['drafts']"""
+        final = []
+        for row in rows:
+            if row[4]:
+                state['drafts'].append(str(row[0]))
+            else:
+                final.append(row)
+        if final:
+            matrix = vectorize([row[3] for row in final], self.dim, self.options['max_chars'])
+            with open(self.data_file(state, 'vectors'), 'ab') as f:
+                f.write(matrix.tobytes())
+            with open(self.data_file(state, 'messages'), 'ab') as f:
+                f.write(b''.join(row[0].bytes for row in final))
+            with open(self.data_file(state, 'sessions'), 'ab') as f:
+                f.write(b''.join(row[1].bytes for row in final))
+            df += np.count_nonzero(matrix, axis=0)
+            self._save_df(state, df)
+            state['rows'] += len(final)
+            state['recent'].update((str(row[0]), row[2].isoformat()) for row in final)
+        # Брошенные черновики не копятся бесконечно
+        del state['drafts'][:-MAX_DRAFTS]
+        return len(final)
+
+    def update(self, rebuild=False, limit=None, blocking=True):
+        """
+        Дописывает новые сообщения. Возвращает (добавлено строк, готово):
+        готово=False, если остановились на limit просмотренных строк или
+        индекс пополняет другой писатель (blocking=False).
+        """
+        added = 0
+        with self.locked(blocking) as acquired:
+            if not acquired:
+                return 0, False
+            # Версия до чтения: запись во время пополнения вызовет следующее
+            version = get_user_version(self.user_id)
+            previous = self.read_state()
+            state = self._reset(previous) if rebuild or previous is None else previous
+            self._truncate(state)
+            df = np.load(self.data_file(state, 'df'))
+            batch_size = self.options['batch_size']
+            lag = datetime.timedelta(seconds=self.options['lag_seconds'])
+
+            # Черновики, пропущенные раньше, индексируются после завершения
+            drafts, state['drafts'] = state['drafts'], []
+            if drafts:
+                added += self._append(state, df, list(self.messages().filter(pk__in=drafts)))
+
+            # Окно lag перед водяным знаком просматривается повторно
+            position = (None, None)
+            if state['watermark']:
+                position = (parse_datetime(state['watermark'][0]) - lag, None)
+            known = set(state['recent']) | set(state['drafts'])
+            scanned, complete = 0, True
+            while True:
+                rows = list(self.pending_messages(position)[:batch_size])
+                if not rows:
+                    break
+                added += self._append(state, df, [row for row in rows if str(row[0]) not in known])
+                last = rows[-1]
+                position = (last[2], last[0])
+                if not state['watermark'] or last[2] >= parse_datetime(state['watermark'][0]):
+                    state['watermark'] = [last[2].isoformat(), str(last[0])]
+                self._prune_recent(state, lag)
+                self._write_state(state)
+                scanned += len(rows)
+                if len(rows) < batch_size:
+                    break
+                if limit is not None and scanned >= limit:
+                    complete = False
+                    break
+
+            if complete:
+                state['ready'] = True
+                state['version'] = version
+            self._write_state(state)
+        return added, complete
+
+    @staticmethod
+    def _prune_recent(state, lag):
+        # Помнить нужно только строки из окна повторного просмотра
+        since = parse_datetime(state['watermark'][0]) - lag
+        state['recent'] = {
+            message_id: created_at for message_id, created_at in state['recent'].items()
+            if parse_datetime(created_at) >= since
+        }
+
+    def query_vector(self, state, text):
+        df = np.load(self.data_file(state, 'df'))
+        idf = (np.log((1 + state['rows']) / (1 + df)) + 1).astype(np.float32)
+        vector = vectorize([text], self.dim, self.options['max_chars'])[0] * idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def search(self, text, k=10):
+        """[(message_id, session_id, score)] по убыванию сходства"""
+        state = self.read_state()
+        if not state or not state['rows']:
+            return []
+        try:
+            return self._search(state, text, k)
+        except (FileNotFoundError, ValueError):
+            # Поколение сменилось между чтением state.json и файлов
+            return []
+
+    def _search(self, state, text, k):
+        rows = state['rows']
+        query = self.query_vector(state, text)
+        if not query.any():
+            return []
+
+        matrix = np.memmap(self.data_file(state, 'vectors'), dtype=np.float32, mode='r', shape=(rows, self.dim))
+        scores = np.empty(rows, dtype=np.float32)
+        chunk = self.options['chunk_rows']
+        for start in range(0, rows, chunk):
+            np.dot(matrix[start:start + chunk], query, out=scores[start:start + chunk])
+
+        k = min(k, rows)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        messages = np.memmap(self.data_file(state, 'messages'), dtype=f'V{ID_SIZE}', mode='r', shape=(rows,))
+        sessions = np.memmap(self.data_file(state, 'sessions'), dtype=f'V{ID_SIZE}', mode='r', shape=(rows,))
+        return [
+            (uuid.UUID(bytes=messages[i].tobytes()), uuid.UUID(bytes=sessions[i].tobytes()), float(scores[i]))
+            for i in top
+        ]
+
+    def drop(self):
+        with self.locked():
+            try:
+                os.remove(self.file('state.json'))
+            except FileNotFoundError:
+                pass
+            self._remove_generations()
+
+
+def build_in_background(user_id, options=None):
+    """
+    Пополняет индекс в фоновом потоке процесса; не больше одного потока на
+    пользователя. Возвращает False, если поток уже работает.
+    """
+    with _locks_guard:
+        if user_id in _building:
+            return False
+        _building.add(user_id)
+    thread = threading.Thread(
+        target=_build, args=(user_id, options), name=f'chat-vectors-{user_id}', daemon=True
+    )
+    thread.start()
+    return True
+
+
+def _build(user_id, options):
+    try:
+        close_old_connections()
+        VectorIndex(user_id, options).update()
+    except Exception:
+        logger.exception('Не удалось пополнить векторный индекс пользователя %s', user_id)
+    finally:
+        with _locks_guard:
+            _building.discard(user_id)
+        connection.close()
+
+
+def reset_user(user_id):
+    """
+    Сбрасывает индекс пользователя после вставки сообщений со старыми
+    датами (восстановление из архива). Заново он строится при следующем
+    поиске или командой chat_vector_index.
+    """
+    if np is None:
+        return
+    index = VectorIndex(user_id)
+    if os.path.exists(index.file('state.json')):
+        index.drop()
+
+
+def refresh(index, state):
+    """Пополнение перед поиском: немного строк в запросе, остальное в фоне"""
+    options = index.options
+    if state is None:
+        complete = False
+    else:
+        _, complete = index.update(limit=options['max_sync_rows'], blocking=False)
+    if not complete and options['background']:
+        build_in_background(index.user_id, options)
+
+
+def similar_messages(user, text, k=10, exclude=()):
+    """
+    Похожие сообщения пользователя: [(сообщение, score)], только из
+    активных сессий. Сообщения загружаются без метаданных. None, если
+    индекс еще не построен - тогда см. text_fallback.
+    """
+    options = get_options()
+    index = VectorIndex(user.pk, options)
+    state = index.read_state()
+    if options['update_on_search'] and not index.is_current(state):
+        refresh(index, state)
+        state = index.read_state()
+    if not state or not state['ready']:
+        return None
+
+    # С запасом: часть строк могла быть удалена или исключена
+    hits = [
+        hit for hit in index.search(text, k=2 * k + len(exclude))
+        if hit[0] not in exclude and hit[2] > 0
+    ]
+    # Два запроса по первичным ключам: соединение с сессиями SQLite
+    # планирует через индекс пользователя и читает все его сообщения
+    messages = ChatMessage.objects.defer('metadata').in_bulk([message_id for message_id, _, _ in hits])
+    active = set(ChatSession.objects.filter(
+        pk__in={session_id for _, session_id, _ in hits}, user=user, is_active=True
+    ).values_list('pk', flat=True))
+    return [
+        (messages[message_id], score)
+        for message_id, session_id, score in hits
+        if message_id in messages and messages[message_id].session_id in active
+    ][:k]
+
+
+def text_fallback(user, text, k=10, exclude=()):
+    """
+    Пока индекс строится: последние сообщения, где есть любое из самых
+    длинных слов текста (полнотекстовый индекс), с score None.
+    """
+    words = sorted(set(_WORD_RE.findall(text.lower())), key=len, reverse=True)[:FALLBACK_WORDS]
+    if not words:
+        return []
+    condition = search.match(ChatMessage, ' '.join(words), any_word=True)
+    if condition is None:
+        # Без полнотекстового индекса - как запасной вариант поиска сессий
+        condition = functools.reduce(operator.or_, (Q(content__icontains=word) for word in words))
+    messages = (ChatMessage.objects
+                .filter(condition, session__user=user, session__is_active=True,
+                        role__in=get_options()['roles'])
+                .exclude(pk__in=exclude)
+                .defer('metadata')
+                .order_by('-created_at', '-id')[:k])
+    return [(message, None) for message in messages]
@@ -1,32 +1,150 @@
 from rest_framework import generics, status, permissions
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, renderer_classes, throttle_classes
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
-from django.db.models import Count, Sum, Avg, Q
+from django.core.cache import cache
+from django.db.models import Count, Sum, Avg, Max, Q
+from django.db.models.functions import TruncDate
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date
 from datetime import datetime, timedelta
+import hashlib
+import hmac
 import uuid
 
-from .models import ChatSession, ChatMessage, ChatAnalytics
+from api_encoding import CompactEncodingMixin, compact_encoding
+
+from . import histograms, idempotency, metaquery, profiling, search, streaming, vectors, writebehind
+from .analytics import day_start
+from .caching import (
+    STATS_CACHE_TIMEOUT, bump_user_version_on_commit, get_user_version,
+    session_list_cache, stats_cache_key
+)
+from .export import EXPORT_FORMATS, streaming_export_response
+from .pagination import KeysetPagination, decode_cursor, message_window, message_cursor
+from .throttling import CHAT_WRITE_THROTTLES
+from .models import ChatSession, ChatMessage, ChatAnalytics, ChatResponseTimeBucket
 from .serializers import (
     ChatSessionListSerializer, ChatSessionDetailSerializer,
     ChatSessionCreateSerializer, ChatMessageSerializer,
-    ChatMessageCreateSerializer, ChatAnalyticsSerializer,
-    ChatStatsSerializer
+    ChatMessageCreateSerializer, ChatMessageFinalizeSerializer,
+    ChatAnalyticsSerializer, ChatStatsSerializer, DEFAULT_MESSAGES_WINDOW,
+    MESSAGE_VALUES, SESSION_LIST_VALUES, datetime_formatter, serialize_messages,
+    serialize_session_list
 )
 
 
+MAX_MESSAGES_PER_BATCH = 100
+SEARCH_PAGE_SIZE = 20
+MAX_MESSAGES_WINDOW = 200
+SIMILAR_DEFAULT_K = 10
+SIMILAR_MAX_K = 50
+SIMILAR_SNIPPET_CHARS = 300
+
+
+def get_window_limit(request, param='limit'):
+    """Размер окна сообщений из query-параметра в пределах MAX_MESSAGES_WINDOW"""
+    try:
+        limit = int(request.query_params.get(param, DEFAULT_MESSAGES_WINDOW))
+    except ValueError:
+        limit = DEFAULT_MESSAGES_WINDOW
+    return min(max(limit, 1), MAX_MESSAGES_WINDOW)
+
+
 class ChatSessionPagination(PageNumberPagination):
     page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 100
 
 
-class ChatSessionListCreateView(generics.ListCreateAPIView):
+class ChatSessionCursorPagination(KeysetPagination):
+    """Курсор по (updated_at, id) - использует индекс (user, -updated_at)"""
+    ordering_field = 'updated_at'
+    page_size = 20
+    max_page_size = 100
+
+
+class ConditionalGetMixin:
+    """
+    ETag и Last-Modified для GET по времени последнего изменения.
+    
+    Если клиент прислал совпадающий If-None-Match, отвечаем 304 после
+    одного индексного запроса, не строя сериализатор. Время изменения -
+    максимум last_modified_field по get_last_modified_queryset() (для
+    детального представления - один объект). Проверка только по ETag:
+    у If-Modified-Since точность в секунду, и запись в ту же секунду
+    вернула бы устаревший 304. В ETag входит версия кэша пользователя -
+    она меняется и при записях, не трогающих updated_at (черновики
+    потокового ответа). ETag слабый, как и у сжатого ответа, чтобы 304 и
+    200 отдавали одно значение.
+    """
+    
+    last_modified_field = 'updated_at'
+    
+    def get_last_modified_queryset(self):
+        queryset = self.get_queryset()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        if lookup_url_kwarg in self.kwargs:
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return queryset
+    
+    def get_last_modified(self):
+        return self.get_last_modified_queryset().aggregate(
+            last=Max(self.last_modified_field)
+        )['last']
+    
+    def get_etag(self, last_modified):
+        # Разные форматы (JSON, msgpack) - разные представления ресурса
+        source = ':'.join([
+            str(self.request.user.pk), str(get_user_version(self.request.user.pk)),
+            self.request.path, self.request.GET.urlencode(),
+            self.request.accepted_renderer.format, last_modified.isoformat(),
+        ])
+        return 'W/"%s"' % hashlib.sha1(source.encode()).hexdigest()
+    
+    def get(self, request, *args, **kwargs):
+        last_modified = self.get_last_modified()
+        if last_modified is None:
+            return super().get(request, *args, **kwargs)
+        
+        etag = self.get_etag(last_modified)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            response = not_modified
+        else:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class ChatSessionListCreateView(CompactEncodingMixin, ConditionalGetMixin, generics.ListCreateAPIView):
     """Список сессий чата и создание новой сессии"""
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = ChatSessionPagination
+    cursor_pagination_class = ChatSessionCursorPagination
+    filter_backends = [metaquery.MetadataFilterBackend]
+    
+    @property
+    def paginator(self):
+        """Курсорный режим по ?cursor= или ?pagination=cursor, иначе постраничный"""
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if 'cursor' in params or params.get('pagination') == 'cursor':
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
     
     def get_queryset(self):
         return ChatSession.objects.filter(
@@ -39,19 +157,44 @@ class ChatSessionListCreateView(generics.ListCreateAPIView):
             return ChatSessionCreateSerializer
         return ChatSessionListSerializer
     
+    def list(self, request, *args, **kwargs):
+        # Страницы кэшируются до следующей записи пользователя (версия в ключе)
+        cache_key = session_list_cache.key(request.user.pk, request.build_absolute_uri())
+        data = session_list_cache.get(cache_key)
+        if data is not None:
+            return Response(data)
+        
+        # Строки .values() и быстрая сериализация вместо ChatSessionListSerializer
+        queryset = self.filter_queryset(self.get_queryset()).values(*SESSION_LIST_VALUES)
+        page = self.paginate_queryset(queryset)
+        response = self.get_paginated_response(serialize_session_list(page))
+        session_list_cache.set(cache_key, response.data)
+        return response
+    
+    def get_last_modified_queryset(self):
+        # По всем сессиям пользователя: удаление тоже меняет updated_at
+        return ChatSession.objects.filter(user=self.request.user)
+    
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
-class ChatSessionDetailView(generics.RetrieveUpdateDestroyAPIView):
+class ChatSessionDetailView(CompactEncodingMixin, ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     """Детальная информация о сессии чата"""
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = ChatSessionDetailSerializer
     lookup_field = 'id'
+    # updated_at сессии меняют и новые сообщения (ChatSession.register_messages)
+    last_modified_field = 'updated_at'
     
     def get_queryset(self):
         return ChatSession.objects.filter(user=self.request.user)
     
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['messages_limit'] = get_window_limit(self.request, 'messages_limit')
+        return context
+    
     def perform_destroy(self, instance):
         # Мягкое удаление - помечаем как неактивную
         instance.is_active = False
@@ -60,6 +203,9 @@ class ChatSessionDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@throttle_classes(CHAT_WRITE_THROTTLES)
+@compact_encoding
+@idempotency.idempotent
 def add_message_to_session(request, session_id):
     """Добавить сообщение в существующую сессию"""
     try:
@@ -76,15 +222,9 @@ def add_message_to_session(request, session_id):
         )
         
         if serializer.is_valid():
+            # Счетчики, превью и заголовок сессии обновляются в ChatMessage.save
             message = serializer.save(session=session)
             
-            # Обновляем заголовок сессии если это первое пользовательское сообщение
-            if (session.total_messages <= 2 and 
-                message.role == 'user' and 
-                len(message.content.strip()) > 0):
-                session.title = message.content[:50] + ('...' if len(message.content) > 50 else '')
-                session.save(update_fields=['title'])
-            
             return Response(
                 ChatMessageSerializer(message).data,
                 status=status.HTTP_201_CREATED
@@ -101,62 +241,310 @@ def add_message_to_session(request, session_id):
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@compact_encoding
+def session_messages_window(request, session_id):
+    """Окно сообщений сессии для ленивой подгрузки истории (before/after, meta.*)"""
+    try:
+        session = get_object_or_404(
+            ChatSession,
+            id=session_id,
+            user=request.user
+        )
+        
+        positions = {}
+        for param in ('before', 'after'):
+            cursor = request.query_params.get(param)
+            if cursor:
+                try:
+                    positions[param], _ = decode_cursor(cursor)
+                except ValueError:
+                    return Response({
+                        'success': False,
+                        'error': f'Некорректный курсор {param}'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            filters = metaquery.parse_filters(request.query_params)
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        messages, has_older, has_newer = message_window(
+            metaquery.filter_messages(session.messages.values(*MESSAGE_VALUES), filters),
+            before=positions.get('before'),
+            after=positions.get('after'),
+            limit=get_window_limit(request)
+        )
+        
+        return Response({
+            'success': True,
+            'data': serialize_messages(messages),
+            'has_older': has_older,
+            'has_newer': has_newer,
+            'before': message_cursor(messages[0]) if messages else None,
+            'after': message_cursor(messages[-1]) if messages else None
+        })
+        
+    except Exception as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+@throttle_classes(CHAT_WRITE_THROTTLES)
+@compact_encoding
+@idempotency.idempotent
+def add_messages_batch(request, session_id):
+    """Добавить несколько сообщений в сессию за один запрос"""
+    try:
+        session = get_object_or_404(
+            ChatSession,
+            id=session_id,
+            user=request.user,
+            is_active=True
+        )
+        
+        payload = request.data.get('messages') if isinstance(request.data, dict) else request.data
+        serializer = ChatMessageCreateSerializer(
+            data=payload,
+            many=True,
+            allow_empty=False,
+            max_length=MAX_MESSAGES_PER_BATCH,
+            context={'session': session}
+        )
+        
+        if serializer.is_valid():
+            # Все сообщения вставляются одним bulk_create в одной транзакции
+            messages = serializer.save()
+            
+            return Response(
+                ChatMessageSerializer(messages, many=True).data,
+                status=status.HTTP_201_CREATED
+            )
+        
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+@throttle_classes(CHAT_WRITE_THROTTLES)
+def open_message_stream(request, session_id):
+    """Открыть черновик потокового ответа ассистента"""
+    try:
+        session = get_object_or_404(
+            ChatSession,
+            id=session_id,
+            user=request.user,
+            is_active=True
+        )
+        
+        message = streaming.open_draft(session)
+        
+        return Response(
+            ChatMessageSerializer(message).data,
+            status=status.HTTP_201_CREATED
+        )
+        
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def append_message_chunks(request, session_id, message_id):
+    """Добавить фрагменты к черновику (в базу пишутся периодически)"""
+    try:
+        session = get_object_or_404(ChatSession, id=session_id, user=request.user)
+        
+        chunks = request.data.get('chunks')
+        if chunks is None:
+            chunks = [request.data.get('content', '')]
+        if not isinstance(chunks, list) or not all(isinstance(c, str) for c in chunks):
+            return Response({
+                'success': False,
+                'error': 'Ожидается content (строка) или chunks (список строк)'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        length = 0
+        for chunk in chunks:
+            length = streaming.append(session, message_id, chunk)
+        
+        return Response({'success': True, 'length': length})
+        
+    except streaming.StreamFinished:
+        return Response({
+            'success': False,
+            'error': 'Сообщение уже завершено'
+        }, status=status.HTTP_409_CONFLICT)
+    except Exception as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+@compact_encoding
+def finalize_message_stream(request, session_id, message_id):
+    """Завершить потоковый ответ: счетчики и превью сессии обновляются один раз"""
+    try:
+        session = get_object_or_404(ChatSession, id=session_id, user=request.user)
+        
+        serializer = ChatMessageFinalizeSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        message = streaming.finalize(session, message_id, **serializer.validated_data)
+        
+        return Response(ChatMessageSerializer(message).data)
+        
+    except streaming.StreamFinished:
+        return Response({
+            'success': False,
+            'error': 'Сообщение уже завершено'
+        }, status=status.HTTP_409_CONFLICT)
+    except Exception as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@renderer_classes([JSONRenderer, streaming.EventStreamRenderer])
+def message_stream_events(request, session_id, message_id):
+    """Server-Sent Events с фрагментами потокового ответа"""
+    try:
+        session = get_object_or_404(ChatSession, id=session_id, user=request.user)
+        
+        try:
+            offset = int(request.headers.get('Last-Event-ID') or request.query_params.get('offset', 0))
+        except ValueError:
+            offset = 0
+        
+        return streaming.event_stream_response(
+            session, message_id, max(offset, 0),
+            serialize=lambda message: ChatMessageSerializer(message).data
+        )
+        
+    except Exception as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def chat_statistics_queries(user, date_from=None, date_to=None):
+    """
+    Запросы статистики без выполнения: (сессии, агрегаты для aggregate,
+    queryset самого активного дня). Общие для синхронного и async-пути.
+    
+    Сообщения не сканируются: счетчики уже поддерживаются в самих сессиях.
+    """
+    sessions = ChatSession.objects.filter(user=user, is_active=True)
+    if date_from:
+        sessions = sessions.filter(created_at__gte=day_start(date_from))
+    if date_to:
+        sessions = sessions.filter(created_at__lt=day_start(date_to + timedelta(days=1)))
+    
+    week_ago = timezone.now() - timedelta(days=7)
+    month_ago = timezone.now() - timedelta(days=30)
+    
+    aggregates = {
+        'total_sessions': Count('id'),
+        'messages_sum': Sum('total_messages'),
+        'tokens_sum': Sum('total_tokens_used'),
+        'avg_messages': Avg('total_messages'),
+        'sessions_this_week': Count('id', filter=Q(created_at__gte=week_ago)),
+        'sessions_this_month': Count('id', filter=Q(created_at__gte=month_ago)),
+    }
+    
+    # Самый активный день
+    most_active = sessions.annotate(
+        day=TruncDate('created_at')
+    ).values('day').annotate(
+        count=Count('id')
+    ).order_by('-count', '-day')
+    
+    return sessions, aggregates, most_active
+
+
+def format_chat_statistics(totals, most_active):
+    """Ответ статистики из результатов chat_statistics_queries"""
+    return {
+        'total_sessions': totals['total_sessions'],
+        'total_messages': totals['messages_sum'] or 0,
+        'total_tokens': totals['tokens_sum'] or 0,
+        'avg_messages_per_session': round(totals['avg_messages'] or 0, 1),
+        'most_active_day': str(most_active['day']) if most_active else 'Нет данных',
+        'sessions_this_week': totals['sessions_this_week'],
+        'sessions_this_month': totals['sessions_this_month'],
+    }
+
+
+def compute_chat_statistics(user, date_from=None, date_to=None):
+    """Статистика по активным сессиям двумя запросами к chat_sessions"""
+    sessions, aggregates, most_active = chat_statistics_queries(user, date_from, date_to)
+    return format_chat_statistics(sessions.aggregate(**aggregates), most_active.first())
+
+
+def parse_date_range(params):
+    """
+    (date_from, date_to) из параметров запроса, None - параметра нет или он
+    не похож на дату; ValueError для несуществующей даты (2024-13-01).
+    """
+    dates = []
+    for name in ('date_from', 'date_to'):
+        try:
+            dates.append(parse_date(params.get(name, '')))
+        except ValueError:
+            raise ValueError(f'Некорректная дата {name}')
+    return dates
+
+
+def date_range_error(error):
+    return Response({
+        'success': False,
+        'error': str(error)
+    }, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@compact_encoding
 def chat_statistics(request):
     """Получить статистику чатов пользователя"""
     try:
         user = request.user
         
-        # Основная статистика
-        total_sessions = ChatSession.objects.filter(user=user, is_active=True).count()
-        total_messages = ChatMessage.objects.filter(session__user=user, session__is_active=True).count()
-        total_tokens = ChatMessage.objects.filter(
-            session__user=user, 
-            session__is_active=True
-        ).aggregate(Sum('tokens_used'))['tokens_used__sum'] or 0
-        
-        # Средние значения
-        avg_messages = ChatSession.objects.filter(
-            user=user, 
-            is_active=True
-        ).aggregate(Avg('total_messages'))['total_messages__avg'] or 0
-        
-        # Активность по дням
-        week_ago = timezone.now() - timedelta(days=7)
-        month_ago = timezone.now() - timedelta(days=30)
-        
-        sessions_this_week = ChatSession.objects.filter(
-            user=user,
-            is_active=True,
-            created_at__gte=week_ago
-        ).count()
-        
-        sessions_this_month = ChatSession.objects.filter(
-            user=user,
-            is_active=True,
-            created_at__gte=month_ago
-        ).count()
-        
-        # Самый активный день
-        most_active = ChatSession.objects.filter(
-            user=user,
-            is_active=True
-        ).extra(
-            select={'day': 'DATE(created_at)'}
-        ).values('day').annotate(
-            count=Count('id')
-        ).order_by('-count').first()
-        
-        most_active_day = most_active['day'] if most_active else 'Нет данных'
-        
-        stats_data = {
-            'total_sessions': total_sessions,
-            'total_messages': total_messages,
-            'total_tokens': total_tokens,
-            'avg_messages_per_session': round(avg_messages, 1),
-            'most_active_day': most_active_day,
-            'sessions_this_week': sessions_this_week,
-            'sessions_this_month': sessions_this_month,
-        }
+        try:
+            date_from, date_to = parse_date_range(request.GET)
+        except ValueError as e:
+            return date_range_error(e)
+        
+        # Результат кэшируется до следующей записи пользователя (версия в ключе)
+        cache_key = stats_cache_key(user.pk, get_user_version(user.pk), date_from, date_to)
+        stats_data = cache.get(cache_key)
+        
+        if stats_data is None:
+            stats_data = compute_chat_statistics(user, date_from, date_to)
+            cache.set(cache_key, stats_data, STATS_CACHE_TIMEOUT)
         
         serializer = ChatStatsSerializer(stats_data)
         return Response({
@@ -173,6 +561,136 @@ def chat_statistics(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@compact_encoding
+def chat_analytics_daily(request):
+    """Дневная аналитика пользователя из предагрегированной таблицы"""
+    try:
+        today = timezone.localdate()
+        try:
+            date_from, date_to = parse_date_range(request.GET)
+        except ValueError as e:
+            return date_range_error(e)
+        date_from = date_from or today - timedelta(days=29)
+        date_to = date_to or today
+        
+        rows = ChatAnalytics.objects.filter(
+            user=request.user,
+            date__gte=date_from,
+            date__lte=date_to
+        )
+        
+        serializer = ChatAnalyticsSerializer(rows, many=True)
+        return Response({
+            'success': True,
+            'data': serializer.data,
+            'date_from': date_from,
+            'date_to': date_to
+        })
+        
+    except Exception as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@compact_encoding
+def chat_latency_percentiles(request):
+    """Процентили времени ответа за диапазон дат по объединенным гистограммам"""
+    try:
+        today = timezone.localdate()
+        try:
+            date_from, date_to = parse_date_range(request.GET)
+        except ValueError as e:
+            return date_range_error(e)
+        date_from = date_from or today - timedelta(days=29)
+        date_to = date_to or today
+        
+        histogram = ChatResponseTimeBucket.histogram(request.user.pk, date_from, date_to)
+        points = histograms.percentiles(histogram)
+        
+        return Response({
+            'success': True,
+            'data': {
+                'count': sum(histogram.values()),
+                'p50': points[50],
+                'p95': points[95],
+                'p99': points[99],
+            },
+            'date_from': date_from,
+            'date_to': date_to
+        })
+        
+    except Exception as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def list_cache_stats(request):
+    """Счетчики попаданий кэша списка сессий (текущий процесс)"""
+    if request.GET.get('reset'):
+        session_list_cache.reset_stats()
+    return Response({
+        'success': True,
+        'data': session_list_cache.stats()
+    })
+
+
+def metrics(request):
+    """
+    Метрики процесса в формате Prometheus (см. profiling).
+    
+    Доступ - по токену CHAT_HISTORY_METRICS_TOKEN (Authorization: Bearer ...)
+    или для сотрудников с сессией Django.
+    """
+    token = getattr(settings, 'CHAT_HISTORY_METRICS_TOKEN', None)
+    header = request.headers.get('Authorization', '')
+    by_token = bool(token) and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+    user = getattr(request, 'user', None)
+    if not by_token and not (user and user.is_staff):
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    
+    cache_stats = session_list_cache.stats()
+    extra = [
+        ('chat_list_cache_hits_total', 'counter', 'Попадания кэша списка сессий', [({}, cache_stats['hits'])]),
+        ('chat_list_cache_misses_total', 'counter', 'Промахи кэша списка сессий', [({}, cache_stats['misses'])]),
+        ('chat_write_behind_batches_total', 'counter', 'Пачки групповой записи', [({}, writebehind.queue.batches)]),
+        ('chat_write_behind_messages_total', 'counter', 'Сообщения групповой записи', [({}, writebehind.queue.written)]),
+        ('chat_write_behind_pending', 'gauge', 'Сообщения в очереди', [({}, len(writebehind.queue.pending))]),
+        ('chat_streams_open', 'gauge', 'Открытые потоковые сообщения', [({}, len(streaming.registry.buffers))]),
+        ('chat_idempotent_replays_total', 'counter', 'Повторы, отданные из хранилища Idempotency-Key', [({}, idempotency.store.replayed)]),
+        ('chat_idempotent_conflicts_total', 'counter', 'Повторы с ошибкой 409/422', [({}, idempotency.store.conflicts)]),
+    ]
+    if cache_stats['entries'] is not None:
+        extra.append(('chat_list_cache_entries', 'gauge', 'Записи кэша списка сессий', [({}, cache_stats['entries'])]))
+    
+    return HttpResponse(
+        profiling.render_prometheus(extra),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+def fallback_search_sessions(user, query):
+    """Поиск через icontains, если полнотекстовый индекс не установлен"""
+    return ChatSession.objects.filter(
+        user=user,
+        is_active=True
+    ).filter(
+        Q(title__icontains=query) |
+        Q(last_message_preview__icontains=query) |
+        Q(messages__content__icontains=query)
+    ).distinct().order_by('-updated_at')
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@compact_encoding
 def search_chat_sessions(request):
     """Поиск по сессиям чата"""
     try:
@@ -183,20 +701,39 @@ def search_chat_sessions(request):
                 'error': 'Параметр поиска q обязателен'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        sessions = ChatSession.objects.filter(
-            user=request.user,
-            is_active=True
-        ).filter(
-            Q(title__icontains=query) |
-            Q(last_message_preview__icontains=query) |
-            Q(messages__content__icontains=query)
-        ).distinct().order_by('-updated_at')[:20]
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+            page_size = min(max(int(request.GET.get('page_size', SEARCH_PAGE_SIZE)), 1), ChatSessionPagination.max_page_size)
+        except ValueError:
+            return Response({
+                'success': False,
+                'error': 'Параметры page и page_size должны быть числами'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        offset = (page - 1) * page_size
+        # Запрашиваем на одну запись больше, чтобы узнать о следующей странице без COUNT(*)
+        hits = search.search_sessions(request.user, query, limit=page_size + 1, offset=offset)
+        
+        if hits is None:
+            # Полнотекстовый индекс не установлен - медленный поиск через icontains
+            sessions = fallback_search_sessions(request.user, query)[offset:offset + page_size + 1]
+            hits = [(session, None, None) for session in sessions]
+        
+        has_next = len(hits) > page_size
+        hits = hits[:page_size]
+        
+        data = serialize_session_list([session for session, _, _ in hits])
+        for item, (_, rank, snippet) in zip(data, hits):
+            item['rank'] = rank
+            item['snippet'] = snippet
         
-        serializer = ChatSessionListSerializer(sessions, many=True)
         return Response({
             'success': True,
-            'data': serializer.data,
-            'count': len(serializer.data)
+            'data': data,
+            'count': len(data),
+            'page': page,
+            'page_size': page_size,
+            'has_next': has_next
         })
         
     except Exception as e:
@@ -206,6 +743,87 @@ def search_chat_sessions(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@compact_encoding
+def similar_chat_messages(request):
+    """Похожие сообщения и сессии по тексту q или сообщению message_id (см. vectors)"""
+    try:
+        if vectors.np is None:
+            return Response({
+                'success': False,
+                'error': 'Поиск похожих сообщений недоступен: не установлен numpy'
+            }, status=status.HTTP_501_NOT_IMPLEMENTED)
+        
+        try:
+            k = min(max(int(request.GET.get('k', SIMILAR_DEFAULT_K)), 1), SIMILAR_MAX_K)
+            message_id = request.GET.get('message_id')
+            message_id = uuid.UUID(message_id) if message_id else None
+        except ValueError:
+            return Response({
+                'success': False,
+                'error': 'Некорректный параметр k или message_id'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        query = request.GET.get('q', '').strip()
+        exclude = set()
+        if message_id:
+            source = get_object_or_404(
+                ChatMessage.objects.only('id', 'content'), id=message_id, session__user=request.user
+            )
+            query = source.content
+            exclude.add(source.id)
+        if not query:
+            return Response({
+                'success': False,
+                'error': 'Нужен параметр q или message_id'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        hits = vectors.similar_messages(request.user, query, k=k, exclude=exclude)
+        index_state = 'ready'
+        if hits is None:
+            # Индекс еще строится - совпадения по словам, без оценки
+            hits = vectors.text_fallback(request.user, query, k=k, exclude=exclude)
+            index_state = 'building'
+        
+        fmt = datetime_formatter()
+        messages = [
+            {
+                'id': str(message.id),
+                'session_id': str(message.session_id),
+                'role': message.role,
+                'created_at': fmt(message.created_at),
+                'snippet': message.content[:SIMILAR_SNIPPET_CHARS],
+                'score': None if score is None else round(score, 4),
+            }
+            for message, score in hits
+        ]
+        
+        # Сессии в порядке лучшего совпадения среди их сообщений
+        best = {}
+        for message, score in hits:
+            best.setdefault(message.session_id, score)
+        rows = {row['id']: row for row in ChatSession.objects.filter(pk__in=best).values(*SESSION_LIST_VALUES)}
+        sessions = serialize_session_list([rows[session_id] for session_id in best if session_id in rows])
+        for item in sessions:
+            score = best[uuid.UUID(item['id'])]
+            item['score'] = None if score is None else round(score, 4)
+        
+        return Response({
+            'success': True,
+            'data': {'messages': messages, 'sessions': sessions, 'index': index_state},
+        })
+        
+    except Http404:
+        # Чужое или несуществующее сообщение - 404, а не 500
+        raise
+    except Exception as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def bulk_delete_sessions(request):
@@ -232,7 +850,8 @@ def bulk_delete_sessions(request):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         # Мягкое удаление
-        updated_count = sessions.update(is_active=False)
+        updated_count = sessions.update(is_active=False, updated_at=timezone.now())
+        bump_user_version_on_commit(request.user.pk)
         
         return Response({
             'success': True,
@@ -258,49 +877,17 @@ def export_chat_session(request, session_id):
             is_active=True
         )
         
-        export_format = request.data.get('format', 'json')  # json, txt, md
-        
-        if export_format == 'json':
-            serializer = ChatSessionDetailSerializer(session)
-            return Response({
-                'success': True,
-                'data': serializer.data,
-                'format': 'json'
-            })
-        
-        elif export_format == 'txt':
-            messages = session.messages.order_by('created_at')
-            content = f"Чат: {session.title}\nДата: {session.created_at.strftime('%Y-%m-%d %H:%M')}\n\n"
-            
-            for msg in messages:
-                role_name = "Врач" if msg.role == "user" else "Avishifo.ai"
-                content += f"[{msg.created_at.strftime('%H:%M')}] {role_name}:\n{msg.content}\n\n"
-            
-            return Response({
-                'success': True,
-                'data': content,
-                'format': 'txt'
-            })
-        
-        elif export_format == 'md':
-            messages = session.messages.order_by('created_at')
-            content = f"# {session.title}\n\n**Дата:** {session.created_at.strftime('%Y-%m-%d %H:%M')}\n\n"
-            
-            for msg in messages:
-                role_name = "**Врач**" if msg.role == "user" else "**Avishifo.ai**"
-                content += f"### {role_name} ({msg.created_at.strftime('%H:%M')})\n\n{msg.content}\n\n---\n\n"
-            
-            return Response({
-                'success': True,
-                'data': content,
-                'format': 'md'
-            })
+        export_format = request.data.get('format', 'json')  # json, ndjson, txt, md
+        compress = str(request.data.get('compress', '')).lower() in ('1', 'true', 'gzip')
         
-        else:
+        if export_format not in EXPORT_FORMATS:
             return Response({
                 'success': False,
-                'error': 'Неподдерживаемый формат. Доступны: json, txt, md'
+                'error': f"Неподдерживаемый формат. Доступны: {', '.join(EXPORT_FORMATS)}"
             }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Файл формируется и отдается по частям, сообщения читаются порциями
+        return streaming_export_response(session, export_format, compress=compress)
             
     except Exception as e:
         return Response({
@@ -0,0 +1,262 @@
+"""
+Групповая запись сообщений (write-behind).
+
+При пиковой нагрузке каждый запрос делает свою маленькую транзакцию с
+INSERT сообщения и UPDATE сессии, и база тратит время в основном на
+фиксацию. В режиме write-behind сообщения ставятся в очередь процесса, а
+фоновый поток записывает их пачками - по размеру или по возрасту первой
+записи: один bulk_create и одно объединенное обновление счетчиков на сессию
+в одной транзакции.
+
+Режим включается настройкой и по умолчанию выключен:
+
+    CHAT_HISTORY_WRITE_BEHIND = {
+        'enabled': True,
+        'max_batch': 200,       # сообщений в одной транзакции
+        'max_delay_ms': 5,      # сколько ждать пополнения пачки
+        'ack': 'commit',        # 'commit' - ответ после фиксации транзакции,
+                                # 'queued' - сразу после постановки в очередь
+        'ack_timeout': 10,      # секунд ожидания фиксации в режиме 'commit'
+    }
+
+В режиме 'commit' запрос получает ответ только после фиксации пачки (или
+ошибку), так что подтвержденное сообщение не теряется. Если за ack_timeout
+пачка не записана, сообщение снимается с очереди и запрос завершается
+ошибкой - повтор не создаст дубль; пачку, которая уже пишется, ждем до
+конца. Режим 'queued' быстрее, но при аварийном завершении процесса
+последние миллисекунды записей пропадут, а ошибки записи видны только в
+логе chat_history.writebehind. Очередь дописывается при штатной остановке
+(atexit).
+
+Внутри открытой транзакции (ATOMIC_REQUESTS и т.п.) сообщение пишется
+напрямую: фоновый поток не видит незафиксированных данных запроса.
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import ChatMessage, ChatSession
+
+
+DEFAULTS = {'enabled': False, 'max_batch': 200, 'max_delay_ms': 5, 'ack': 'commit', 'ack_timeout': 10}
+
+logger = logging.getLogger('chat_history.writebehind')
+
+
+def get_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'CHAT_HISTORY_WRITE_BEHIND', None) or {})
+    return options
+
+
+class Ticket:
+    """Подтверждение записи одного сообщения"""
+
+    def __init__(self, message, detached=False):
+        self.message = message
+        # Результат никто не ждет (ack='queued') - ошибки только в лог
+        self.detached = detached
+        self.error = None
+        self.done = threading.Event()
+        # Для async-ожидания без занятого потока (asyncio.wrap_future)
+        self.future = concurrent.futures.Future()
+        self.queue = None
+
+    def resolve(self, error=None):
+        self.error = error
+        self.done.set()
+        if error is None:
+            self.future.set_result(self.message)
+        else:
+            self.future.set_exception(error)
+
+    def wait(self, timeout=None):
+        """
+        Ждет фиксации; возвращает сообщение или пробрасывает ошибку записи.
+        По таймауту сообщение снимается с очереди; если пачка уже пишется,
+        ждет ее фиксации или отката.
+        """
+        if not self.done.wait(timeout):
+            if self.queue is not None and self.queue.cancel(self):
+                raise TimeoutError('Сообщение не записано за отведенное время')
+            self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.message
+
+    async def await_commit(self, timeout=None):
+        """То же, что wait, для async-кода: поток на время ожидания не занимается"""
+        future = asyncio.wrap_future(self.future)
+        try:
+            # shield: отмена по таймауту не должна отменять сам результат
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if self.queue is not None and self.queue.cancel(self):
+                raise TimeoutError('Сообщение не записано за отведенное время')
+        return await future
+
+
+class WriteBehindQueue:
+    """Очередь сообщений процесса и фоновый поток, записывающий их пачками"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = []
+        self.thread = None
+        self.pid = None
+        self.stopping = False
+        self.batches = 0
+        self.written = 0
+
+    def submit(self, message, detached=False):
+        options = get_options()
+        ticket = Ticket(message, detached)
+        ticket.queue = self
+        with self.condition:
+            self._ensure_thread()
+            self.pending.append((time.monotonic(), ticket))
+            if len(self.pending) in (1, options['max_batch']):
+                self.condition.notify_all()
+        return ticket
+
+    def cancel(self, ticket):
+        """Снимает сообщение с очереди; False, если его пачка уже пишется"""
+        with self.condition:
+            for position, (_, pending) in enumerate(self.pending):
+                if pending is ticket:
+                    del self.pending[position]
+                    return True
+        return False
+
+    def _ensure_thread(self):
+        # После fork (gunicorn --preload) поток родителя в дочернем процессе не существует
+        if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+            return
+        self.pid = os.getpid()
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name='chat-write-behind', daemon=True)
+        self.thread.start()
+
+    def _take_batch(self):
+        """Ждет, пока пачка наберется или первая запись состарится; под self.condition"""
+        while not self.pending:
+            if self.stopping:
+                return None
+            self.condition.wait()
+        options = get_options()
+        deadline = self.pending[0][0] + options['max_delay_ms'] / 1000
+        while len(self.pending) < options['max_batch'] and not self.stopping:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.condition.wait(remaining)
+        batch = [ticket for _, ticket in self.pending[:options['max_batch']]]
+        del self.pending[:len(batch)]
+        return batch
+
+    def _run(self):
+        while True:
+            with self.condition:
+                batch = self._take_batch()
+            if batch is None:
+                break
+            # Пачка пуста, если все ее сообщения сняты по таймауту
+            if batch:
+                self.flush(batch)
+        close_old_connections()
+
+    def flush(self, tickets):
+        close_old_connections()
+        try:
+            write_batch([ticket.message for ticket in tickets])
+        except Exception:
+            # Пачка откатилась целиком - пишем по одному, чтобы ошибка
+            # одного сообщения не отклонила остальные
+            for ticket in tickets:
+                ticket.message._state.adding = True
+                try:
+                    ticket.message.save(force_insert=True)
+                except Exception as e:
+                    if ticket.detached:
+                        logger.exception('Сообщение %s не записано', ticket.message.pk)
+                    ticket.resolve(e)
+                else:
+                    ticket.resolve()
+        else:
+            for ticket in tickets:
+                ticket.resolve()
+        with self.condition:
+            self.batches += 1
+            self.written += len(tickets)
+
+    def stop(self, timeout=None):
+        """Дописывает очередь и останавливает поток"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+            thread = self.thread
+        if thread is not None and thread.is_alive() and self.pid == os.getpid():
+            thread.join(timeout)
+
+
+def write_batch(messages):
+    """Один bulk_create и одно обновление счетчиков на сессию в общей транзакции"""
+    by_session = defaultdict(list)
+    for message in messages:
+        by_session[message.session_id].append(message)
+    with transaction.atomic():
+        ChatMessage.objects.bulk_create(messages)
+        for session_messages in by_session.values():
+            ChatSession.register_messages(session_messages[0].session, session_messages)
+
+
+queue = WriteBehindQueue()
+atexit.register(queue.stop)
+
+
+def submit_message(message):
+    """
+    Ставит новое сообщение в очередь, если write-behind включен, иначе
+    сохраняет обычным save(). Возвращает Ticket, если фиксацию нужно
+    дождаться, или None.
+    """
+    options = get_options()
+    if not options['enabled'] or connection.in_atomic_block:
+        message.save()
+        return None
+    if options['ack'] == 'queued':
+        # Для ответа; в базе будет время записи пачки (позже на max_delay_ms)
+        message.created_at = timezone.now()
+        queue.submit(message, detached=True)
+        return None
+    return queue.submit(message)
+
+
+def save_message(message):
+    """Сохраняет новое сообщение (см. submit_message); возвращает его"""
+    ticket = submit_message(message)
+    if ticket is not None:
+        ticket.wait(get_options()['ack_timeout'])
+    return message
+
+
+async def asave_message(message):
+    """
+    save_message для async-представлений. Общий поток sync_to_async занят
+    только постановкой в очередь, а не ожиданием фиксации: иначе запросы
+    шли бы в очередь по одному и никогда не попадали в одну пачку.
+    """
+    ticket = await sync_to_async(submit_message)(message)
+    if ticket is not None:
+        await ticket.await_commit(get_options()['ack_timeout'])
+    return message
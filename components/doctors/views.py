@@ -3,10 +3,11 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
+from api_encoding import CompactEncodingMixin, compact_encoding
 from .models import Doctor
 from .serializers import DoctorProfileSerializer, DoctorScheduleSerializer, DoctorContactsSerializer
 
-class DoctorProfileView(generics.RetrieveUpdateAPIView):
+class DoctorProfileView(CompactEncodingMixin, generics.RetrieveUpdateAPIView):
     serializer_class = DoctorProfileSerializer
     permission_classes = [IsAuthenticated]
     
@@ -32,6 +33,7 @@ class DoctorProfileView(generics.RetrieveUpdateAPIView):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@compact_encoding
 def doctor_schedule(request, pk=None):
     """Получить расписание врача"""
     try:
@@ -127,6 +129,7 @@ def doctor_schedule(request, pk=None):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@compact_encoding
 def doctor_contacts(request, pk=None):
     """Получить дополнительные контакты врача"""
     try:
@@ -159,6 +162,7 @@ def doctor_contacts(request, pk=None):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@compact_encoding
 def doctor_reviews(request, pk=None):
     """Получить отзывы о враче"""
     try:
@@ -190,6 +194,7 @@ def doctor_reviews(request, pk=None):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@compact_encoding
 def doctor_analytics(request, pk=None):
     """Получить аналитику врача"""
     try: